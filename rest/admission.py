@@ -0,0 +1,203 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+Admission control for requests, weighted by the cost of the query.
+
+The cost of a request is measured in bead coordinates read, the number of beads
+in the region multiplied by the number of models. Listing end points are
+charged a flat LIST_COST. Each user has a token bucket that is refilled at a
+fixed rate, and requests above the expensive threshold also need one of a
+limited number of concurrent read slots.
+"""
+
+from __future__ import print_function
+
+import collections
+import threading
+import time
+
+# Cost charged for requests that only read the region indexes
+LIST_COST = 1000
+
+
+def model_cost(beads, models):
+    """
+    Estimated cost of reading a set of models from a region
+
+    Parameters
+    ----------
+    beads : int
+        Number of beads in the region (`j` - `i`)
+    models : int
+        Number of models that are read
+
+    Returns
+    -------
+    int
+    """
+    return max(int(beads) * int(models), 1)
+
+
+class TokenBucket(object):
+    """
+    Token bucket that holds at most `burst` tokens and is refilled at `rate`
+    tokens per second
+    """
+
+    def __init__(self, rate, burst, now):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.stamp = now
+
+    def take(self, cost, now):
+        """
+        Take tokens for a request
+
+        A request that costs more than the burst is let through when the
+        bucket is full, leaving the bucket in debt so that the user then has to
+        wait for it to refill.
+
+        Returns
+        -------
+        float
+            0 if the request was admitted, otherwise the number of seconds
+            until there will be enough tokens
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+        if self.tokens >= min(cost, self.burst):
+            self.tokens -= cost
+            return 0
+        return (min(cost, self.burst) - self.tokens) / self.rate
+
+    def refund(self, cost):
+        """
+        Return the tokens for a request that was not run
+        """
+        self.tokens = min(self.burst, self.tokens + cost)
+
+
+class Ticket(object):
+    """
+    Admission for a single request. Expensive requests hold one of the
+    concurrent read slots until the ticket is released.
+    """
+
+    def __init__(self, slots=None):
+        self._slots = slots
+        self._lock = threading.Lock()
+
+    def release(self):
+        """
+        Free the read slot, it is safe to call this more than once
+        """
+        with self._lock:
+            slots, self._slots = self._slots, None
+        if slots is not None:
+            slots.release()
+
+
+class AdmissionControl(object):
+    """
+    Per user token buckets weighted by the cost of each request, along with a
+    global cap on the number of expensive reads running at the same time
+    """
+
+    def __init__(self, rate=2000000, burst=20000000, max_expensive=4,
+                 expensive_cost=1000000, busy_retry=1, max_clients=10000,
+                 clock=time.time):
+        """
+        Parameters
+        ----------
+        rate : int
+            Bead coordinates per second that each user's bucket is refilled by
+        burst : int
+            Size of each user's bucket
+        max_expensive : int
+            Number of expensive requests that can run at the same time
+        expensive_cost : int
+            Requests that cost at least this much are expensive
+        busy_retry : int
+            Seconds to wait before retrying when all of the expensive read
+            slots are in use
+        max_clients : int
+            Maximum number of buckets held, the least recently used are
+            dropped first
+        clock : function
+            Source of the current time in seconds
+        """
+        self.rate = rate
+        self.burst = burst
+        self.expensive_cost = expensive_cost
+        self.busy_retry = busy_retry
+        self.max_clients = max_clients
+        self.clock = clock
+        self.admitted = 0
+        self.rejected = 0
+        self._buckets = collections.OrderedDict()
+        self._slots = threading.BoundedSemaphore(max_expensive)
+        self._lock = threading.Lock()
+
+    def _bucket(self, client, now):
+        bucket = self._buckets.pop(client, None)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.burst, now)
+            while len(self._buckets) >= self.max_clients:
+                self._buckets.popitem(last=False)
+        self._buckets[client] = bucket
+        return bucket
+
+    def admit(self, client, cost):
+        """
+        Decide whether a request can be run
+
+        Parameters
+        ----------
+        client : str
+            User ID that the request is charged to
+        cost : int
+            Estimated cost of the request
+
+        Returns
+        -------
+        tuple
+            (ticket, retry_after). ticket is None if the request was rejected,
+            in which case retry_after is the number of seconds to wait.
+            The ticket must be released once the request has been served.
+        """
+        with self._lock:
+            now = self.clock()
+            bucket = self._bucket(client, now)
+            retry_after = bucket.take(cost, now)
+            if retry_after:
+                self.rejected += 1
+                return None, retry_after
+
+            if cost < self.expensive_cost:
+                self.admitted += 1
+                return Ticket(), 0
+
+        if not self._slots.acquire(False):
+            with self._lock:
+                bucket.refund(cost)
+                self.rejected += 1
+            return None, self.busy_retry
+
+        with self._lock:
+            self.admitted += 1
+        return Ticket(self._slots), 0
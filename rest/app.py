@@ -17,20 +17,64 @@
 
 from __future__ import print_function
 
+import functools
+import math
 import os
 import sys
+import threading
 
-from flask import Flask, request
+from flask import Flask, Response, request
 from flask_restful import Api, Resource
 
-from reader.hdf5_coord import coord
-
-from mg_rest_util.mg_auth import authorized
+from rest import release
+from rest.admission import LIST_COST, AdmissionControl, model_cost
+from rest.auth_cache import TokenCache, mg_auth_validator
+from rest.metrics import METRICS
+from rest.tracing import span, streamed
+from rest.warmup import WARMUP, parse_target
 
 
 APP = Flask(__name__)
 #app.config['DEBUG'] = False
 
+# Results of validating bearer tokens. The validator can be replaced to use a
+# local stand-in for the auth server.
+AUTH_CACHE = TokenCache(mg_auth_validator, max_size=1024, ttl=300, negative_ttl=10)
+
+# Local catalogue of file locations, resolutions and chromosomes so that
+# listings do not need the DM API or the HDF5 file. Created on first use.
+CATALOGUE = None
+_CATALOGUE_LOCK = threading.Lock()
+
+# Key for signing GetModel cursors when CURSOR_SECRET is not configured
+_CURSOR_SECRET = None
+
+# Background export jobs. Created on first use.
+EXPORTS = None
+_EXPORTS_LOCK = threading.Lock()
+
+# Cost weighted rate limits, created on first use
+ADMISSION = None
+_ADMISSION_LOCK = threading.Lock()
+
+# Serialised and compressed GetModel pages, created on first use
+RESPONSE_CACHE = None
+_RESPONSE_CACHE_LOCK = threading.Lock()
+
+# Thread pool for the federated end points, created on first use
+FEDERATION = None
+_FEDERATION_LOCK = threading.Lock()
+
+# Process pool that builds large GetModel pages, created on first use or by
+# start_offload
+OFFLOAD = None
+_OFFLOAD_LOCK = threading.Lock()
+
+# Background reads of the regions that clients are likely to ask for next,
+# created on first use
+PREFETCHER = None
+_PREFETCHER_LOCK = threading.Lock()
+
 def help_usage(error_message, status_code,
                parameters_required, parameters_provided):
     """
@@ -71,6 +115,15 @@ def help_usage(error_message, status_code,
         'model': ['Model ID', 'str', 'REQUIRED'],
         'page': ['Page number (default: 0)', 'int', 'OPTIONAL'],
         'mpp': ['Models per page (default: 10; max: 100)', 'int', 'OPTIONAL'],
+        'cursor': ['Continuation cursor from a previous page', 'str', 'OPTIONAL'],
+        'format': ['Output format json, pdb, cif or xyz (default: json)', 'str', 'OPTIONAL'],
+        'export_format': ['Archive format npz, pdb or hdf5 (default: npz)', 'str', 'OPTIONAL'],
+        'job_id': ['Export job ID', 'str', 'REQUIRED'],
+        'file_ids': ['Comma separated list of file IDs', 'str', 'REQUIRED'],
+        'estimated_bytes': ['Estimated memory needed for the page', 'int', 'OPTIONAL'],
+        'box': ['Box corners x0,y0,z0,x1,y1,z1', 'str', 'OPTIONAL'],
+        'center': ['Sphere center x,y,z', 'str', 'OPTIONAL'],
+        'radius': ['Sphere radius', 'float', 'OPTIONAL'],
     }
 
     used_param = {k: parameters[k] for k in parameters_required if k in parameters}
@@ -95,9 +148,639 @@ def help_usage(error_message, status_code,
 
     return message
 
-def _get_dm_api(user_id, file_id, resolution=None):
-    cnf_loc = os.path.dirname(os.path.abspath(__file__)) + '/mongodb.cnf'
-    return coord(user_id["user_id"], file_id, resolution, cnf_loc)
+def authorized(func):
+    """
+    Wrap an end point with the authorisation check
+
+    Tokens are validated by AUTH_CACHE, so only the first request with a given
+    token goes to the auth server. The mg_auth module is only imported when
+    the first token is validated so that new workers can start without
+    loading it.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        """
+        Validate the request token and call the end point
+        """
+        name = args[0].__class__.__name__ + '.' + func.__name__ if args else func.__name__
+        with span(name, **{'http.url': request.url}):
+            with span('auth.validate') as current:
+                user_id, hit = AUTH_CACHE.lookup(request.headers.get('Authorization'))
+                current.set_attribute('cached', hit)
+            return func(user_id=user_id, *args, **kwargs)
+    return wrapper
+
+def _data_dir():
+    """
+    Directory for the files written by the service. This is DATA_DIR from the
+    app config or the MG_REST_3D_DATA_DIR environment variable, otherwise a
+    directory within the system temporary directory.
+    """
+    import tempfile
+
+    data_dir = (
+        APP.config.get('DATA_DIR') or os.environ.get('MG_REST_3D_DATA_DIR') or
+        os.path.join(tempfile.gettempdir(), 'mg-rest-3d')
+    )
+    try:
+        os.makedirs(data_dir)
+    except OSError:
+        if not os.path.isdir(data_dir):
+            raise
+    return data_dir
+
+def _get_catalogue():
+    """
+    Get the local catalogue of files, creating it and starting the background
+    refresh on first use. The catalogue is held in CATALOGUE_DB, by default
+    `catalogue.db` within the data directory.
+    """
+    global CATALOGUE  # pylint: disable=global-statement
+    with _CATALOGUE_LOCK:
+        if CATALOGUE is None:
+            from rest import coord_store
+            from rest.catalogue import Catalogue
+
+            cnf_loc = os.path.dirname(os.path.abspath(__file__)) + '/mongodb.cnf'
+
+            def _dm_lookup(user_id, file_id):
+                with span('dm.get_file_path', file_id=file_id):
+                    return coord_store.get_file_path(user_id, file_id, cnf_loc)
+
+            catalogue = Catalogue(
+                APP.config.get('CATALOGUE_DB') or os.path.join(_data_dir(), 'catalogue.db'),
+                _dm_lookup,
+                lambda user_id: coord_store.get_user_files(user_id, cnf_loc)
+            )
+            catalogue.start_refresh(APP.config.get('CATALOGUE_REFRESH', 300))
+            CATALOGUE = catalogue
+    return CATALOGUE
+
+def _get_exports():
+    """
+    Get the export job manager, creating it on first use. Archives are
+    written to EXPORT_DIR, or `exports` within the data directory.
+    """
+    global EXPORTS  # pylint: disable=global-statement
+    with _EXPORTS_LOCK:
+        if EXPORTS is None:
+            from rest.export import ExportManager
+
+            EXPORTS = ExportManager(
+                APP.config.get('EXPORT_DIR') or os.path.join(_data_dir(), 'exports'),
+                APP.config.get('EXPORT_WORKERS', 2),
+                APP.config.get('EXPORT_MAX_AGE', 86400),
+                APP.config.get('EXPORT_MAX_USER_JOBS', 2),
+                APP.config.get('EXPORT_QUOTA_BYTES', 10 * 1024 ** 3)
+            )
+    return EXPORTS
+
+def _get_federation():
+    """
+    Get the thread pool used to query several files at once, creating it on
+    first use
+    """
+    global FEDERATION  # pylint: disable=global-statement
+    with _FEDERATION_LOCK:
+        if FEDERATION is None:
+            from rest.federated import Federation
+
+            FEDERATION = Federation(APP.config.get('FEDERATED_WORKERS', 8))
+    return FEDERATION
+
+def _get_offload():
+    """
+    Get the process pool for building pages, creating it on first use from
+    the OFFLOAD_* settings. Returns None if OFFLOAD_PROCESSES is 0 (the
+    default) and start_offload has not been called.
+    """
+    global OFFLOAD  # pylint: disable=global-statement
+    if OFFLOAD is None and APP.config.get('OFFLOAD_PROCESSES', 0) < 1:
+        return None
+    with _OFFLOAD_LOCK:
+        if OFFLOAD is None:
+            from rest.offload import Offload
+
+            OFFLOAD = Offload(
+                APP.config['OFFLOAD_PROCESSES'], APP.config.get('OFFLOAD_MAX_QUEUE', 32))
+    return OFFLOAD
+
+def _json_settings():
+    """
+    Keyword arguments for json.dumps that match the flask_restful output
+    """
+    settings = dict(APP.config.get('RESTFUL_JSON', {}))
+    if APP.debug:
+        settings.setdefault('indent', 4)
+    return settings
+
+def _get_prefetcher():
+    """
+    Get the prefetch thread pool, creating it on first use from the
+    PREFETCH_* settings. Returns None if PREFETCH_WORKERS is 0.
+    """
+    global PREFETCHER  # pylint: disable=global-statement
+    if APP.config.get('PREFETCH_WORKERS', 2) < 1:
+        return None
+    with _PREFETCHER_LOCK:
+        if PREFETCHER is None:
+            from rest.prefetch import Prefetcher
+
+            PREFETCHER = Prefetcher(
+                workers=APP.config.get('PREFETCH_WORKERS', 2),
+                max_pending=APP.config.get('PREFETCH_MAX_PENDING', 16),
+                max_active=APP.config.get('PREFETCH_MAX_ACTIVE', 4)
+            )
+    return PREFETCHER
+
+def _prefetch(hdf5_store, resolution, region_ids, columns=None):
+    """
+    Read the coordinates of regions into the store in the background. With
+    columns only those models are read, otherwise all of the models in each
+    region.
+    """
+    prefetcher = _get_prefetcher()
+    if prefetcher is None:
+        return
+    models = None if columns is None else (columns[0], columns[-1], len(columns))
+    for region_id in region_ids:
+        prefetcher.submit(
+            (hdf5_store.file_path, hdf5_store.version, resolution, region_id, models),
+            functools.partial(hdf5_store.prefetch_region, resolution, region_id, columns)
+        )
+
+@APP.before_request
+def count_request():
+    """
+    Count the requests in flight so that prefetching backs off under load
+    """
+    if PREFETCHER is not None:
+        PREFETCHER.request_started()
+
+@APP.teardown_request
+def uncount_request(exc):  # pylint: disable=unused-argument
+    """
+    Count a finished request
+    """
+    if PREFETCHER is not None:
+        PREFETCHER.request_finished()
+
+def _get_admission():
+    """
+    Get the admission control, creating it on first use from the ADMISSION_*
+    settings
+    """
+    global ADMISSION  # pylint: disable=global-statement
+    with _ADMISSION_LOCK:
+        if ADMISSION is None:
+            ADMISSION = AdmissionControl(
+                rate=APP.config.get('ADMISSION_RATE', 2000000),
+                burst=APP.config.get('ADMISSION_BURST', 20000000),
+                max_expensive=APP.config.get('ADMISSION_MAX_EXPENSIVE', 4),
+                expensive_cost=APP.config.get('ADMISSION_EXPENSIVE_COST', 1000000),
+                busy_retry=APP.config.get('ADMISSION_BUSY_RETRY', 1)
+            )
+    return ADMISSION
+
+def _admit(user_id, cost):
+    """
+    Charge a request to the user
+
+    Returns
+    -------
+    tuple
+        (ticket, rejection). rejection is a 429 response with a Retry-After
+        header when the request should not be run, otherwise the ticket must
+        be released once the request has been served.
+    """
+    ticket, retry_after = _get_admission().admit(user_id['user_id'], cost)
+    if ticket is None:
+        return None, (
+            help_usage('TooManyRequests', 429, [], {}),
+            429,
+            {'Retry-After': str(int(math.ceil(retry_after)))}
+        )
+    return ticket, None
+
+def _get_response_cache():
+    """
+    Get the cache of serialised responses, creating it on first use. Returns
+    None if RESPONSE_CACHE_BYTES is 0.
+    """
+    global RESPONSE_CACHE  # pylint: disable=global-statement
+    with _RESPONSE_CACHE_LOCK:
+        if RESPONSE_CACHE is None and APP.config.get('RESPONSE_CACHE_BYTES', 64 * 1024 * 1024):
+            from rest.compression import ResponseCache
+
+            RESPONSE_CACHE = ResponseCache(
+                APP.config.get('RESPONSE_CACHE_BYTES', 64 * 1024 * 1024),
+                APP.config.get('COMPRESSION_LEVEL', 6)
+            )
+    return RESPONSE_CACHE
+
+def _cached_json(user_id, hdf5_store, build, admitted=False):
+    """
+    Serve a JSON response from the response cache. On a miss `build` is
+    called to create the data, which is then serialised (unless it is
+    already the bytes of the body) and stored so that
+    later requests for the same URL skip both the read and the serialisation.
+    Unless the request has already been `admitted`, hits are charged
+    LIST_COST, with the ticket released once the response has been sent. The
+    body is returned in the negotiated encoding, and each request is counted
+    once as either a hit or a miss of the cache.
+    """
+    from flask_restful.representations.json import output_json
+    from rest.compression import available_encodings, compress, negotiate
+
+    cache = _get_response_cache()
+    cache_key = (user_id['user_id'], request.url, hdf5_store.file_path, hdf5_store.version)
+    encoding = negotiate(request.headers.get('Accept-Encoding'), available_encodings())
+
+    ticket = None
+    body = cache.get(cache_key) if cache is not None else None
+    if body is None:
+        data = build()
+        if isinstance(data, bytes):
+            body = data
+        elif not isinstance(data, dict):
+            return data
+        else:
+            with span('serialize.json') as current:
+                body = output_json(data, 200).get_data()
+                current.set_attribute('bytes', len(body))
+        if cache is not None:
+            cache.put(cache_key, body)
+    elif not admitted:
+        ticket, rejection = _admit(user_id, LIST_COST)
+        if rejection is not None:
+            return rejection
+
+    headers = {'Vary': 'Accept-Encoding'}
+    if encoding is not None and len(body) >= APP.config.get('COMPRESSION_MIN_SIZE', 1024):
+        with span('compress', encoding=encoding, bytes_in=len(body)) as current:
+            if cache is not None:
+                body = cache.encode(cache_key, body, encoding)
+            else:
+                body = compress(body, encoding, APP.config.get('COMPRESSION_LEVEL', 6))
+            current.set_attribute('bytes_out', len(body))
+        headers['Content-Encoding'] = encoding
+
+    response = Response(body, mimetype='application/json', headers=headers)
+    if ticket is not None:
+        response.call_on_close(ticket.release)
+    return response
+
+@APP.after_request
+def compress_response(response):
+    """
+    Compress responses in the encoding negotiated from the Accept-Encoding
+    header. Files sent directly from disk and bodies smaller than
+    COMPRESSION_MIN_SIZE are left as they are. Streamed responses are
+    compressed a chunk at a time with gzip or deflate.
+    """
+    from rest.compression import (
+        STREAM_ENCODINGS, available_encodings, compress, compress_stream, negotiate)
+
+    if response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return response
+    if response.status_code < 200 or response.status_code in (204, 304):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    level = APP.config.get('COMPRESSION_LEVEL', 6)
+    accept_encoding = request.headers.get('Accept-Encoding')
+
+    if response.is_streamed:
+        encoding = negotiate(accept_encoding, STREAM_ENCODINGS)
+        if encoding is not None:
+            response.response = compress_stream(response.response, encoding, level)
+            response.headers.pop('Content-Length', None)
+            response.headers['Content-Encoding'] = encoding
+        return response
+
+    encoding = negotiate(accept_encoding, available_encodings())
+    data = response.get_data()
+    if encoding is not None and len(data) >= APP.config.get('COMPRESSION_MIN_SIZE', 1024):
+        with span('compress', encoding=encoding, bytes_in=len(data)) as current:
+            response.set_data(compress(data, encoding, level))
+            current.set_attribute('bytes_out', response.content_length)
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+def _get_store(user_id, file_id):
+    """
+    Get the shared handle and region indexes for a file
+    """
+    from rest import coord_store
+
+    with span('catalogue.get_file_path', file_id=file_id):
+        file_path = _get_catalogue().get_file_path(user_id["user_id"], file_id)
+    with span('store.open'):
+        return coord_store.get_store(file_path)
+
+def _cursor_secret(user_id):
+    """
+    Key used to sign the GetModel cursors of a user. CURSOR_SECRET should be
+    set when there are several server processes so that cursors are accepted
+    by all of them, otherwise a key is generated for this process. The key is
+    derived for each user so that a cursor is only valid for the user it was
+    created for.
+    """
+    import hashlib
+    import hmac
+
+    global _CURSOR_SECRET  # pylint: disable=global-statement
+    secret = APP.config.get('CURSOR_SECRET')
+    if secret:
+        secret = secret.encode('utf-8') if not isinstance(secret, bytes) else secret
+    else:
+        if _CURSOR_SECRET is None:
+            _CURSOR_SECRET = os.urandom(32)
+        secret = _CURSOR_SECRET
+    return hmac.new(
+        secret, str(user_id['user_id']).encode('utf-8'), hashlib.sha256).digest()
+
+def _models_payload(hdf5_store, resolution, region_id, columns, precision=None, beads=None,
+                    query_columns=None, with_keyframes=True):
+    """
+    Read a set of models from a region and build the TADbit JSON payload
+    with the coordinates of each model. With a precision the models are sent
+    as residuals against the centroids of the clusters of `query_columns`,
+    with the keyframes left out unless with_keyframes is set. With a (first,
+    last) range of beads only those beads are read.
+    """
+    with span('payload.build', region=region_id, models=len(columns)):
+        return _build_models_payload(
+            hdf5_store, resolution, region_id, columns, precision, beads,
+            query_columns, with_keyframes)
+
+
+def _build_models_payload(hdf5_store, resolution, region_id, columns, precision, beads,
+                          query_columns, with_keyframes):
+    from rest.formats import json_models, split_header
+
+    payload, tail = split_header(hdf5_store.get_model_header(resolution, region_id))
+
+    if precision is not None:
+        from rest.residual import encode_page
+
+        payload['encoding'] = {'name': 'residual', 'precision': precision}
+        keyframes, payload['models'] = encode_page(
+            hdf5_store, resolution, region_id, columns, precision, beads,
+            query_columns, with_keyframes)
+        if keyframes is not None:
+            payload['keyframes'] = keyframes
+    else:
+        payload['models'] = json_models(
+            *hdf5_store.get_model_page(resolution, region_id, columns, beads))
+    payload.update(tail)
+    return payload
+
+def _bead_count(region, beads):
+    """
+    Number of beads read from a region for a (first, last) range of beads
+    """
+    if beads is None:
+        return region['j'] - region['i']
+    return beads[1] - beads[0]
+
+def _oversize_page(user_id, hdf5_store, resolution, region_id, columns, mpp, page_bytes,
+                   beads=None, tail=None):
+    """
+    Handle a GetModel page that would need more than MAX_PAGE_BYTES to build.
+    With OVERSIZE_PAGES set to `stream` (the default) the page is streamed as
+    JSON a batch of models at a time, followed by the keys in `tail`. With
+    `refuse` a 413 is returned.
+    """
+    if APP.config.get('OVERSIZE_PAGES', 'stream') != 'stream':
+        METRICS.incr('pages_refused')
+        return help_usage(
+            'ResponseTooLarge', 413, ['mpp'],
+            {'mpp': mpp, 'estimated_bytes': page_bytes}
+        ), 413
+
+    from rest.formats import stream_json
+
+    region = hdf5_store.get_index(resolution).get_region(region_id)
+    ticket, rejection = _admit(user_id, model_cost(_bead_count(region, beads), len(columns)))
+    if rejection is not None:
+        return rejection
+
+    METRICS.incr('pages_streamed')
+    response = Response(
+        streamed('stream.json', stream_json(
+            hdf5_store, resolution, region_id, columns, beads, tail), region=str(region_id)),
+        mimetype='application/json')
+    response.call_on_close(ticket.release)
+    return response
+
+def _page_links(user_id, file_id, resolution, region_id, model_str,
+                hdf5_store, columns, position, mpp, precision=None, beads=None):
+    """
+    Links and query data of a GetModel page. The `_next_page` and
+    `_previous_page` links are cursors holding the file ID, the region and
+    the columns of the models so that following a link goes straight to
+    reading the next hyperslab.
+
+    Returns
+    -------
+    tuple
+        (_links, query_data) dicts
+    """
+    from rest.cursor import encode_columns, encode_cursor
+
+    model_count = len(columns)
+    page_count = (model_count + mpp - 1) // mpp
+    page = position // mpp + 1
+
+    links = {
+        '_self': request.url,
+        '_parent': request.url_root + 'mug/api/3dcoord',
+    }
+
+    query_data = {
+        'model_count': model_count,
+        'page_count': page_count,
+        'page': page,
+        'mpp': mpp
+    }
+    if beads is not None:
+        query_data['bead_from'], query_data['bead_to'] = beads
+
+    state = {
+        'id': file_id, 't': hdf5_store.mtime, 'r': resolution, 'g': region_id,
+        'm': model_str, 'c': encode_columns(columns), 'n': mpp
+    }
+    if precision is not None:
+        # The keyframes are sent with this page and not with the pages that
+        # the cursors lead to
+        state['q'] = precision
+        state['k'] = 1
+    if beads is not None:
+        state['b'] = list(beads)
+    cursor_url = request.url_root + 'mug/api/3dcoord/model?cursor='
+    if page < page_count:
+        state['p'] = position + mpp
+        links['_next_page'] = cursor_url + encode_cursor(state, _cursor_secret(user_id))
+    if page > 1:
+        state['p'] = max(0, position - mpp)
+        links['_previous_page'] = cursor_url + encode_cursor(state, _cursor_secret(user_id))
+
+    return links, query_data
+
+def _model_page(user_id, file_id, resolution, region_id, model_str,
+                hdf5_store, columns, position, mpp, precision=None, beads=None,
+                with_keyframes=True):
+    """
+    Build a page of models for GetModel along with the cursors for the
+    neighbouring pages. Pages over MAX_PAGE_BYTES are streamed in the default
+    encoding with the same links and query data. Pages of at least
+    OFFLOAD_MIN_BYTES are encoded by the offload process pool, if there is
+    one, and returned as the bytes of the body. Residual pages carry the
+    keyframes of the whole query if with_keyframes is set.
+    """
+    from rest.formats import estimate_json_bytes, split_header
+
+    page_columns = columns[position:position+mpp]
+    links, query_data = _page_links(
+        user_id, file_id, resolution, region_id, model_str,
+        hdf5_store, columns, position, mpp, precision, beads)
+
+    region = hdf5_store.get_index(resolution).get_region(region_id)
+    page_bytes = estimate_json_bytes(_bead_count(region, beads), len(page_columns))
+    METRICS.high_water('largest_page_bytes', page_bytes)
+    if page_bytes > APP.config.get('MAX_PAGE_BYTES', 128 * 1024 * 1024):
+        query_data['streamed'] = True
+        return _oversize_page(
+            user_id, hdf5_store, resolution, region_id, page_columns, mpp, page_bytes, beads,
+            {'_links': links, 'query_data': query_data})
+
+    ticket, rejection = _admit(
+        user_id, model_cost(_bead_count(region, beads), len(page_columns)))
+    if rejection is not None:
+        return rejection
+
+    offload = None
+    if precision is None and page_bytes >= APP.config.get('OFFLOAD_MIN_BYTES', 1024 * 1024):
+        offload = _get_offload()
+
+    # With offloading the ticket is held until the body has been built, as
+    # that is where the memory for the page is used
+    try:
+        if offload is not None:
+            from rest.offload import build_json
+
+            models = hdf5_store.get_model_header(resolution, region_id)
+            page_data = hdf5_store.get_model_page(resolution, region_id, page_columns, beads)
+            models['_links'] = links
+            models['query_data'] = query_data
+
+            head, tail = split_header(models)
+            body = offload.build_json(head, tail, page_data[0], page_data[1], _json_settings())
+            if body is None:
+                body = build_json(head, tail, page_data[0], page_data[1], _json_settings())
+        else:
+            models = _models_payload(
+                hdf5_store, resolution, region_id, page_columns, precision, beads,
+                columns, with_keyframes)
+            models['_links'] = links
+            models['query_data'] = query_data
+    finally:
+        ticket.release()
+    METRICS.incr('pages_served')
+    if position + mpp < len(columns):
+        _prefetch(hdf5_store, resolution, [region_id], columns[position+mpp:position+2*mpp])
+
+    if offload is not None:
+        return body
+    return models
+
+def _region_missing(hdf5_store, resolution, region_id):
+    """
+    Whether a resolution or a region is not in a file
+    """
+    return (
+        resolution not in hdf5_store.get_resolutions() or
+        region_id not in hdf5_store.get_index(resolution)
+    )
+
+def _cursor_page(user_id, cursor):
+    """
+    Continue a GetModel query from a cursor without resolving the region or
+    models again. The file is looked up from its ID in the catalogue of the
+    user, so the cursor does not hold its location.
+    """
+    from rest.cursor import decode_columns, decode_cursor
+
+    try:
+        state = decode_cursor(cursor, _cursor_secret(user_id))
+    except ValueError:
+        return help_usage('InvalidCursor', 400, ['cursor'], {'cursor': cursor})
+
+    hdf5_store = _get_store(user_id, state['id'])
+    if hdf5_store.mtime != state['t']:
+        return help_usage('CursorExpired', 410, ['cursor'], {'cursor': cursor})
+
+    return _cached_json(user_id, hdf5_store, lambda: _model_page(
+        user_id, state['id'], state['r'], state['g'], state['m'], hdf5_store,
+        decode_columns(state['c']), state['p'], state['n'], state.get('q'),
+        tuple(state['b']) if 'b' in state else None, not state.get('k')
+    ))
+
+def _federated_params(params_required, optional=()):
+    """
+    Read and check the parameters that are shared by the federated end points
+
+    Returns
+    -------
+    tuple
+        (params, error). params holds the list of file IDs and the integer
+        location parameters, error is the help_usage response when the
+        parameters are not valid.
+    """
+    provided = {
+        name: request.args.get(name) for name in list(params_required) + list(optional)
+    }
+    required = [provided[name] for name in params_required]
+
+    # Display the parameters available
+    if sum([x is None for x in required]) == len(required):
+        return None, help_usage(None, 200, params_required, {})
+
+    # ERROR - one of the required parameters is NoneType
+    if sum([x is not None for x in required]) != len(required):
+        return None, help_usage('MissingParameters', 400, params_required, provided)
+
+    from rest.federated import split_file_ids
+
+    params = dict(provided)
+    params['file_ids'] = split_file_ids(provided['file_ids'])
+    if not params['file_ids']:
+        return None, help_usage('MissingParameters', 400, params_required, provided)
+
+    try:
+        for name in ('res', 'start', 'end'):
+            params[name] = int(params[name])
+        if 'mpp' in params:
+            params['mpp'] = int(params['mpp']) if params['mpp'] is not None else 10
+    except ValueError:
+        # ERROR - one of the parameters is not of integer type
+        return None, help_usage('IncorrectParameterType', 400, params_required, provided)
+
+    return params, None
+
+def _federated_response(results, errors):
+    """
+    Merge the per file results, reporting the files that failed
+    """
+    return {
+        'files': results,
+        'errors': errors,
+        'query_data': {
+            'files_requested': len(results) + len(errors),
+            'files_returned': len(results),
+        }
+    }
 
 
 class GetEndPoints(Resource):
@@ -128,9 +811,15 @@ class GetEndPoints(Resource):
                 '_resolutions': request.url_root + 'mug/api/3dcoord/resolutions',
                 '_chromosomes': request.url_root + 'mug/api/3dcoord/chromosomes',
                 '_regions': request.url_root + 'mug/api/3dcoord/regions',
+                '_locus': request.url_root + 'mug/api/3dcoord/locus',
                 '_models': request.url_root + 'mug/api/3dcoord/models',
                 '_model': request.url_root + 'mug/api/3dcoord/model',
+                '_spatial': request.url_root + 'mug/api/3dcoord/spatial',
+                '_export': request.url_root + 'mug/api/3dcoord/export',
+                '_federated_regions': request.url_root + 'mug/api/3dcoord/federated/regions',
+                '_federated_model': request.url_root + 'mug/api/3dcoord/federated/model',
                 '_ping': request.url_root + 'mug/api/3dcoord/ping',
+                '_metrics': request.url_root + 'mug/api/3dcoord/metrics',
                 '_parent': request.url_root + 'mug/api'
             }
         }
@@ -186,9 +875,15 @@ class GetResolutions(Resource):
                     {'file_id': file_id}
                 )
 
-            hdf5_handle = _get_dm_api(user_id, file_id)
-            resolution_list = hdf5_handle.get_resolutions()
-            hdf5_handle.close()
+            ticket, rejection = _admit(user_id, LIST_COST)
+            if rejection is not None:
+                return rejection
+
+            try:
+                resolution_list = _get_catalogue().get_resolutions(
+                    user_id["user_id"], file_id)
+            finally:
+                ticket.release()
 
             data = {}
 
@@ -283,9 +978,15 @@ class GetChromosomes(Resource):
                     {'file_id': file_id, 'res': resolution}
                 )
 
-            hdf5_handle = _get_dm_api(user_id, file_id, resolution)
-            chromosome_list = hdf5_handle.get_chromosomes()
-            hdf5_handle.close()
+            ticket, rejection = _admit(user_id, LIST_COST)
+            if rejection is not None:
+                return rejection
+
+            try:
+                chromosome_list = _get_catalogue().get_chromosomes(
+                    user_id["user_id"], file_id, resolution)
+            finally:
+                ticket.release()
 
             data = {}
 
@@ -410,9 +1111,15 @@ class GetRegions(Resource):
                     }
                 )
 
-            hdf5_handle = _get_dm_api(user_id, file_id, resolution)
-            region_list = hdf5_handle.get_regions(chr_id, start, end)
-            hdf5_handle.close()
+            ticket, rejection = _admit(user_id, LIST_COST)
+            if rejection is not None:
+                return rejection
+
+            try:
+                region_index = _get_store(user_id, file_id).get_index(resolution)
+                region_list = region_index.get_regions(chr_id, start, end)
+            finally:
+                ticket.release()
 
             data = {}
             regions = []
@@ -445,6 +1152,147 @@ class GetRegions(Resource):
         return help_usage('Forbidden', 403, ['file_id', 'res', 'chrom', 'start', 'end'], {})
 
 
+class GetLocus(Resource):
+    """
+    Class to handle the http requests for returning the regions that cover a
+    chromosomal location at every resolution within a file
+    """
+
+    @authorized
+    def get(self, user_id):
+        """
+        GET List the regions for a location at each resolution
+
+        The regions are found from the region index of each resolution within
+        a single open file, so a viewer can switch resolution without listing
+        the resolutions, chromosomes and regions again.
+
+        Parameters
+        ----------
+        user_id : str
+            User ID
+        file_id : str
+            Identifier of the file to retrieve data from
+        chrom : str
+            Chromosome identifier (1, 2, 3, chr1, chr2, chr3, I, II, III, etc)
+            for the chromosome of interest
+        start : int
+            Start position for a selected region
+        end : int
+            End position for a selected region
+        models : str
+            `true` to include the number of models and clusters in each
+            region (default: false)
+
+        Returns
+        -------
+        file : json
+            JSON file listing, for each resolution, the regions that overlap
+            the location
+
+        Examples
+        --------
+        .. code-block:: none
+           :linenos:
+
+           curl -X GET http://localhost:5001/mug/api/3dcoord/locus?file_id=test_file&chrom=1&start=1&end=1000000&models=true
+
+        """
+        if user_id is not None:
+            file_id = request.args.get('file_id')
+            chr_id = request.args.get('chrom')
+            start = request.args.get('start')
+            end = request.args.get('end')
+            with_models = request.args.get('models', 'false').lower() in ('1', 'true', 'yes')
+
+            params_required = ['file_id', 'chrom', 'start', 'end']
+            params = [user_id, file_id, chr_id, start, end]
+
+            # Display the parameters available
+            if sum([x is None for x in params]) == len(params):
+                return help_usage(None, 200, params_required, {})
+
+            # ERROR - one of the required parameters is NoneType
+            if sum([x is not None for x in params]) != len(params):
+                return help_usage(
+                    'MissingParameters',
+                    400,
+                    params_required,
+                    {
+                        'file_id': file_id,
+                        'chrom': chr_id,
+                        'start': start,
+                        'end': end
+                    }
+                )
+
+            try:
+                start = int(start)
+                end = int(end)
+            except ValueError:
+                # ERROR - one of the parameters is not of integer type
+                return help_usage(
+                    'IncorrectParameterType',
+                    400,
+                    params_required,
+                    {
+                        'file_id': file_id,
+                        'chrom': chr_id,
+                        'start': start,
+                        'end': end
+                    }
+                )
+
+            ticket, rejection = _admit(user_id, LIST_COST)
+            if rejection is not None:
+                return rejection
+
+            try:
+                locus = _get_store(user_id, file_id).get_locus(chr_id, start, end)
+            finally:
+                ticket.release()
+
+            resolutions = []
+            for resolution, region_list in locus:
+                query = '?file_id=' + file_id + '&res=' + str(resolution)
+                regions = []
+                for region_id, region in region_list:
+                    entry = {
+                        'region_id': region_id,
+                        'start': region['start'],
+                        'end': region['end'],
+                        '_links': {
+                            '_models': request.url_root + 'mug/api/3dcoord/models' + query + '&region=' + region_id,
+                            '_models_all': request.url_root + 'mug/api/3dcoord/model' + query + '&region=' + region_id + '&model=all'
+                        }
+                    }
+                    if with_models:
+                        entry['models'] = region['models']
+                        entry['clusters'] = region['clusters']
+                    regions.append(entry)
+                resolutions.append({
+                    'resolution': resolution,
+                    'regions': regions,
+                    '_links': {
+                        '_regions': request.url_root + 'mug/api/3dcoord/regions' + query + '&chrom=' + str(chr_id) + '&start=' + str(start) + '&end=' + str(end)
+                    }
+                })
+
+            return {
+                'chromosome': chr_id,
+                'start': start,
+                'end': end,
+                'resolutions': resolutions,
+                '_links': {
+                    '_self': request.url,
+                    '_parent': request.url_root + 'mug/api/3dcoord',
+                    '_resolution': request.url_root + 'mug/api/3dcoord/resolutions?file_id=' + file_id
+                }
+            }
+
+        return help_usage('Forbidden', 403, ['file_id', 'chrom', 'start', 'end'], {})
+
+
 class GetModels(Resource):
     """
     Class to handle the http requests for returning information about the models
@@ -466,6 +1314,11 @@ class GetModels(Resource):
             Resolution
         region : str
             Region ID
+        model : str
+            Comma separated list of model IDs to list (default: all)
+        cluster : str
+            Comma separated list of cluster IDs. Only the models in these
+            clusters are listed.
 
         Returns
         -------
@@ -485,6 +1338,8 @@ class GetModels(Resource):
             file_id = request.args.get('file_id')
             resolution = request.args.get('res')
             region_id = request.args.get('region')
+            model_str = request.args.get('model')
+            cluster_str = request.args.get('cluster')
 
             params_required = ['file_id', 'res', 'region']
             params = [user_id, file_id, resolution, region_id]
@@ -521,40 +1376,112 @@ class GetModels(Resource):
                     }
                 )
 
-            hdf5_handle = _get_dm_api(user_id, file_id, resolution)
-            model_list = hdf5_handle.get_models(region_id)
-            region_list = hdf5_handle.get_region_order(region=region_id)
-            hdf5_handle.close()
+            ticket, rejection = _admit(user_id, LIST_COST)
+            if rejection is not None:
+                return rejection
+
+            try:
+                hdf5_store = _get_store(user_id, file_id)
+                if _region_missing(hdf5_store, resolution, region_id):
+                    return help_usage(
+                        'NotFound',
+                        404,
+                        params_required,
+                        {
+                            'file_id': file_id,
+                            'res': resolution,
+                            'region': region_id
+                        }
+                    )
+                region_list = hdf5_store.get_index(resolution).get_region_order(region=region_id)
+
+                # Prefetch the regions either side before the cache lookup so
+                # that they are read for cached listings too
+                current_region = region_list.index(region_id)
+                _prefetch(hdf5_store, resolution, [
+                    region_list[k] for k in (current_region + 1, current_region - 1)
+                    if 0 <= k < len(region_list)
+                ])
+
+                return _cached_json(user_id, hdf5_store, lambda: self._model_list(
+                    file_id, resolution, region_id, hdf5_store, region_list,
+                    None if model_str is None else model_str.split(','),
+                    None if cluster_str is None else cluster_str.split(',')
+                ), admitted=True)
+            finally:
+                ticket.release()
+
+        return help_usage('Forbidden', 403, ['file_id', 'res', 'region'], {})
 
-            models = {}
-            models['model_list'] = [
+    @staticmethod
+    def _model_list(file_id, resolution, region_id, hdf5_store, region_list,
+                    model_ids, clusters):
+        """
+        Build the listing from the catalogue of the region. The model IDs,
+        clusters and links are converted from the catalogue arrays in bulk.
+        `region_list` is the order of the regions on the chromosome.
+        """
+        import numpy as np
+
+        catalogue = hdf5_store.get_catalogue(resolution, region_id)
+        columns = catalogue.select(model_ids, clusters)
+
+        refs = catalogue.model_ids[columns].astype(str)
+        model_urls = np.char.add(
+            request.url_root + 'mug/api/3dcoord/model?file_id=' + file_id + '&res=' + str(resolution) + '&region=' + str(region_id) + '&model=',
+            refs)
+
+        models = {}
+        models['model_list'] = [
+            {
+                'model': ref,
+                'cluster': cluster,
+                '_links': {
+                    '_model': model_url
+                }
+            } for ref, cluster, model_url in zip(
+                refs.tolist(), catalogue.cluster_ids[columns].astype(str).tolist(),
+                model_urls.tolist())
+        ]
+
+        model_stats, cluster_stats = hdf5_store.get_model_stats(resolution, region_id)
+        if model_stats is not None:
+            for entry, stats in zip(models['model_list'], model_stats[columns]):
+                entry['stats'] = {
+                    'radius_of_gyration': float(stats['radius_of_gyration']),
+                    'end_to_end': float(stats['end_to_end']),
+                    'bbox': stats['bbox_min'].tolist() + stats['bbox_max'].tolist(),
+                    'density': float(stats['density'])
+                }
+        if cluster_stats is not None:
+            models['cluster_stats'] = [
                 {
-                    'model': str(m[0]),
-                    'cluster': str(m[1]),
-                    '_links': {
-                        '_model': request.url_root + 'mug/api/3dcoord/model?file_id=' + file_id + '&res=' + str(resolution) + '&region=' + str(region_id) + '&model=' + str(m[0])
-                    }
-                } for m in model_list
+                    'cluster': str(stats['cluster']),
+                    'models': int(stats['models']),
+                    'radius_of_gyration': float(stats['radius_of_gyration']),
+                    'radius_of_gyration_std': float(stats['radius_of_gyration_std']),
+                    'end_to_end': float(stats['end_to_end']),
+                    'end_to_end_std': float(stats['end_to_end_std']),
+                    'density': float(stats['density'])
+                } for stats in cluster_stats
             ]
 
-            models['_links'] = {
-                '_self': request.base_url + '?file_id=' + file_id + '&res=' + str(resolution) + '&region=' + str(region_id),
-                '_parent': request.url_root + 'mug/api/3dcoord',
-                '_models_all': request.url_root + 'mug/api/3dcoord/model?file_id=' + file_id + '&res=' + str(resolution) + '&region=' + str(region_id) + '&model=all'
-            }
-
-            current_region = region_list.index(region_id)
-            next_region = current_region+1
-            previous_region = current_region-1
+        models['_links'] = {
+            '_self': request.base_url + '?file_id=' + file_id + '&res=' + str(resolution) + '&region=' + str(region_id),
+            '_parent': request.url_root + 'mug/api/3dcoord',
+            '_models_all': request.url_root + 'mug/api/3dcoord/model?file_id=' + file_id + '&res=' + str(resolution) + '&region=' + str(region_id) + '&model=all'
+        }
 
-            if current_region < (len(region_list)-1):
-                models['_links']['_next_region'] = request.url_root + 'mug/api/3dcoord/models?file_id=' + file_id + '&res=' + str(resolution) + '&region=' + region_list[next_region]
-            if current_region > 0:
-                models['_links']['_previous_region'] = request.url_root + 'mug/api/3dcoord/models?file_id=' + file_id + '&res=' + str(resolution) + '&region=' + region_list[previous_region]
+        current_region = region_list.index(region_id)
+        next_region = current_region+1
+        previous_region = current_region-1
 
-            return models
+        if current_region < (len(region_list)-1):
+            models['_links']['_next_region'] = request.url_root + 'mug/api/3dcoord/models?file_id=' + file_id + '&res=' + str(resolution) + '&region=' + region_list[next_region]
+        if current_region > 0:
+            models['_links']['_previous_region'] = request.url_root + 'mug/api/3dcoord/models?file_id=' + file_id + '&res=' + str(resolution) + '&region=' + region_list[previous_region]
 
-        return help_usage('Forbidden', 403, ['file_id', 'res', 'region'], {})
+        return models
 
 
 class GetModel(Resource):
@@ -581,6 +1508,38 @@ class GetModel(Resource):
             Region ID
         model : str
             model ID
+        cluster : str
+            Comma separated list of cluster IDs. Only the requested models
+            that are in these clusters are returned.
+        page : int
+            Page number (default: 1)
+        mpp : int
+            Models per page (default: 10)
+        cursor : str
+            Continuation cursor from the `_next_page` or `_previous_page`
+            link of a previous page. Replaces all of the other parameters.
+        format : str
+            json (default), pdb, cif or xyz. The structural formats are
+            streamed and include all of the requested models unless page or
+            mpp are given.
+        encoding : str
+            absolute (default) or residual. With residual the centroid of
+            each cluster of the query is sent once in `keyframes` and each
+            model as its difference from that centroid. Pages reached through
+            the `_next_page` and `_previous_page` cursors leave the keyframes
+            out. See `rest.residual` for the decoder.
+        precision : int
+            Quantisation step of the residuals (default: 1, lossless)
+        start : int
+            Genomic start of the beads to return. Bead `k` of a region covers
+            the region start + k * res up to the start of the next bead.
+        end : int
+            Genomic end of the beads to return
+        bead_from : int
+            First bead to return, counting from 0. Ignored if start or end
+            are given.
+        bead_to : int
+            Bead after the last one to return
 
         Returns
         -------
@@ -603,8 +1562,19 @@ class GetModel(Resource):
             model_str = request.args.get('model')
             page = request.args.get('page')
             mpp = request.args.get('mpp')
+            cursor = request.args.get('cursor')
+            output_format = request.args.get('format', 'json')
+            encoding = request.args.get('encoding', 'absolute')
+            precision = request.args.get('precision', '1')
+            cluster_str = request.args.get('cluster')
+            bead_range = [
+                request.args.get(name) for name in ('start', 'end', 'bead_from', 'bead_to')]
 
             params_required = ['file_id', 'res', 'region', 'model']
+
+            if cursor is not None:
+                return _cursor_page(user_id, cursor)
+
             params = [user_id, file_id, resolution, region_id, model_str]
 
             # Display the parameters available
@@ -625,6 +1595,40 @@ class GetModel(Resource):
                     }
                 )
 
+            from rest.formats import FORMATS
+
+            if output_format != 'json' and output_format not in FORMATS:
+                return help_usage(
+                    'UnsupportedFormat',
+                    400,
+                    params_required,
+                    {
+                        'file_id': file_id,
+                        'res': resolution,
+                        'region': region_id,
+                        'model': model_str,
+                        'format': output_format
+                    }
+                )
+
+            if encoding not in ('absolute', 'residual') or (
+                    encoding == 'residual' and output_format != 'json'):
+                return help_usage(
+                    'UnsupportedEncoding',
+                    400,
+                    params_required,
+                    {
+                        'file_id': file_id,
+                        'res': resolution,
+                        'region': region_id,
+                        'model': model_str,
+                        'format': output_format,
+                        'encoding': encoding
+                    }
+                )
+
+            paged = page is not None or mpp is not None
+
             if page is None:
                 page = 1
 
@@ -635,6 +1639,8 @@ class GetModel(Resource):
                 resolution = int(resolution)
                 page = int(page)
                 mpp = int(mpp)
+                precision = int(precision)
+                bead_range = [None if x is None else int(x) for x in bead_range]
             except ValueError:
                 # ERROR - one of the parameters is not of integer type
                 return help_usage(
@@ -645,42 +1651,662 @@ class GetModel(Resource):
                         'file_id': file_id,
                         'res': resolution,
                         'region': region_id,
-                        'model': model_str
+                        'model': model_str,
+                        'precision': precision,
+                        'start': bead_range[0],
+                        'end': bead_range[1],
+                        'bead_from': bead_range[2],
+                        'bead_to': bead_range[3]
                     }
                 )
 
+            if precision < 1:
+                precision = 1
+
             if page < 1:
                 page = 1
 
-            hdf5_handle = _get_dm_api(user_id, file_id, resolution)
-
-            model_ids = model_str.split(',')
-            models, model_meta = hdf5_handle.get_model(region_id, model_ids, page-1, mpp)
-            hdf5_handle.close()
-
-            models['_links'] = {
-                '_self': request.base_url + '?file_id=' + file_id + '&res=' + str(resolution) + '&region=' + str(region_id) + '&model=' + str(model_str) + '&mpp=' + str(mpp) + '&page=' +str(page),
-                '_parent': request.url_root + 'mug/api/3dcoord',
-            }
-
-            models['query_data'] = {
-                'model_count': model_meta['model_count'],
-                'page_count': model_meta['page_count'],
-                'page': page,
-                'mpp': mpp
-            }
+            if mpp < 1:
+                mpp = 1
 
-            if (page) < model_meta['page_count']:
-                models['_links']['_next_page'] = request.url_root + 'mug/api/3dcoord/model?file_id=' + file_id + '&res=' + str(resolution) + '&region=' + str(region_id) + '&model=' + str(model_str) + '&mpp=' + str(mpp) + '&page=' +str(page+1)
-            if (page) > 1:
-                models['_links']['_previous_page'] = request.url_root + 'mug/api/3dcoord/model?file_id=' + file_id + '&res=' + str(resolution) + '&region=' + str(region_id) + '&model=' + str(model_str) + '&mpp=' + str(mpp) + '&page=' +str(page-1)
+            hdf5_store = _get_store(user_id, file_id)
+            columns = hdf5_store.get_model_columns(
+                resolution, region_id, model_str.split(','),
+                None if cluster_str is None else cluster_str.split(','))
 
-            return models
+            page = min(page, max(1, (len(columns) + mpp - 1) // mpp))
 
-        return help_usage('Forbidden', 403, ['file_id', 'res', 'region', 'model'], {})
-
-
-class Ping(Resource):
+            try:
+                beads = hdf5_store.get_bead_range(resolution, region_id, *bead_range)
+            except ValueError:
+                return help_usage(
+                    'InvalidRange',
+                    400,
+                    params_required,
+                    {
+                        'file_id': file_id,
+                        'res': resolution,
+                        'region': region_id,
+                        'model': model_str,
+                        'start': bead_range[0],
+                        'end': bead_range[1],
+                        'bead_from': bead_range[2],
+                        'bead_to': bead_range[3]
+                    }
+                )
+
+            if output_format in FORMATS:
+                from rest.formats import stream_models
+
+                if paged:
+                    columns = columns[(page-1) * mpp:page * mpp]
+
+                region = hdf5_store.get_index(resolution).get_region(region_id)
+                ticket, rejection = _admit(
+                    user_id, model_cost(_bead_count(region, beads), len(columns)))
+                if rejection is not None:
+                    return rejection
+
+                response = Response(
+                    streamed('stream.' + output_format, stream_models(
+                        output_format, hdf5_store, resolution, region_id, columns, beads
+                    ), region=str(region_id)),
+                    mimetype=FORMATS[output_format],
+                    headers={
+                        'Content-Disposition':
+                            'attachment; filename=' + str(region_id) + '.' + output_format
+                    }
+                )
+                response.call_on_close(ticket.release)
+                return response
+
+            return _cached_json(user_id, hdf5_store, lambda: _model_page(
+                user_id, file_id, resolution, region_id, model_str,
+                hdf5_store, columns, (page-1) * mpp, mpp,
+                precision if encoding == 'residual' else None, beads
+            ))
+
+        return help_usage('Forbidden', 403, ['file_id', 'res', 'region', 'model'], {})
+
+
+class GetSpatial(Resource):
+    """
+    Class to handle the http requests for returning the beads of the models in
+    a region that fall within a 3D box or sphere
+    """
+
+    @authorized
+    def get(self, user_id):
+        """
+        GET List the beads within a 3D box or sphere
+
+        Either `box` or both `center` and `radius` need to be given. The query
+        uses a grid over the coordinates of all of the models in the region
+        that is built on first use and kept by the server. Coordinates need to
+        be finite, each lower bound of the box no more than its upper bound
+        and the radius at least 0.
+
+        Parameters
+        ----------
+        user_id : str
+            User ID
+        file_id : str
+            Identifier of the file to retrieve data from
+        res : int
+            Resolution
+        region : str
+            Region ID
+        model : str
+            Comma separated list of model IDs or `all`
+        box : str
+            x0,y0,z0,x1,y1,z1 corners of the box
+        center : str
+            x,y,z center of the sphere
+        radius : float
+            Radius of the sphere
+
+        Returns
+        -------
+        file : json
+            JSON file listing, for each model with beads inside the box or
+            sphere, the bead numbers (from 0) and their coordinates
+
+        Examples
+        --------
+        .. code-block:: none
+           :linenos:
+
+           curl -X GET http://localhost:5001/mug/api/3dcoord/spatial?file_id=test_file&res=10000&region=region_1&model=all&center=0,0,0&radius=500
+
+        """
+        params_required = ['file_id', 'res', 'region', 'model', 'box', 'center', 'radius']
+
+        if user_id is not None:
+            file_id = request.args.get('file_id')
+            resolution = request.args.get('res')
+            region_id = request.args.get('region')
+            model_str = request.args.get('model')
+            box = request.args.get('box')
+            center = request.args.get('center')
+            radius = request.args.get('radius')
+
+            provided = {
+                'file_id': file_id,
+                'res': resolution,
+                'region': region_id,
+                'model': model_str,
+                'box': box,
+                'center': center,
+                'radius': radius
+            }
+            params = [file_id, resolution, region_id, model_str]
+
+            # Display the parameters available
+            if sum([x is None for x in params + [box, center, radius]]) == len(params) + 3:
+                return help_usage(None, 200, params_required, {})
+
+            # ERROR - one of the required parameters is NoneType
+            if sum([x is not None for x in params]) != len(params) or (
+                    box is None and (center is None or radius is None)):
+                return help_usage('MissingParameters', 400, params_required, provided)
+
+            try:
+                resolution = int(resolution)
+                if box is not None:
+                    box = [float(x) for x in box.split(',')]
+                    values = box
+                else:
+                    center = [float(x) for x in center.split(',')]
+                    radius = float(radius)
+                    values = center + [radius]
+                if any(math.isinf(x) or math.isnan(x) for x in values):
+                    raise ValueError('Coordinates need to be finite')
+            except ValueError:
+                # ERROR - one of the parameters is not of the right type
+                return help_usage('IncorrectParameterType', 400, params_required, provided)
+
+            if (box is not None and len(box) != 6) or (box is None and len(center) != 3):
+                return help_usage('IncorrectParameterType', 400, params_required, provided)
+
+            if (box is not None and any(box[k] > box[k + 3] for k in range(3))) or (
+                    box is None and radius < 0):
+                # ERROR - the box is inside out or the radius is negative
+                return help_usage('InvalidRange', 400, params_required, provided)
+
+            hdf5_store = _get_store(user_id, file_id)
+            if _region_missing(hdf5_store, resolution, region_id):
+                return help_usage('NotFound', 404, params_required, provided)
+            region = hdf5_store.get_index(resolution).get_region(region_id)
+            columns = hdf5_store.get_model_columns(
+                resolution, region_id, model_str.split(','))
+
+            ticket, rejection = _admit(
+                user_id, model_cost(region['j'] - region['i'], len(columns)))
+            if rejection is not None:
+                return rejection
+
+            try:
+                grid = hdf5_store.get_spatial_index(resolution, region_id)
+                if box is not None:
+                    point_ids = grid.query_box(box[0:3], box[3:6])
+                else:
+                    point_ids = grid.query_sphere(center, radius)
+            finally:
+                ticket.release()
+
+            model_params = hdf5_store.get_models(resolution, region_id)
+            models = []
+            bead_count = 0
+            for col, beads, coords in grid.group_by_model(point_ids, columns):
+                bead_count += len(beads)
+                models.append({
+                    'ref': str(model_params[col][0]),
+                    'cluster': str(model_params[col][1]),
+                    'beads': beads.tolist(),
+                    'data': coords.ravel().tolist()
+                })
+
+            return {
+                'metadata': {
+                    'region_id': region_id,
+                    'resolution': resolution,
+                    'chromosome': region['chromosome'],
+                    'start': region['start'],
+                    'end': region['end']
+                },
+                'models': models,
+                'query_data': {
+                    'model_count': len(columns),
+                    'models_found': len(models),
+                    'bead_count': bead_count
+                },
+                '_links': {
+                    '_self': request.url,
+                    '_parent': request.url_root + 'mug/api/3dcoord'
+                }
+            }
+
+        return help_usage('Forbidden', 403, params_required, {})
+
+
+class GetExport(Resource):
+    """
+    Class to handle the http requests for exporting all of the models at a
+    given resolution. Exports run as background jobs that write an archive
+    that can then be downloaded.
+    """
+
+    @staticmethod
+    def _job_links(job_id):
+        return {
+            '_self': request.url_root + 'mug/api/3dcoord/export?job_id=' + job_id,
+            '_download': request.url_root + 'mug/api/3dcoord/export/download?job_id=' + job_id,
+            '_parent': request.url_root + 'mug/api/3dcoord'
+        }
+
+    @authorized
+    def post(self, user_id):
+        """
+        POST Queue an export of all models at a resolution
+
+        Parameters
+        ----------
+        user_id : str
+            User ID
+        file_id : str
+            Identifier of the file to retrieve data from
+        res : int
+            Resolution
+        export_format : str
+            npz (default), pdb or hdf5
+
+        Returns
+        -------
+        file : json
+            Status of the queued job with links to check its progress and to
+            download the archive. The export is charged to the user by
+            admission control as a read of every model at the resolution. A
+            user can have EXPORT_MAX_USER_JOBS unfinished exports and new
+            exports are refused once the archives would take the export
+            directory over EXPORT_QUOTA_BYTES.
+
+        Examples
+        --------
+        .. code-block:: none
+           :linenos:
+
+           curl -X POST "http://localhost:5001/mug/api/3dcoord/export?file_id=test_file&res=1000000&export_format=npz"
+
+        """
+        if user_id is not None:
+            from rest.export import EXPORT_FORMATS
+
+            file_id = request.args.get('file_id')
+            resolution = request.args.get('res')
+            export_format = request.args.get('export_format', 'npz')
+
+            params_required = ['file_id', 'res', 'export_format']
+            params = [user_id, file_id, resolution]
+
+            # ERROR - one of the required parameters is NoneType
+            if sum([x is not None for x in params]) != len(params):
+                return help_usage(
+                    'MissingParameters',
+                    400,
+                    params_required,
+                    {'file_id': file_id, 'res': resolution}
+                )
+
+            try:
+                resolution = int(resolution)
+            except ValueError:
+                # ERROR - one of the parameters is not of integer type
+                return help_usage(
+                    'IncorrectParameterType',
+                    400,
+                    params_required,
+                    {'file_id': file_id, 'res': resolution}
+                )
+
+            if export_format not in EXPORT_FORMATS:
+                return help_usage(
+                    'UnsupportedFormat',
+                    400,
+                    params_required,
+                    {'file_id': file_id, 'res': resolution, 'export_format': export_format}
+                )
+
+            from rest.export import BYTES_PER_COORD, export_cost
+
+            hdf5_store = _get_store(user_id, file_id)
+            if resolution not in hdf5_store.get_resolutions():
+                return help_usage(
+                    'NotFound',
+                    404,
+                    params_required,
+                    {'file_id': file_id, 'res': resolution}
+                )
+
+            cost = export_cost(hdf5_store, resolution)
+            ticket, rejection = _admit(user_id, cost)
+            if rejection is not None:
+                return rejection
+
+            try:
+                job = _get_exports().submit(
+                    user_id["user_id"], file_id, hdf5_store.file_path, resolution,
+                    export_format, cost * BYTES_PER_COORD)
+            except IOError as err:
+                status = 429 if str(err) == 'TooManyExports' else 507
+                return help_usage(
+                    str(err),
+                    status,
+                    params_required,
+                    {'file_id': file_id, 'res': resolution, 'export_format': export_format}
+                ), status
+            finally:
+                ticket.release()
+
+            data = job.report()
+            data['_links'] = self._job_links(job.job_id)
+            return data, 202
+
+        return help_usage('Forbidden', 403, ['file_id', 'res', 'export_format'], {})
+
+    @authorized
+    def get(self, user_id):
+        """
+        GET Status of an export job
+
+        Parameters
+        ----------
+        user_id : str
+            User ID
+        job_id : str
+            Identifier of the export job
+
+        Returns
+        -------
+        file : json
+            Status of the job
+
+        Examples
+        --------
+        .. code-block:: none
+           :linenos:
+
+           curl -X GET http://localhost:5001/mug/api/3dcoord/export?job_id=abc123
+
+        """
+        if user_id is not None:
+            job_id = request.args.get('job_id')
+
+            # Display the parameters available
+            if job_id is None:
+                return help_usage(
+                    None, 200, ['file_id', 'res', 'export_format', 'job_id'], {})
+
+            job = _get_exports().get(job_id, user_id["user_id"])
+            if job is None:
+                return help_usage('NotFound', 404, ['job_id'], {'job_id': job_id})
+
+            data = job.report()
+            data['_links'] = self._job_links(job_id)
+            return data
+
+        return help_usage('Forbidden', 403, ['job_id'], {})
+
+
+class GetExportDownload(Resource):
+    """
+    Class to handle the http requests for downloading a finished export
+    """
+
+    @authorized
+    def get(self, user_id):
+        """
+        GET Download the archive of a finished export job
+
+        Parameters
+        ----------
+        user_id : str
+            User ID
+        job_id : str
+            Identifier of the export job
+
+        Returns
+        -------
+        file
+            The archive
+
+        Examples
+        --------
+        .. code-block:: none
+           :linenos:
+
+           curl -X GET http://localhost:5001/mug/api/3dcoord/export/download?job_id=abc123 -o export.npz
+
+        """
+        if user_id is not None:
+            from flask import send_file
+
+            job_id = request.args.get('job_id')
+
+            # Display the parameters available
+            if job_id is None:
+                return help_usage(None, 200, ['job_id'], {})
+
+            job = _get_exports().get(job_id, user_id["user_id"])
+            if job is None:
+                return help_usage('NotFound', 404, ['job_id'], {'job_id': job_id})
+
+            if job.status != 'done':
+                return help_usage('NotReady', 409, ['job_id'], {'job_id': job_id})
+
+            return send_file(job.output, as_attachment=True)
+
+        return help_usage('Forbidden', 403, ['job_id'], {})
+
+
+class GetFederatedRegions(Resource):
+    """
+    Class to handle the http requests for returning the regions that overlap a
+    chromosomal location in each of several files
+    """
+
+    @authorized
+    def get(self, user_id):
+        """
+        GET List the regions for a location across several files
+
+        The files are queried in parallel. A file that fails or does not
+        respond within FEDERATED_TIMEOUT seconds is listed under `errors` and
+        the results from the other files are still returned.
+
+        Parameters
+        ----------
+        user_id : str
+            User ID
+        file_ids : str
+            Comma separated list of the files to retrieve data from
+        res : int
+            Resolution
+        chrom : str
+            Chromosome identifier (1, 2, 3, chr1, chr2, chr3, I, II, III, etc)
+            for the chromosome of interest
+        start : int
+            Start position for a selected region
+        end : int
+            End position for a selected region
+
+        Returns
+        -------
+        file : json
+            JSON file listing the regions for each of the files, keyed by
+            file ID
+
+        Examples
+        --------
+        .. code-block:: none
+           :linenos:
+
+           curl -X GET http://localhost:5001/mug/api/3dcoord/federated/regions?file_ids=file_a,file_b&res=1000000&chrom=1&start=1&end=1000000
+
+        """
+        params_required = ['file_ids', 'res', 'chrom', 'start', 'end']
+
+        if user_id is not None:
+            params, error = _federated_params(params_required)
+            if error is not None:
+                return error
+
+            ticket, rejection = _admit(user_id, LIST_COST * len(params['file_ids']))
+            if rejection is not None:
+                return rejection
+
+            url_root = request.url_root
+
+            def _file_regions(file_id):
+                region_index = _get_store(user_id, file_id).get_index(params['res'])
+                regions = []
+                for region_id in region_index.get_regions(
+                        params['chrom'], params['start'], params['end']):
+                    region = region_index.get_region(region_id)
+                    regions.append({
+                        'region_id': region_id,
+                        'chromosome': region['chromosome'],
+                        'start': region['start'],
+                        'end': region['end'],
+                        'models': region['models'],
+                        '_links': {
+                            '_models': url_root + 'mug/api/3dcoord/models?file_id=' + file_id + '&res=' + str(params['res']) + '&region=' + region_id
+                        }
+                    })
+                return regions
+
+            try:
+                results, errors = _get_federation().run(
+                    _file_regions, params['file_ids'], APP.config.get('FEDERATED_TIMEOUT', 30))
+            finally:
+                ticket.release()
+
+            data = _federated_response(results, errors)
+            data['resolution'] = params['res']
+            data['chromosome'] = params['chrom']
+            data['_links'] = {
+                '_self': request.url,
+                '_parent': request.url_root + 'mug/api/3dcoord'
+            }
+            return data
+
+        return help_usage('Forbidden', 403, params_required, {})
+
+
+class GetFederatedModel(Resource):
+    """
+    Class to handle the http requests for returning the models from the
+    regions that overlap a chromosomal location in each of several files
+    """
+
+    @authorized
+    def get(self, user_id):
+        """
+        GET List the models for a location across several files
+
+        The files are queried in parallel. A file that fails or does not
+        respond within FEDERATED_TIMEOUT seconds is listed under `errors` and
+        the results from the other files are still returned.
+
+        Parameters
+        ----------
+        user_id : str
+            User ID
+        file_ids : str
+            Comma separated list of the files to retrieve data from
+        res : int
+            Resolution
+        chrom : str
+            Chromosome identifier (1, 2, 3, chr1, chr2, chr3, I, II, III, etc)
+            for the chromosome of interest
+        start : int
+            Start position for a selected region
+        end : int
+            End position for a selected region
+        model : str
+            Comma separated list of model IDs or `all`
+        mpp : int
+            Maximum number of models returned for each region (default: 10)
+
+        Returns
+        -------
+        file : json
+            JSON file listing the models of each overlapping region for each
+            of the files, keyed by file ID
+
+        Examples
+        --------
+        .. code-block:: none
+           :linenos:
+
+           curl -X GET http://localhost:5001/mug/api/3dcoord/federated/model?file_ids=file_a,file_b&res=1000000&chrom=1&start=1&end=1000000&model=all&mpp=5
+
+        """
+        params_required = ['file_ids', 'res', 'chrom', 'start', 'end', 'model']
+
+        if user_id is not None:
+            params, error = _federated_params(params_required, ['mpp'])
+            if error is not None:
+                return error
+
+            model_ids = params['model'].split(',')
+            mpp = max(1, min(params['mpp'], 100))
+
+            from rest.formats import estimate_json_bytes
+
+            def _file_models(file_id):
+                hdf5_store = _get_store(user_id, file_id)
+                region_index = hdf5_store.get_index(params['res'])
+                selected = []
+                cost = 0
+                page_bytes = 0
+                for region_id in region_index.get_regions(
+                        params['chrom'], params['start'], params['end']):
+                    region = region_index.get_region(region_id)
+                    columns = hdf5_store.get_model_columns(
+                        params['res'], region_id, model_ids)[:mpp]
+                    selected.append((region_id, columns))
+                    cost += model_cost(region['j'] - region['i'], len(columns))
+                    page_bytes += estimate_json_bytes(region['j'] - region['i'], len(columns))
+
+                if page_bytes > APP.config.get('MAX_PAGE_BYTES', 128 * 1024 * 1024):
+                    METRICS.incr('pages_refused')
+                    raise IOError('ResponseTooLarge')
+
+                ticket, _ = _get_admission().admit(user_id['user_id'], cost)
+                if ticket is None:
+                    raise IOError('TooManyRequests')
+                try:
+                    return [
+                        _models_payload(hdf5_store, params['res'], region_id, columns)
+                        for region_id, columns in selected
+                    ]
+                finally:
+                    ticket.release()
+
+            results, errors = _get_federation().run(
+                _file_models, params['file_ids'], APP.config.get('FEDERATED_TIMEOUT', 30))
+
+            data = _federated_response(results, errors)
+            data['_links'] = {
+                '_self': request.url,
+                '_parent': request.url_root + 'mug/api/3dcoord'
+            }
+            return data
+
+        return help_usage('Forbidden', 403, params_required, {})
+
+
+class Ping(Resource):
     """
     Class to handle the http requests to ping a service
     """
@@ -693,6 +2319,10 @@ class Ping(Resource):
         List the current status of the service along with the relevant
         information about the version.
 
+        While files are being preloaded at startup the status is `warming` and
+        a 503 status code is returned so that the service is only sent traffic
+        once it is `ready`.
+
         Example
         -------
         .. code-block:: none
@@ -701,9 +2331,8 @@ class Ping(Resource):
            curl -X GET http://localhost:5001/mug/api/3dcoord/ping
 
         """
-        from . import release
         res = {
-            "status":  "ready",
+            "status":  WARMUP.status,
             "version": release.__version__,
             "author":  release.__author__,
             "license": release.__license__,
@@ -714,6 +2343,79 @@ class Ping(Resource):
                 '_parent': request.url_root + 'mug/api/3dcoord'
             }
         }
+
+        if WARMUP.targets_total:
+            res['warmup'] = WARMUP.report()
+
+        if WARMUP.status != 'ready':
+            return res, 503
+
+        return res
+
+class GetMetrics(Resource):
+    """
+    Class to handle the http requests for the monitoring metrics of the worker
+    """
+
+    @staticmethod
+    def get():
+        """
+        GET Metrics
+
+        Counters and memory usage for the worker process that handled the
+        request. `memory.peak_rss_bytes` is the high-water mark of the
+        resident memory of the worker and `largest_page_bytes` is the
+        largest GetModel page that has been asked for. Pages larger than
+        MAX_PAGE_BYTES are counted in `pages_streamed` or `pages_refused`.
+        `slab_hit_rate` is the fraction of GetModel pages served from
+        regions that had been prefetched, and the `prefetch_*` counters show
+        how many prefetches were queued, done, skipped or cancelled because
+        the server was busy.
+        `replicas` shows the number and size of the local copies of hot
+        resolutions.
+
+        Example
+        -------
+        .. code-block:: none
+           :linenos:
+
+           curl -X GET http://localhost:5001/mug/api/3dcoord/metrics
+
+        """
+        res = METRICS.report()
+        pages_read = res.get('slab_hits', 0) + res.get('slab_misses', 0)
+        res['slab_hit_rate'] = res.get('slab_hits', 0) / float(pages_read) if pages_read else None
+        from rest import coord_store
+
+        if coord_store.REPLICAS is not None:
+            res['replicas'] = coord_store.REPLICAS.report()
+        if OFFLOAD is not None:
+            res['offload'] = {
+                'processes': OFFLOAD.processes,
+                'max_queue': OFFLOAD.max_queue,
+                'queued': OFFLOAD.queued
+            }
+        if PREFETCHER is not None:
+            res['prefetch'] = {
+                'active_requests': PREFETCHER.active,
+                'pending': PREFETCHER.pending()
+            }
+        if ADMISSION is not None:
+            res['admission'] = {
+                'admitted': ADMISSION.admitted,
+                'rejected': ADMISSION.rejected
+            }
+        if RESPONSE_CACHE is not None:
+            res['response_cache'] = {
+                'entries': len(RESPONSE_CACHE),
+                'bytes': RESPONSE_CACHE.size,
+                'hits': RESPONSE_CACHE.hits,
+                'misses': RESPONSE_CACHE.misses
+            }
+        res['_links'] = {
+            '_self': request.url_root + 'mug/api/3dcoord/metrics',
+            '_parent': request.url_root + 'mug/api/3dcoord'
+        }
         return res
 
 ################################################################################
@@ -737,16 +2439,203 @@ API.add_resource(GetChromosomes, "/mug/api/3dcoord/chromosomes", endpoint='chrom
 #   Show the available regions for a given chromosome, start, end and resolution
 API.add_resource(GetRegions, "/mug/api/3dcoord/regions", endpoint='regions')
 
+#   List the regions for a location at every resolution
+API.add_resource(GetLocus, "/mug/api/3dcoord/locus", endpoint='locus')
+
 #   Show the available models for a given region_id
 API.add_resource(GetModels, "/mug/api/3dcoord/models", endpoint='models')
 
 #   Show the 3D coordinates of a model for a given region_id
 API.add_resource(GetModel, "/mug/api/3dcoord/model", endpoint='model')
 
+#   Show the beads of the models in a region within a 3D box or sphere
+API.add_resource(GetSpatial, "/mug/api/3dcoord/spatial", endpoint='spatial')
+
+#   Queue and check the progress of exports of all models at a resolution
+API.add_resource(GetExport, "/mug/api/3dcoord/export", endpoint='export')
+
+#   Download a finished export
+API.add_resource(GetExportDownload, "/mug/api/3dcoord/export/download", endpoint='export_download')
+
+#   List the regions in a location across several files
+API.add_resource(
+    GetFederatedRegions, "/mug/api/3dcoord/federated/regions", endpoint='federated_regions')
+
+#   Get the models for a location across several files
+API.add_resource(
+    GetFederatedModel, "/mug/api/3dcoord/federated/model", endpoint='federated_model')
+
+#   Worker metrics for monitoring
+API.add_resource(GetMetrics, "/mug/api/3dcoord/metrics", endpoint='metrics')
+
 #   Service ping
 API.add_resource(Ping, "/mug/api/3dcoord/ping", endpoint='adjacency-ping')
 
 
+def start_warmup(user_id, targets, workers=4, budget=300, preload_bytes=0):
+    """
+    Open files and build their region indexes in the background before they
+    are requested. Ping reports `warming` until this has completed.
+
+    Parameters
+    ----------
+    user_id : str
+        User ID used to resolve the file_ids with the DM API
+    targets : list
+        Targets of the form `file_id[:res[,res...]]`
+    workers : int
+        Number of files to warm concurrently
+    budget : int
+        Maximum number of seconds to spend warming
+    preload_bytes : int
+        Bytes of the `data` dataset to read per resolution
+    """
+    def open_store(file_id):
+        """
+        Resolve and open a file on behalf of the warm-up user
+        """
+        return _get_store({"user_id": user_id}, file_id)
+
+    return WARMUP.start(
+        open_store, [parse_target(target) for target in targets],
+        workers, budget, preload_bytes
+    )
+
+
+def start_offload(processes, max_queue=32):
+    """
+    Start the process pool that builds large GetModel pages. This should be
+    called before the server starts handling requests.
+
+    Parameters
+    ----------
+    processes : int
+        Number of pool processes
+    max_queue : int
+        Number of pages that can be waiting for the pool before pages are
+        built in the server process again
+    """
+    APP.config['OFFLOAD_PROCESSES'] = processes
+    APP.config['OFFLOAD_MAX_QUEUE'] = max_queue
+    return _get_offload()
+
+
+def start_replicas(cache_dir, quota_bytes=10 * 1024 ** 3, hot_reads=100, compression=None):
+    """
+    Copy the `data` datasets of hot resolutions into a local cache directory,
+    uncompressed or with LZ4, and read from the copies
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory for the replicas
+    quota_bytes : int
+        Total size of the replicas, the least recently read are removed to
+        stay within it
+    hot_reads : int
+        Number of reads of a resolution of a file before it is replicated
+    compression : str
+        None for uncompressed replicas or `lz4`, which needs hdf5plugin
+
+    Returns
+    -------
+    ReplicaManager
+    """
+    from rest import coord_store
+    from rest.replicas import ReplicaManager
+
+    manager = ReplicaManager(cache_dir, quota_bytes, hot_reads, compression)
+    coord_store.set_replicas(manager)
+    return manager
+
+
+def start_tracing(exporter, path=None):
+    """
+    Record spans for each request, covering the auth check, the DM lookup,
+    the HDF5 reads, building the payload, serialisation and compression
+
+    Parameters
+    ----------
+    exporter : str
+        `otel` to create the spans with the OpenTelemetry API, `console` to
+        write them to stderr or `file` to append them to `path`, one JSON
+        object per line
+    path : str
+        File that the spans are written to with the `file` exporter
+    """
+    from rest import tracing
+
+    tracing.configure(exporter, path)
+
+
 # Initialise the server
 if __name__ == "__main__":
+    import argparse
+
+    PARSER = argparse.ArgumentParser(description="3D coordinate RESTful API")
+    PARSER.add_argument(
+        "--data_dir", default=None,
+        help="Directory for the files written by the service, e.g. the catalogue")
+    PARSER.add_argument(
+        "--warmup", action="append", default=[], metavar="FILE_ID[:RES,...]",
+        help="File (and optionally resolutions) to load at startup")
+    PARSER.add_argument(
+        "--warmup_user", default="test",
+        help="User ID used to resolve the warm-up file_ids")
+    PARSER.add_argument(
+        "--warmup_workers", type=int, default=4,
+        help="Number of files warmed concurrently")
+    PARSER.add_argument(
+        "--warmup_budget", type=int, default=300,
+        help="Maximum seconds to spend warming before reporting ready")
+    PARSER.add_argument(
+        "--preload_mb", type=int, default=0,
+        help="MB of coordinate data to read per resolution during warm-up")
+    PARSER.add_argument(
+        "--trace", choices=["otel", "console", "file"], default=None,
+        help="Record tracing spans for each request")
+    PARSER.add_argument(
+        "--trace_file", default="spans.jsonl",
+        help="File that spans are appended to with --trace file")
+    PARSER.add_argument(
+        "--offload_processes", type=int, default=0,
+        help="Processes used to build large GetModel pages")
+    PARSER.add_argument(
+        "--offload_queue", type=int, default=32,
+        help="Pages that can wait for the offload processes")
+    PARSER.add_argument(
+        "--replica_dir", default=None,
+        help="Directory for local copies of the data of hot resolutions")
+    PARSER.add_argument(
+        "--replica_quota_mb", type=int, default=10240,
+        help="Disk space for the replicas")
+    PARSER.add_argument(
+        "--replica_hot_reads", type=int, default=100,
+        help="Reads of a resolution of a file before it is replicated")
+    PARSER.add_argument(
+        "--replica_compression", choices=["none", "lz4"], default="none",
+        help="Compression of the replicas")
+    ARGS = PARSER.parse_args()
+
+    if ARGS.data_dir:
+        APP.config['DATA_DIR'] = ARGS.data_dir
+
+    if ARGS.replica_dir:
+        start_replicas(
+            ARGS.replica_dir, ARGS.replica_quota_mb * 1024 * 1024, ARGS.replica_hot_reads,
+            None if ARGS.replica_compression == 'none' else ARGS.replica_compression
+        )
+
+    if ARGS.offload_processes:
+        start_offload(ARGS.offload_processes, ARGS.offload_queue)
+
+    if ARGS.trace:
+        start_tracing(ARGS.trace, ARGS.trace_file)
+
+    if ARGS.warmup:
+        start_warmup(
+            ARGS.warmup_user, ARGS.warmup, ARGS.warmup_workers,
+            ARGS.warmup_budget, ARGS.preload_mb * 1024 * 1024
+        )
+
     APP.run()
@@ -0,0 +1,176 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import hashlib
+import threading
+import time
+
+from collections import OrderedDict
+
+
+def mg_auth_validator(token):  # pylint: disable=unused-argument
+    """
+    Validate the token of the current request with mg_rest_util
+
+    mg_auth reads the token from the headers of the current request, so this
+    has to be called while handling the request that the token came from.
+
+    Parameters
+    ----------
+    token : str
+        Value of the Authorization header
+
+    Returns
+    -------
+    tuple
+        (user_id, expires_at). user_id is None if the token was rejected.
+        mg_auth does not report when a token expires, so expires_at is always
+        None and accepted tokens are held for the TTL of the cache.
+    """
+    from mg_rest_util.mg_auth import authorized
+
+    @authorized
+    def _capture(user_id):
+        return user_id
+
+    user_id = _capture()  # pylint: disable=no-value-for-parameter
+
+    return user_id, None
+
+
+class TokenCache(object):
+    """
+    Bounded cache of the results of validating bearer tokens.
+
+    Accepted tokens are kept for `ttl` seconds, or until the token expires if
+    that is sooner. Rejected tokens are kept for `negative_ttl` seconds so
+    that repeated requests with a bad token are not sent to the auth server.
+    Once `max_size` tokens are held the least recently used is dropped.
+    """
+
+    def __init__(self, validator, max_size=1024, ttl=300, negative_ttl=10,
+                 clock=time.time):
+        """
+        Parameters
+        ----------
+        validator : function
+            Function that takes a token and returns (user_id, expires_at)
+        max_size : int
+            Maximum number of tokens to hold
+        ttl : int
+            Seconds to keep an accepted token
+        negative_ttl : int
+            Seconds to keep a rejected token
+        clock : function
+            Returns the current time in seconds
+        """
+        self.validator = validator
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token):
+        """
+        Tokens are only held as a hash
+        """
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def validate(self, token):
+        """
+        Get the user for a token, only calling the validator if the token is
+        not already in the cache.
+
+        Parameters
+        ----------
+        token : str
+            Value of the Authorization header
+
+        Returns
+        -------
+        dict | None
+            User details from the validator, None if the token was rejected
+        """
+        return self.lookup(token)[0]
+
+    def lookup(self, token):
+        """
+        Get the user for a token as validate does, along with whether the
+        result came from the cache
+
+        Parameters
+        ----------
+        token : str
+            Value of the Authorization header
+
+        Returns
+        -------
+        tuple
+            (user_id, hit). hit is True if the validator was not called.
+        """
+        if not token:
+            user_id, _ = self.validator(token)
+            return user_id, False
+
+        key = self._key(token)
+        now = self.clock()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._entries[key] = self._entries.pop(key)
+                    self.hits += 1
+                    return entry[0], True
+                del self._entries[key]
+            self.misses += 1
+
+        user_id, expires_at = self.validator(token)
+
+        if user_id is None:
+            valid_until = now + self.negative_ttl
+        else:
+            valid_until = now + self.ttl
+            if expires_at is not None:
+                valid_until = min(valid_until, expires_at)
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (user_id, valid_until)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+        return user_id, False
+
+    def clear(self):
+        """
+        Remove all tokens from the cache
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
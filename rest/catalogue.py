@@ -0,0 +1,234 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def describe_file(file_path):
+    """
+    Get the resolutions and chromosomes within an HDF5 coordinate file
+
+    Parameters
+    ----------
+    file_path : str
+
+    Returns
+    -------
+    dict
+        Sorted list of chromosomes for each resolution
+    """
+    from .coord_store import get_store
+
+    store = get_store(file_path)
+    return {
+        str(res): store.get_index(res).get_chromosomes()
+        for res in store.get_resolutions()
+    }
+
+
+class Catalogue(object):
+    """
+    Local SQLite catalogue of the coordinate files that are known to the DM
+    API. For each (user_id, file_id) it holds the location of the file, its
+    modification time and the resolutions and chromosomes that it contains.
+
+    Lookups that miss the catalogue fall back to the DM API and the result is
+    added to the catalogue. Entries are checked against the modification time
+    of the file so that a file that has been rewritten is described again.
+    """
+
+    def __init__(self, db_path, dm_lookup, dm_list=None, describe=describe_file):
+        """
+        Parameters
+        ----------
+        db_path : str
+            Location of the SQLite database
+        dm_lookup : function
+            Function taking (user_id, file_id) returning the file path from
+            the DM API
+        dm_list : function
+            Function taking a user_id and returning a list of (file_id,
+            file_path) for the coordinate files of that user in the DM API.
+            Required for refresh.
+        describe : function
+            Function taking a file path and returning the chromosomes for each
+            resolution
+        """
+        self.db_path = db_path
+        self.dm_lookup = dm_lookup
+        self.dm_list = dm_list
+        self.describe = describe
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "user_id TEXT, file_id TEXT, file_path TEXT, mtime REAL, "
+            "resolutions TEXT, updated REAL, PRIMARY KEY (user_id, file_id))"
+        )
+        self._conn.commit()
+
+    def _fetch(self, user_id, file_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT file_path, mtime, resolutions FROM files "
+                "WHERE user_id = ? AND file_id = ?",
+                (user_id, file_id)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            'file_path': row[0],
+            'mtime': row[1],
+            'resolutions': json.loads(row[2])
+        }
+
+    def _store(self, user_id, file_id, file_path):
+        mtime = os.stat(file_path).st_mtime
+        record = {
+            'file_path': file_path,
+            'mtime': mtime,
+            'resolutions': self.describe(file_path)
+        }
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                (user_id, file_id, file_path, mtime,
+                 json.dumps(record['resolutions']), time.time())
+            )
+            self._conn.commit()
+        return record
+
+    def lookup(self, user_id, file_id):
+        """
+        Get the catalogue entry for a file
+
+        Parameters
+        ----------
+        user_id : str
+        file_id : str
+
+        Returns
+        -------
+        dict
+            file_path, mtime and resolutions (chromosomes for each resolution)
+        """
+        record = self._fetch(user_id, file_id)
+        if record is not None:
+            try:
+                mtime = os.stat(record['file_path']).st_mtime
+            except OSError:
+                mtime = None
+            if mtime == record['mtime']:
+                self.hits += 1
+                return record
+
+        self.misses += 1
+        if record is None or mtime is None:
+            file_path = self.dm_lookup(user_id, file_id)
+        else:
+            file_path = record['file_path']
+        return self._store(user_id, file_id, file_path)
+
+    def get_file_path(self, user_id, file_id):
+        """
+        Location of a file
+        """
+        return self.lookup(user_id, file_id)['file_path']
+
+    def get_resolutions(self, user_id, file_id):
+        """
+        List of the resolutions within a file
+        """
+        return sorted(int(res) for res in self.lookup(user_id, file_id)['resolutions'])
+
+    def get_chromosomes(self, user_id, file_id, resolution):
+        """
+        List of the chromosomes within a file at a given resolution
+        """
+        return self.lookup(user_id, file_id)['resolutions'].get(str(resolution), [])
+
+    def refresh(self):
+        """
+        Update the entries for every user in the catalogue from the DM API.
+        Files that have not changed are not opened and files that are no
+        longer listed by the DM API are removed.
+        """
+        if self.dm_list is None:
+            return
+
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT user_id, file_id, mtime FROM files").fetchall()
+
+        known = {}
+        for user_id, file_id, mtime in rows:
+            known.setdefault(user_id, {})[file_id] = mtime
+
+        for user_id, files in known.items():
+            listed = set()
+            for file_id, file_path in self.dm_list(user_id):
+                listed.add(file_id)
+                try:
+                    mtime = os.stat(file_path).st_mtime
+                except OSError:
+                    continue
+                if files.get(file_id) != mtime:
+                    self._store(user_id, file_id, file_path)
+
+            removed = [(user_id, file_id) for file_id in files if file_id not in listed]
+            with self._lock:
+                self._conn.executemany(
+                    "DELETE FROM files WHERE user_id = ? AND file_id = ?", removed)
+                self._conn.commit()
+
+    def start_refresh(self, interval):
+        """
+        Refresh the catalogue every `interval` seconds in a background thread
+
+        Returns
+        -------
+        threading.Thread
+        """
+        def _loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.refresh()
+                except Exception as err:  # pylint: disable=broad-except
+                    print("Catalogue refresh failed: " + str(err))
+
+        thread = threading.Thread(target=_loop)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def close(self):
+        """
+        Close the connection to the database
+        """
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,267 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+Content-Encoding negotiation and a cache of compressed responses.
+
+gzip and deflate are always available. zstd and br are offered when the
+`zstandard` and `brotli` packages are installed.
+"""
+
+from __future__ import print_function
+
+import threading
+import zlib
+
+from collections import OrderedDict
+
+# Encodings in the order that the server prefers them
+PREFERENCE = ['zstd', 'br', 'gzip', 'deflate']
+
+# Encodings that can be applied to a streamed response a chunk at a time
+STREAM_ENCODINGS = ['gzip', 'deflate']
+
+_AVAILABLE = None
+
+
+def available_encodings():
+    """
+    List of the encodings that can be produced, in order of preference
+
+    Returns
+    -------
+    list
+    """
+    global _AVAILABLE  # pylint: disable=global-statement
+    if _AVAILABLE is None:
+        available = []
+        for encoding, module in (('zstd', 'zstandard'), ('br', 'brotli')):
+            try:
+                __import__(module)
+                available.append(encoding)
+            except ImportError:
+                pass
+        _AVAILABLE = available + ['gzip', 'deflate']
+    return list(_AVAILABLE)
+
+
+def negotiate(accept_encoding, encodings):
+    """
+    Pick the encoding for a response from the Accept-Encoding header
+
+    Parameters
+    ----------
+    accept_encoding : str
+        Value of the Accept-Encoding header
+    encodings : list
+        Encodings that the server can produce, in order of preference
+
+    Returns
+    -------
+    str | None
+        None if the response should not be compressed
+    """
+    accepted = {}
+    for item in (accept_encoding or '').split(','):
+        parts = item.strip().split(';')
+        name = parts[0].strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in parts[1:]:
+            key, _, value = param.strip().partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name] = quality
+
+    best = None
+    best_quality = 0.0
+    for encoding in encodings:
+        quality = accepted.get(encoding, accepted.get('*', 0.0))
+        if quality > best_quality:
+            best = encoding
+            best_quality = quality
+    return best
+
+
+def compress(data, encoding, level=6):
+    """
+    Compress a response body
+
+    Parameters
+    ----------
+    data : bytes
+    encoding : str
+        zstd, br, gzip or deflate
+    level : int
+
+    Returns
+    -------
+    bytes
+    """
+    if encoding == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    if encoding == 'br':
+        import brotli
+        return brotli.compress(data, quality=level)
+
+    compressor = zlib.compressobj(
+        level, zlib.DEFLATED, 31 if encoding == 'gzip' else zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_stream(chunks, encoding, level=6):
+    """
+    Compress a streamed response a chunk at a time with gzip or deflate
+
+    Parameters
+    ----------
+    chunks : iterable
+        bytes for each chunk of the response
+    encoding : str
+        gzip or deflate
+    level : int
+
+    Returns
+    -------
+    generator
+    """
+    compressor = zlib.compressobj(
+        level, zlib.DEFLATED, 31 if encoding == 'gzip' else zlib.MAX_WBITS)
+    for chunk in chunks:
+        if not isinstance(chunk, bytes):
+            chunk = chunk.encode('utf-8')
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class ResponseCache(object):
+    """
+    LRU cache of serialised response bodies. Each entry holds the
+    uncompressed body along with a copy in each of the encodings that it has
+    been requested in, so that hot responses are neither serialised nor
+    compressed again.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, level=6):
+        """
+        Parameters
+        ----------
+        max_bytes : int
+            Total size of the bodies held, in all encodings
+        level : int
+            Compression level
+        """
+        self.max_bytes = max_bytes
+        self.level = level
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, encoding=None):
+        """
+        Get a cached body
+
+        Parameters
+        ----------
+        key : tuple
+        encoding : str | None
+            Encoding of the body to return, None for the uncompressed body
+
+        Returns
+        -------
+        bytes | None
+        """
+        encoding = encoding or 'identity'
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries[key] = entry
+            self.hits += 1
+        return self.encode(key, entry['identity'], encoding)
+
+    def encode(self, key, body, encoding):
+        """
+        Get a body in an encoding, compressing it and keeping the compressed
+        copy if the body is still cached under the key. Unlike get this is
+        not counted as a hit or a miss.
+
+        Parameters
+        ----------
+        key : tuple
+        body : bytes
+            Uncompressed body
+        encoding : str | None
+            Encoding of the body to return, None for the uncompressed body
+
+        Returns
+        -------
+        bytes
+        """
+        if encoding is None or encoding == 'identity':
+            return body
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry['identity'] is body and encoding in entry:
+                return entry[encoding]
+
+        data = compress(body, encoding, self.level)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry['identity'] is body and encoding not in entry:
+                entry[encoding] = data
+                self.size += len(data)
+                self._evict()
+        return data
+
+    def put(self, key, body):
+        """
+        Add an uncompressed body to the cache
+        """
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= sum(len(data) for data in old.values())
+            if len(body) > self.max_bytes:
+                return
+            self._entries[key] = {'identity': body}
+            self.size += len(body)
+            self._evict()
+
+    def _evict(self):
+        while self.size > self.max_bytes and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            self.size -= sum(len(data) for data in entry.values())
+
+    def clear(self):
+        """
+        Remove all of the entries
+        """
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
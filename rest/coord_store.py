@@ -0,0 +1,1110 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import json
+import os
+import threading
+
+from collections import OrderedDict
+
+import h5py
+import numpy as np
+
+from .metrics import METRICS
+from .tracing import span
+
+# Memory held by the spatial indexes of each store
+SPATIAL_CACHE_BYTES = 256 * 1024 * 1024
+
+# Memory held by the prefetched region coordinates of each store
+SLAB_CACHE_BYTES = 256 * 1024 * 1024
+
+# Memory held by the model catalogues of each store
+CATALOGUE_CACHE_BYTES = 64 * 1024 * 1024
+
+# Attributes of the `data` dataset that `scripts/parsing_models.py` copies from
+# the TADbit `object` of the first region loaded at each resolution
+OBJECT_ATTRS = (
+    'title', 'experimentType', 'species', 'project', 'identifier', 'assembly',
+    'cellType', 'resolution', 'datatype', 'components', 'source'
+)
+
+# ReplicaManager holding local copies of the `data` datasets of hot
+# resolutions, set by set_replicas
+REPLICAS = None
+
+
+def get_file_path(user_id, file_id, cnf_loc):
+    """
+    Resolve a file_id to the location of the HDF5 file
+
+    Parameters
+    ----------
+    user_id : str
+        User ID
+    file_id : str
+        Identifier of the file within the DM API
+    cnf_loc : str
+        Location of the mongodb.cnf file for the DM API
+
+    Returns
+    -------
+    str
+        Path to the HDF5 file
+    """
+    from dmp import dmp
+
+    da = dmp(cnf_loc)
+    file_obj = da.get_file_by_id(user_id, file_id)
+    return file_obj['file_path']
+
+
+def get_user_files(user_id, cnf_loc):
+    """
+    List the HDF5 files that a user has registered with the DM API
+
+    Parameters
+    ----------
+    user_id : str
+        User ID
+    cnf_loc : str
+        Location of the mongodb.cnf file for the DM API
+
+    Returns
+    -------
+    list
+        List of (file_id, file_path) tuples
+    """
+    from dmp import dmp
+
+    da = dmp(cnf_loc)
+    return [
+        (str(file_obj['_id']), file_obj['file_path'])
+        for file_obj in da.get_files_by_user(user_id)
+        if str(file_obj.get('file_type', '')).lower() in ('hdf5', 'h5')
+    ]
+
+
+def file_version(file_path):
+    """
+    Identify the version of a file by its inode and modification time. A file
+    that has been replaced by renaming a new file over it has a new inode.
+    """
+    stat = os.stat(file_path)
+    return (stat.st_ino, stat.st_mtime)
+
+
+def _attr_str(value):
+    """
+    HDF5 string attributes can be returned as bytes depending on the version
+    of h5py that was used to write them.
+    """
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return str(value)
+
+
+def _attr_value(value):
+    """
+    Convert an HDF5 attribute to a JSON serialisable value
+    """
+    if isinstance(value, (bytes, str)):
+        return _attr_str(value)
+    if isinstance(value, np.ndarray):
+        return [_attr_value(item) for item in value.tolist()]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _table_current(meta, table):
+    """
+    Check that the `meta/regions` table of a resolution matches the regions
+    that have been loaded, so that a table left behind by a tool that does
+    not maintain it is not used
+    """
+    region_ids = [_attr_str(uuid) for uuid in table['uuid']]
+    if sorted(region_ids) != sorted(meta['model_params'].keys()):
+        return False
+
+    bounds = dict(zip(region_ids, zip(table['i'].tolist(), table['j'].tolist())))
+    if 'manifest' in meta:
+        manifest = meta['manifest'][:]
+        committed = dict(zip(
+            [_attr_str(uuid) for uuid in manifest['uuid']],
+            zip(manifest['i'].tolist(), manifest['j'].tolist())))
+        return committed == bounds
+
+    rows = meta.parent['data'].shape[0]
+    return all(0 <= i <= j <= rows for i, j in bounds.values())
+
+
+class RegionIndex(object):
+    """
+    In memory index of the regions that have been loaded for a single
+    resolution. This replaces walking the attributes of each dataset in
+    `meta/model_params` for every listing request.
+    """
+
+    def __init__(self, region_ids, chromosomes, starts, ends, row_i, row_j,
+                 model_counts=None, cluster_counts=None):
+        """
+        Parameters
+        ----------
+        region_ids : list
+            Region IDs (uuids)
+        chromosomes : list
+            Chromosome for each region
+        starts : list
+            Start position of each region
+        ends : list
+            End position of each region
+        row_i : list
+            First row of each region within the `data` dataset
+        row_j : list
+            Row after the last row of each region within the `data` dataset
+        model_counts : list
+            Number of models in each region
+        cluster_counts : list
+            Number of clusters in each region
+        """
+        self.region_ids = [str(region_id) for region_id in region_ids]
+        self.chromosomes = np.array(
+            [str(chrom) for chrom in chromosomes], dtype=str)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+        self.row_i = np.asarray(row_i, dtype=np.int64)
+        self.row_j = np.asarray(row_j, dtype=np.int64)
+        self.model_counts = np.asarray(
+            model_counts if model_counts is not None else [0] * len(region_ids),
+            dtype=np.int64)
+        self.cluster_counts = np.asarray(
+            cluster_counts if cluster_counts is not None else [0] * len(region_ids),
+            dtype=np.int64)
+
+        self._position = {
+            region_id: pos for pos, region_id in enumerate(self.region_ids)
+        }
+
+    @classmethod
+    def from_table(cls, table):
+        """
+        Build the index from the `meta/regions` table of a resolution
+
+        Parameters
+        ----------
+        table : numpy.ndarray
+            Structured array with the fields uuid, chromosome, start, end, i,
+            j, models and clusters
+
+        Returns
+        -------
+        RegionIndex
+        """
+        return cls(
+            [_attr_str(uuid) for uuid in table['uuid']],
+            [_attr_str(chrom) for chrom in table['chromosome']],
+            table['start'], table['end'], table['i'], table['j'],
+            table['models'], table['clusters']
+        )
+
+    @classmethod
+    def from_group(cls, mpgrp, clustersgrp=None):
+        """
+        Build the index from the attributes of the datasets in the
+        `meta/model_params` group of a resolution
+
+        Parameters
+        ----------
+        mpgrp : h5py.Group
+            Group holding one dataset per region
+        clustersgrp : h5py.Group
+            `meta/clusters` group, used to count the clusters in each region
+
+        Returns
+        -------
+        RegionIndex
+        """
+        region_ids = list(mpgrp.keys())
+        chromosomes = []
+        starts = []
+        ends = []
+        row_i = []
+        row_j = []
+        model_counts = []
+        cluster_counts = []
+        for region_id in region_ids:
+            model_param_ds = mpgrp[region_id]
+            attrs = model_param_ds.attrs
+            chromosomes.append(_attr_str(attrs['chromosome']))
+            starts.append(int(attrs['start']))
+            ends.append(int(attrs['end']))
+            row_i.append(int(attrs['i']))
+            row_j.append(int(attrs['j']))
+            model_counts.append(model_param_ds.shape[0])
+            if clustersgrp is not None and region_id in clustersgrp:
+                cluster_counts.append(len(clustersgrp[region_id]))
+            else:
+                cluster_counts.append(0)
+
+        return cls(
+            region_ids, chromosomes, starts, ends, row_i, row_j,
+            model_counts, cluster_counts
+        )
+
+    @classmethod
+    def from_meta(cls, meta):
+        """
+        Build the index for a resolution. The `meta/regions` table is loaded
+        in a single read when it is present and up to date, otherwise the
+        attributes of each region are read.
+
+        The table is up to date if it lists the same regions as
+        `meta/model_params` and the rows of each region match the
+        `meta/manifest`, or lie within the `data` dataset for files written
+        before the manifest was introduced.
+
+        Parameters
+        ----------
+        meta : h5py.Group
+            `meta` group of a resolution
+
+        Returns
+        -------
+        RegionIndex
+        """
+        mpgrp = meta['model_params']
+        if 'regions' in meta and meta['regions'].shape[0] == len(mpgrp):
+            table = meta['regions'][:]
+            if _table_current(meta, table):
+                return cls.from_table(table)
+        return cls.from_group(mpgrp, meta.get('clusters'))
+
+    def __len__(self):
+        return len(self.region_ids)
+
+    def __contains__(self, region_id):
+        return str(region_id) in self._position
+
+    def get_chromosomes(self):
+        """
+        List of the chromosomes that have regions at this resolution
+        """
+        return sorted(set(self.chromosomes.tolist()))
+
+    def get_regions(self, chr_id, start, end):
+        """
+        List of the regions that overlap a given chromosomal location
+
+        Parameters
+        ----------
+        chr_id : str
+            Chromosome
+        start : int
+            Start position
+        end : int
+            End position
+
+        Returns
+        -------
+        list
+            Region IDs
+        """
+        with span('index.get_regions', chromosome=str(chr_id)) as current:
+            mask = (
+                (self.chromosomes == str(chr_id)) &
+                (self.starts < end) &
+                (self.ends > start)
+            )
+            regions = [self.region_ids[pos] for pos in np.flatnonzero(mask)]
+            current.set_attribute('regions', len(regions))
+        return regions
+
+    def get_region_order(self, chr_id=None, region=None):
+        """
+        List of the regions on a chromosome ordered by their start position
+
+        Parameters
+        ----------
+        chr_id : str
+            Chromosome
+        region : str
+            Region ID, used to identify the chromosome when chr_id is None
+
+        Returns
+        -------
+        list
+            Region IDs
+        """
+        with span('index.get_region_order'):
+            if region is not None:
+                chr_id = self.chromosomes[self._position[str(region)]]
+
+            positions = np.flatnonzero(self.chromosomes == str(chr_id))
+            order = positions[np.argsort(self.starts[positions], kind='mergesort')]
+            return [self.region_ids[pos] for pos in order]
+
+    def get_region(self, region_id):
+        """
+        Location of a region within the chromosome and the `data` dataset
+
+        Parameters
+        ----------
+        region_id : str
+            Region ID
+
+        Returns
+        -------
+        dict
+            chromosome, start, end, i, j, models and clusters for the region
+        """
+        pos = self._position[str(region_id)]
+        return {
+            'chromosome': str(self.chromosomes[pos]),
+            'start': int(self.starts[pos]),
+            'end': int(self.ends[pos]),
+            'i': int(self.row_i[pos]),
+            'j': int(self.row_j[pos]),
+            'models': int(self.model_counts[pos]),
+            'clusters': int(self.cluster_counts[pos])
+        }
+
+
+class ModelCatalogue(object):
+    """
+    Read only arrays describing the models of a region, in the order of
+    their columns within the `data` dataset. A catalogue is loaded once per
+    region and shared by all of the requests against the file. The IDs are
+    held as numbers and only formatted when a response is built.
+    """
+
+    __slots__ = ('model_ids', 'cluster_ids', 'row_i', 'row_j')
+
+    def __init__(self, model_params, row_i, row_j):
+        """
+        Parameters
+        ----------
+        model_params : numpy.ndarray
+            [model_id, cluster_id] for each model, from
+            `meta/model_params/<region_id>`
+        row_i : int
+            First row of the region within the `data` dataset
+        row_j : int
+            Row after the last row of the region
+        """
+        model_params = np.asarray(model_params).reshape(-1, 2)
+        self.model_ids = np.ascontiguousarray(model_params[:, 0])
+        self.cluster_ids = np.ascontiguousarray(model_params[:, 1])
+        self.row_i = int(row_i)
+        self.row_j = int(row_j)
+        for array in (self.model_ids, self.cluster_ids):
+            array.flags.writeable = False
+
+    def __len__(self):
+        return len(self.model_ids)
+
+    def nbytes(self):
+        """
+        Memory used by the arrays of the catalogue
+        """
+        return self.model_ids.nbytes + self.cluster_ids.nbytes
+
+    def select(self, model_ids=None, clusters=None):
+        """
+        Columns of the models with the given IDs and in the given clusters
+
+        Parameters
+        ----------
+        model_ids : list
+            Model IDs, or None or ['all'] for every model
+        clusters : list
+            Cluster IDs, or None for every cluster
+
+        Returns
+        -------
+        numpy.ndarray
+            Sorted column indexes
+        """
+        mask = np.ones(len(self.model_ids), dtype=bool)
+        if model_ids is not None and 'all' not in model_ids:
+            mask &= np.isin(self.model_ids, _int_ids(model_ids))
+        if clusters is not None:
+            mask &= np.isin(self.cluster_ids, _int_ids(clusters))
+        return np.flatnonzero(mask)
+
+
+def _int_ids(values):
+    """
+    Requested IDs as integers, leaving out those that are not numbers as
+    they cannot match any model or cluster
+    """
+    ids = []
+    for value in values:
+        try:
+            ids.append(int(value))
+        except (TypeError, ValueError):
+            pass
+    return np.array(ids, dtype=np.int64)
+
+
+class CoordStore(object):
+    """
+    Long lived read only handle on an HDF5 coordinate file. The region
+    indexes for each resolution are built on first use and then shared by all
+    of the requests against the file.
+    """
+
+    def __init__(self, file_path):
+        """
+        Parameters
+        ----------
+        file_path : str
+            Location of the HDF5 file
+        """
+        self.file_path = file_path
+        self.version = file_version(file_path)
+        self.mtime = self.version[1]
+        self.file_handle = h5py.File(file_path, 'r')
+        self._indexes = {}
+        self._spatial = OrderedDict()
+        self._spatial_bytes = 0
+        self._slabs = OrderedDict()
+        self._slab_bytes = 0
+        self._catalogues = OrderedDict()
+        self._catalogue_bytes = 0
+        self._replica_handles = {}
+        self._replica_drops = 0
+        self._lock = threading.Lock()
+
+    def get_resolutions(self):
+        """
+        List of the resolutions available within the file
+        """
+        with span('store.get_resolutions'):
+            return sorted(int(res) for res in self.file_handle.keys() if res.isdigit())
+
+    def get_index(self, resolution):
+        """
+        Get the region index for a resolution, building it if required
+
+        Parameters
+        ----------
+        resolution : int
+
+        Returns
+        -------
+        RegionIndex
+        """
+        resolution = str(resolution)
+        index = self._indexes.get(resolution)
+        if index is None:
+            with self._lock:
+                index = self._indexes.get(resolution)
+                if index is None:
+                    with span('store.build_index', resolution=resolution) as current:
+                        index = RegionIndex.from_meta(self.file_handle[resolution]['meta'])
+                        current.set_attribute('regions', len(index))
+                    self._indexes[resolution] = index
+        return index
+
+    def get_locus(self, chr_id, start, end):
+        """
+        Regions that overlap a chromosomal location at each of the
+        resolutions in the file
+
+        Parameters
+        ----------
+        chr_id : str
+            Chromosome
+        start : int
+            Start position
+        end : int
+            End position
+
+        Returns
+        -------
+        list
+            (resolution, regions) for each resolution in ascending order,
+            where regions is a list of (region_id, region) with the region
+            from `RegionIndex.get_region`
+        """
+        with span('store.get_locus', chromosome=str(chr_id)):
+            locus = []
+            for resolution in self.get_resolutions():
+                index = self.get_index(resolution)
+                locus.append((resolution, [
+                    (region_id, index.get_region(region_id))
+                    for region_id in index.get_regions(chr_id, start, end)
+                ]))
+            return locus
+
+    def get_dataset(self, resolution, record=True):
+        """
+        Get the `data` dataset for a resolution. Reads are counted by the
+        replica manager, if there is one, and go to the replica of the
+        dataset once it has been built.
+
+        Parameters
+        ----------
+        resolution : int
+        record : bool
+            Count the read towards replicating the resolution. Reads made
+            ahead of the clients, by prefetching or warm up, are not counted.
+
+        Returns
+        -------
+        h5py.Dataset
+        """
+        replicas = REPLICAS
+        if replicas is not None:
+            if record:
+                replicas.record(self.file_path, self.version, resolution)
+            replica = self._replica_handles.get(str(resolution))
+            if replica is None:
+                drops = self._replica_drops
+                replica = replicas.open(self.file_path, self.version, resolution)
+                if replica is not None:
+                    # Only keep the handle if the replica was not evicted
+                    # while it was being opened
+                    with self._lock:
+                        if self._replica_drops == drops:
+                            current = self._replica_handles.setdefault(
+                                str(resolution), replica)
+                        else:
+                            current = replica
+                    if current is not replica:
+                        replica.close()
+                        replica = current
+            if replica is not None:
+                METRICS.incr('replica_reads')
+                return replica[str(resolution)]['data']
+        return self.file_handle[str(resolution)]['data']
+
+    def get_models(self, resolution, region_id):
+        """
+        List of the models within a region
+
+        Parameters
+        ----------
+        resolution : int
+        region_id : str
+
+        Returns
+        -------
+        numpy.ndarray
+            Array of [model_id, cluster_id] for each of the models
+        """
+        with span('store.get_models', region=str(region_id)) as current:
+            mpgrp = self.file_handle[str(resolution)]['meta']['model_params']
+            model_params = mpgrp[str(region_id)][:]
+            current.set_attribute('models', len(model_params))
+            current.set_attribute('bytes_read', model_params.nbytes)
+        return model_params
+
+    def get_catalogue(self, resolution, region_id):
+        """
+        Get the catalogue of the models in a region, loading it if required.
+        The most recently used catalogues are kept up to
+        CATALOGUE_CACHE_BYTES.
+
+        Parameters
+        ----------
+        resolution : int
+        region_id : str
+
+        Returns
+        -------
+        ModelCatalogue
+        """
+        key = (str(resolution), str(region_id))
+        with self._lock:
+            catalogue = self._catalogues.pop(key, None)
+            if catalogue is not None:
+                self._catalogues[key] = catalogue
+                return catalogue
+
+        region = self.get_index(resolution).get_region(region_id)
+        catalogue = ModelCatalogue(
+            self.get_models(resolution, region_id), region['i'], region['j'])
+
+        with self._lock:
+            if key in self._catalogues:
+                return self._catalogues[key]
+            self._catalogues[key] = catalogue
+            self._catalogue_bytes += catalogue.nbytes()
+            while self._catalogue_bytes > CATALOGUE_CACHE_BYTES and len(self._catalogues) > 1:
+                _, dropped = self._catalogues.popitem(last=False)
+                self._catalogue_bytes -= dropped.nbytes()
+        return catalogue
+
+    def get_model_stats(self, resolution, region_id):
+        """
+        Summary statistics for the models of a region that were computed when
+        the region was loaded
+
+        Parameters
+        ----------
+        resolution : int
+        region_id : str
+
+        Returns
+        -------
+        tuple
+            (model_stats, cluster_stats). model_stats has a row for each row
+            of `meta/model_params/<region_id>`. Both are None for files that
+            do not have the statistics.
+        """
+        with span('store.get_model_stats', region=str(region_id)):
+            meta = self.file_handle[str(resolution)]['meta']
+            if 'model_stats' not in meta or str(region_id) not in meta['model_stats']:
+                return None, None
+            cluster_data = None
+            if 'cluster_stats' in meta and str(region_id) in meta['cluster_stats']:
+                cluster_data = meta['cluster_stats'][str(region_id)][:]
+            return meta['model_stats'][str(region_id)][:], cluster_data
+
+    def get_centroids(self, resolution, region_id):
+        """
+        Model IDs of the centroid of each cluster in a region
+
+        Parameters
+        ----------
+        resolution : int
+        region_id : str
+
+        Returns
+        -------
+        numpy.ndarray
+            Model ID of the centroid of cluster `n` at position `n`. Empty for
+            regions without centroids.
+        """
+        meta = self.file_handle[str(resolution)]['meta']
+        if 'centroids' not in meta or str(region_id) not in meta['centroids']:
+            return np.zeros(0, dtype=np.int64)
+        return np.atleast_1d(meta['centroids'][str(region_id)][:])
+
+    def get_model_header(self, resolution, region_id):
+        """
+        Parts of the TADbit JSON for a region other than the models, rebuilt
+        from what `scripts/parsing_models.py` stores in the file
+
+        Parameters
+        ----------
+        resolution : int
+        region_id : str
+
+        Returns
+        -------
+        dict
+            metadata, object, clusters, centroids and restraints, along with
+            hic_data if it was loaded
+        """
+        with span('store.get_model_header', region=str(region_id)):
+            region = self.get_index(resolution).get_region(region_id)
+            meta = self.file_handle[str(resolution)]['meta']
+            attrs = self.file_handle[str(resolution)]['data'].attrs
+
+            objectdata = dict(
+                (name, _attr_value(attrs[name])) for name in OBJECT_ATTRS if name in attrs)
+            objectdata['uuid'] = str(region_id)
+            objectdata['chrom'] = [region['chromosome']]
+            objectdata['chromStart'] = [region['start']]
+            objectdata['chromEnd'] = [region['end']]
+            objectdata['dependencies'] = json.loads(
+                _attr_str(attrs['dependencies'])) if 'dependencies' in attrs else {}
+
+            clusters = []
+            if 'clusters' in meta and str(region_id) in meta['clusters']:
+                clustergrps = meta['clusters'][str(region_id)]
+                clusters = [
+                    np.atleast_1d(clustergrps[name][:]).tolist()
+                    for name in sorted(clustergrps.keys(), key=int)
+                ]
+
+            header = {
+                'metadata': json.loads(
+                    _attr_str(attrs['TADbit_meta'])) if 'TADbit_meta' in attrs else {},
+                'object': objectdata,
+                'clusters': clusters,
+                'centroids': self.get_centroids(resolution, region_id).tolist(),
+                'restraints': json.loads(
+                    _attr_str(attrs['restraints'])) if 'restraints' in attrs else [],
+            }
+            if 'hic_data' in attrs:
+                header['hic_data'] = json.loads(_attr_str(attrs['hic_data']))
+            return header
+
+    def get_model_columns(self, resolution, region_id, model_ids, clusters=None):
+        """
+        Resolve model IDs to their columns within the `data` dataset. The
+        models for a region are stored in the same order as the rows of its
+        `meta/model_params` dataset.
+
+        Parameters
+        ----------
+        resolution : int
+        region_id : str
+        model_ids : list
+            List of model IDs, or ['all'] for every model in the region
+        clusters : list
+            Only include the models in these clusters, None for all clusters
+
+        Returns
+        -------
+        numpy.ndarray
+            Sorted column indexes for the models that were found
+        """
+        return self.get_catalogue(resolution, region_id).select(model_ids, clusters)
+
+    def get_bead_range(self, resolution, region_id, start=None, end=None,
+                       bead_from=None, bead_to=None):
+        """
+        Map a genomic interval or a range of beads to the beads of a region.
+        Bead `k` covers `region start + k * resolution` up to the start of
+        the next bead.
+
+        Parameters
+        ----------
+        resolution : int
+        region_id : str
+        start : int
+            Genomic start. If either start or end is given then bead_from and
+            bead_to are ignored.
+        end : int
+            Genomic end
+        bead_from : int
+            First bead, counting from 0
+        bead_to : int
+            Bead after the last one
+
+        Returns
+        -------
+        tuple | None
+            (first, last) beads with last excluded, clipped to the region.
+            None if no range was given.
+
+        Raises
+        ------
+        ValueError
+            If no beads of the region are in the range
+        """
+        if start is None and end is None and bead_from is None and bead_to is None:
+            return None
+
+        region = self.get_index(resolution).get_region(region_id)
+        beads = region['j'] - region['i']
+        if start is not None or end is not None:
+            first = 0 if start is None else (int(start) - region['start']) // int(resolution)
+            last = beads if end is None else -((region['start'] - int(end)) // int(resolution))
+        else:
+            first = 0 if bead_from is None else int(bead_from)
+            last = beads if bead_to is None else int(bead_to)
+
+        first, last = max(first, 0), min(last, beads)
+        if first >= last:
+            raise ValueError('No beads of ' + str(region_id) + ' in the range')
+        return first, last
+
+    def get_model_page(self, resolution, region_id, columns, beads=None):
+        """
+        Read the coordinates for a set of models within a region. Only the
+        hyperslab of the `data` dataset for the region rows and the model
+        columns is read.
+
+        Parameters
+        ----------
+        resolution : int
+        region_id : str
+        columns : list
+            Sorted column indexes of the models
+        beads : tuple
+            (first, last) beads of the region to read, from `get_bead_range`.
+            None for all of them.
+
+        Returns
+        -------
+        model_params : numpy.ndarray
+            [model_id, cluster_id] for each of the models
+        coords : numpy.ndarray
+            Array of shape (beads, models, 3)
+        """
+        region = self.get_index(resolution).get_region(region_id)
+        dset = self.get_dataset(resolution)
+        mpds = self.file_handle[str(resolution)]['meta']['model_params'][str(region_id)]
+        first, last = beads if beads is not None else (0, region['j'] - region['i'])
+
+        columns = [int(col) for col in columns]
+        if not columns:
+            return (
+                np.zeros((0, 2), dtype=mpds.dtype),
+                np.zeros((last - first, 0, 3), dtype=dset.dtype)
+            )
+
+        if columns[-1] - columns[0] == len(columns) - 1:
+            col_slice = slice(columns[0], columns[-1] + 1)
+        else:
+            col_slice = columns
+
+        slab = self._cached_slab(resolution, region_id, columns)
+        with span('store.get_model_page', region=str(region_id)) as current:
+            model_params = mpds[col_slice]
+            if slab is not None:
+                METRICS.incr('slab_hits')
+                coords = slab[first:last]
+                current.set_attribute('bytes_read', model_params.nbytes)
+            else:
+                METRICS.incr('slab_misses')
+                coords = dset[region['i'] + first:region['i'] + last, col_slice, :]
+                current.set_attribute('bytes_read', model_params.nbytes + coords.nbytes)
+            current.set_attribute('models', len(columns))
+        return model_params, coords
+
+    def _cached_slab(self, resolution, region_id, columns):
+        """
+        Coordinates of a set of models in a region from the prefetched slab,
+        or None if the slab does not hold all of them
+        """
+        key = (str(resolution), str(region_id))
+        with self._lock:
+            entry = self._slabs.pop(key, None)
+            if entry is None:
+                return None
+            self._slabs[key] = entry
+
+        slab_columns, slab = entry
+        columns = np.asarray(columns, dtype=np.int64)
+        positions = np.searchsorted(slab_columns, columns)
+        if (positions >= len(slab_columns)).any() or \
+                not np.array_equal(slab_columns[positions], columns):
+            return None
+        if positions[-1] - positions[0] == len(positions) - 1:
+            return slab[:, positions[0]:positions[-1] + 1, :]
+        return slab[:, positions, :]
+
+    def prefetch_region(self, resolution, region_id, columns=None):
+        """
+        Read the coordinates of the models in a region into memory so that
+        pages of the region are served without reading the file. A single
+        slab is held for each region, and the most recently used slabs are
+        kept up to SLAB_CACHE_BYTES.
+
+        Parameters
+        ----------
+        resolution : int
+        region_id : str
+        columns : list
+            Sorted column indexes of the models to read, such as those of the
+            next page. None for all of the models in the region.
+
+        Returns
+        -------
+        int
+            Number of bytes that were read, 0 if the models were already held
+        """
+        region = self.get_index(resolution).get_region(region_id)
+        if columns is None:
+            columns = np.arange(region['models'], dtype=np.int64)
+        columns = np.asarray(columns, dtype=np.int64)
+        if len(columns) == 0 or self._cached_slab(resolution, region_id, columns) is not None:
+            return 0
+
+        with span('store.prefetch_region', region=str(region_id)) as current:
+            dset = self.get_dataset(resolution, record=False)
+            if columns[-1] - columns[0] == len(columns) - 1:
+                slab = dset[region['i']:region['j'], int(columns[0]):int(columns[-1]) + 1, :]
+            else:
+                slab = dset[region['i']:region['j'], columns.tolist(), :]
+            current.set_attribute('bytes_read', slab.nbytes)
+            current.set_attribute('models', len(columns))
+        if slab.nbytes > SLAB_CACHE_BYTES:
+            return slab.nbytes
+
+        key = (str(resolution), str(region_id))
+        with self._lock:
+            old = self._slabs.pop(key, None)
+            if old is not None:
+                self._slab_bytes -= old[1].nbytes
+            self._slabs[key] = (columns, slab)
+            self._slab_bytes += slab.nbytes
+            while self._slab_bytes > SLAB_CACHE_BYTES:
+                _, (_, dropped) = self._slabs.popitem(last=False)
+                self._slab_bytes -= dropped.nbytes
+        return slab.nbytes
+
+    def get_spatial_index(self, resolution, region_id):
+        """
+        Get the grid over the bead coordinates of all of the models in a
+        region, building it if required. The most recently used grids are kept
+        up to SPATIAL_CACHE_BYTES.
+
+        Parameters
+        ----------
+        resolution : int
+        region_id : str
+
+        Returns
+        -------
+        GridIndex
+        """
+        from .spatial import GridIndex
+
+        key = (str(resolution), str(region_id))
+        with self._lock:
+            index = self._spatial.pop(key, None)
+            if index is not None:
+                self._spatial[key] = index
+                return index
+
+        with span('store.build_spatial_index', region=str(region_id)) as current:
+            region = self.get_index(resolution).get_region(region_id)
+            coords = self.get_dataset(resolution)[region['i']:region['j'], 0:region['models'], :]
+            index = GridIndex(coords)
+            current.set_attribute('bytes_read', coords.nbytes)
+
+        with self._lock:
+            if key not in self._spatial:
+                self._spatial[key] = index
+                self._spatial_bytes += index.nbytes()
+            while self._spatial_bytes > SPATIAL_CACHE_BYTES and len(self._spatial) > 1:
+                _, dropped = self._spatial.popitem(last=False)
+                self._spatial_bytes -= dropped.nbytes()
+        return index
+
+    def preload(self, resolution, region_ids=None, max_bytes=None):
+        """
+        Read the rows of the `data` dataset for a set of regions so that the
+        chunks are decompressed once and the pages are in the OS cache.
+
+        Parameters
+        ----------
+        resolution : int
+        region_ids : list
+            Regions to read. If None then regions are read in the order that
+            they appear in the index.
+        max_bytes : int
+            Stop once this many bytes have been read
+
+        Returns
+        -------
+        int
+            Number of bytes that were read
+        """
+        index = self.get_index(resolution)
+        dset = self.get_dataset(resolution, record=False)
+
+        if region_ids is None:
+            region_ids = index.region_ids
+
+        row_bytes = int(np.prod(dset.shape[1:])) * dset.dtype.itemsize
+        bytes_read = 0
+        for region_id in region_ids:
+            region = index.get_region(region_id)
+            region_bytes = (region['j'] - region['i']) * row_bytes
+            if max_bytes is not None and bytes_read + region_bytes > max_bytes:
+                break
+            dset[region['i']:region['j']]
+            bytes_read += region_bytes
+
+        return bytes_read
+
+    def drop_replica(self, resolution):
+        """
+        Stop reading from the replica of a resolution, e.g. once it has been
+        evicted. The handle is not closed here, it is closed once the reads
+        that are still using it have finished.
+
+        Parameters
+        ----------
+        resolution : int
+        """
+        with self._lock:
+            self._replica_drops += 1
+            self._replica_handles.pop(str(resolution), None)
+
+    def close(self):
+        """
+        Close the file handle and any replicas that were opened
+        """
+        for replica in self._replica_handles.values():
+            replica.close()
+        self.file_handle.close()
+
+
+_STORES = {}
+_STORES_LOCK = threading.Lock()
+
+
+def set_replicas(manager):
+    """
+    Use a ReplicaManager for the reads of all of the stores, or None to stop
+    counting reads and opening replicas
+    """
+    global REPLICAS  # pylint: disable=global-statement
+    if manager is not None:
+        manager.add_listener(_replica_removed)
+    REPLICAS = manager
+
+
+def _replica_removed(file_path, resolution):
+    """
+    Drop the handles that the stores hold on a replica that is being removed
+    """
+    with _STORES_LOCK:
+        stores = list(_STORES.values())
+    for store in stores:
+        if os.path.abspath(store.file_path) == file_path:
+            store.drop_replica(resolution)
+
+
+def get_store(file_path):
+    """
+    Get the shared CoordStore for a file, opening it if required
+
+    If the file has been replaced since it was opened then a new store is
+    opened and the old one is dropped from the pool. Requests that are still
+    using the old store carry on reading the old file, which is closed once
+    they have finished with it.
+
+    Parameters
+    ----------
+    file_path : str
+
+    Returns
+    -------
+    CoordStore
+    """
+    version = file_version(file_path)
+    store = _STORES.get(file_path)
+    if store is None or store.version != version:
+        with _STORES_LOCK:
+            store = _STORES.get(file_path)
+            if store is None or store.version != version:
+                store = CoordStore(file_path)
+                _STORES[file_path] = store
+    return store
+
+
+def close_stores():
+    """
+    Close all of the shared file handles
+    """
+    with _STORES_LOCK:
+        for store in _STORES.values():
+            store.close()
+        _STORES.clear()
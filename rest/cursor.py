@@ -0,0 +1,119 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import base64
+import hashlib
+import hmac
+import json
+import zlib
+
+SIGNATURE_LENGTH = 16
+
+
+def encode_columns(columns):
+    """
+    Compact form of the columns of the `data` dataset for a set of models.
+    A contiguous run is stored as its bounds, anything else as a list.
+
+    Parameters
+    ----------
+    columns : list
+        Sorted column indexes
+
+    Returns
+    -------
+    list | dict
+    """
+    columns = [int(col) for col in columns]
+    if columns and columns[-1] - columns[0] == len(columns) - 1:
+        return {'a': columns[0], 'b': columns[-1] + 1}
+    return columns
+
+
+def decode_columns(encoded):
+    """
+    Inverse of encode_columns
+
+    Returns
+    -------
+    list
+    """
+    if isinstance(encoded, dict):
+        return list(range(encoded['a'], encoded['b']))
+    return list(encoded)
+
+
+def _signature(body, secret):
+    return hmac.new(secret, body, hashlib.sha256).hexdigest()[:SIGNATURE_LENGTH]
+
+
+def encode_cursor(state, secret):
+    """
+    Create an opaque continuation cursor
+
+    Parameters
+    ----------
+    state : dict
+        JSON serialisable state of the query
+    secret : bytes
+        Key used to sign the cursor so that it cannot be altered by the client
+
+    Returns
+    -------
+    str
+    """
+    body = base64.urlsafe_b64encode(
+        zlib.compress(json.dumps(state, separators=(',', ':')).encode('utf-8'))
+    ).rstrip(b'=')
+    return body.decode('ascii') + '.' + _signature(body, secret)
+
+
+def decode_cursor(cursor, secret):
+    """
+    Validate and decode a cursor that was created by encode_cursor
+
+    Parameters
+    ----------
+    cursor : str
+    secret : bytes
+
+    Returns
+    -------
+    dict
+        State of the query
+
+    Raises
+    ------
+    ValueError
+        If the cursor is malformed or the signature does not match
+    """
+    try:
+        body, signature = cursor.rsplit('.', 1)
+        body = body.encode('ascii')
+    except (ValueError, UnicodeError):
+        raise ValueError('Malformed cursor')
+
+    if not hmac.compare_digest(_signature(body, secret), str(signature)):
+        raise ValueError('Invalid cursor signature')
+
+    try:
+        padded = body + b'=' * (-len(body) % 4)
+        return json.loads(zlib.decompress(base64.urlsafe_b64decode(padded)).decode('utf-8'))
+    except (TypeError, ValueError, zlib.error):
+        raise ValueError('Malformed cursor')
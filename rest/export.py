@@ -0,0 +1,386 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+
+import h5py
+import numpy as np
+
+from .formats import pdb_model
+
+EXPORT_FORMATS = {
+    'npz': 'npz',
+    'pdb': 'tar.gz',
+    'hdf5': 'hdf5',
+}
+
+# Minimum number of rows of the `data` dataset read at a time
+CHUNK_ROWS = 4096
+
+# Bytes of each bead coordinate of the models, used to estimate the size of
+# an archive before it is written
+BYTES_PER_COORD = 12
+
+
+def export_cost(hdf5_store, resolution):
+    """
+    Number of bead coordinates read by an export of a resolution, the sum of
+    beads x models over the regions
+
+    Parameters
+    ----------
+    hdf5_store : CoordStore
+    resolution : int
+
+    Returns
+    -------
+    int
+    """
+    index = hdf5_store.get_index(resolution)
+    return int(((index.row_j - index.row_i) * index.model_counts).sum())
+
+
+def iter_regions(hdf5_store, resolution, chunk_rows=CHUNK_ROWS):
+    """
+    Read all of the regions at a resolution in the order that they are held
+    in the `data` dataset. Neighbouring regions are read together so that
+    each read covers at least `chunk_rows` rows.
+
+    Parameters
+    ----------
+    hdf5_store : CoordStore
+    resolution : int
+    chunk_rows : int
+
+    Returns
+    -------
+    generator
+        (region_id, region, model_params, coords) for each region, where
+        coords has the shape (beads, models, 3)
+    """
+    index = hdf5_store.get_index(resolution)
+    dset = hdf5_store.get_dataset(resolution)
+
+    order = np.argsort(index.row_i, kind='mergesort')
+    batch = []
+    batch_rows = 0
+    for pos in order:
+        region_id = index.region_ids[pos]
+        batch.append(region_id)
+        batch_rows += int(index.row_j[pos] - index.row_i[pos])
+        if batch_rows >= chunk_rows or pos == order[-1]:
+            regions = [index.get_region(region) for region in batch]
+            params = [hdf5_store.get_models(resolution, region) for region in batch]
+            first = regions[0]['i']
+            last = max(region['j'] for region in regions)
+            width = max(len(param) for param in params)
+            block = dset[first:last, 0:width, :]
+            for region_id, region, param in zip(batch, regions, params):
+                coords = block[region['i'] - first:region['j'] - first, 0:len(param), :]
+                yield region_id, region, param, coords
+            batch = []
+            batch_rows = 0
+
+
+def write_npz(hdf5_store, resolution, out_path, progress):
+    """
+    Write a zip of NumPy arrays. Each region has `<region_id>.npy` holding
+    the coordinates with shape (beads, models, 3) and
+    `<region_id>_models.npy` holding [model_id, cluster_id] for each model.
+    `regions.json` lists the location of each region.
+    """
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(out_path))
+    regions = {}
+    try:
+        with zipfile.ZipFile(out_path, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as zip_file:
+            for region_id, region, params, coords in iter_regions(hdf5_store, resolution):
+                for name, array in ((region_id, coords), (region_id + '_models', params)):
+                    tmp_file = os.path.join(tmp_dir, name + '.npy')
+                    np.save(tmp_file, array)
+                    zip_file.write(tmp_file, name + '.npy')
+                    os.remove(tmp_file)
+                regions[region_id] = region
+                progress(coords.shape[0])
+            zip_file.writestr('regions.json', json.dumps(regions))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def write_pdb(hdf5_store, resolution, out_path, progress):
+    """
+    Write a gzipped tar of PDB files, one for each region holding all of its
+    models
+    """
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(out_path))
+    try:
+        with tarfile.open(out_path, 'w:gz') as tar_file:
+            for region_id, _, params, coords in iter_regions(hdf5_store, resolution):
+                tmp_file = os.path.join(tmp_dir, region_id + '.pdb')
+                with open(tmp_file, 'wb') as pdb_file:
+                    for k in range(len(params)):
+                        pdb_file.write(pdb_model(k + 1, coords[:, k, :]))
+                    pdb_file.write(b'END\n')
+                tar_file.add(tmp_file, region_id + '.pdb')
+                os.remove(tmp_file)
+                progress(coords.shape[0])
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def write_hdf5(hdf5_store, resolution, out_path, progress):
+    """
+    Write an HDF5 file with just the one resolution. The `data` dataset is
+    trimmed to the largest number of models in a region.
+    """
+    src_grp = hdf5_store.file_handle[str(resolution)]
+    src_dset = src_grp['data']
+    index = hdf5_store.get_index(resolution)
+    width = max(
+        [len(hdf5_store.get_models(resolution, region)) for region in index.region_ids] or [1]
+    )
+
+    with h5py.File(out_path, 'w') as out_file:
+        grp = out_file.create_group(str(resolution))
+        src_grp.copy('meta', grp)
+        dset = grp.create_dataset(
+            'data', (src_dset.shape[0], width, 3), maxshape=(None, 1000, 3),
+            dtype=src_dset.dtype, chunks=True, compression="gzip")
+        for key, value in src_dset.attrs.items():
+            dset.attrs[key] = value
+
+        for start in range(0, src_dset.shape[0], CHUNK_ROWS):
+            end = min(start + CHUNK_ROWS, src_dset.shape[0])
+            dset[start:end] = src_dset[start:end, 0:width, :]
+            progress(end - start)
+
+
+WRITERS = {
+    'npz': write_npz,
+    'pdb': write_pdb,
+    'hdf5': write_hdf5,
+}
+
+
+class ExportJob(object):
+    """
+    State of a single export
+    """
+
+    def __init__(self, user_id, file_id, file_path, resolution, fmt, estimated_bytes=0):
+        self.job_id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.file_id = file_id
+        self.file_path = file_path
+        self.resolution = resolution
+        self.format = fmt
+        self.status = 'queued'
+        self.rows_done = 0
+        self.rows_total = 0
+        self.created = time.time()
+        self.finished = None
+        self.error = None
+        self.output = None
+        self.estimated_bytes = estimated_bytes
+
+    def report(self):
+        """
+        JSON serialisable summary of the job
+        """
+        return {
+            'job_id': self.job_id,
+            'file_id': self.file_id,
+            'resolution': self.resolution,
+            'format': self.format,
+            'status': self.status,
+            'rows_done': self.rows_done,
+            'rows_total': self.rows_total,
+            'created': self.created,
+            'finished': self.finished,
+            'error': self.error
+        }
+
+
+class ExportManager(object):
+    """
+    Queue of export jobs that are run on a pool of background threads so that
+    whole file dumps do not use the request threads. Each user can have a
+    limited number of unfinished jobs and the archives are kept within a
+    quota on the size of the export directory.
+    """
+
+    def __init__(self, export_dir, workers=2, max_age=86400, max_user_jobs=2,
+                 quota_bytes=10 * 1024 ** 3):
+        """
+        Parameters
+        ----------
+        export_dir : str
+            Directory that the archives are written to
+        workers : int
+            Number of exports that run at the same time
+        max_age : int
+            Seconds to keep finished jobs and their archives
+        max_user_jobs : int
+            Number of queued or running jobs that each user can have
+        quota_bytes : int
+            Size that the export directory can grow to, counting the
+            estimated size of the archives of the queued jobs
+        """
+        from multiprocessing.pool import ThreadPool
+
+        if not os.path.isdir(export_dir):
+            os.makedirs(export_dir)
+
+        self.export_dir = export_dir
+        self.max_age = max_age
+        self.max_user_jobs = max_user_jobs
+        self.quota_bytes = quota_bytes
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPool(workers)
+
+    def submit(self, user_id, file_id, file_path, resolution, fmt, estimated_bytes=0):
+        """
+        Queue an export
+
+        Parameters
+        ----------
+        user_id : str
+        file_id : str
+        file_path : str
+        resolution : int
+        fmt : str
+            Key of EXPORT_FORMATS
+        estimated_bytes : int
+            Expected size of the archive, held against the quota until the
+            job has started writing it
+
+        Returns
+        -------
+        ExportJob
+
+        Raises
+        ------
+        IOError
+            `TooManyExports` if the user already has max_user_jobs unfinished
+            jobs or `ExportQuotaExceeded` if the archive would not fit in the
+            quota
+        """
+        self.purge()
+        used = self.disk_usage()
+        with self._lock:
+            unfinished = [
+                job for job in self.jobs.values() if job.status in ('queued', 'running')
+            ]
+            if sum(job.user_id == user_id for job in unfinished) >= self.max_user_jobs:
+                raise IOError('TooManyExports')
+            reserved = sum(job.estimated_bytes for job in unfinished if job.status == 'queued')
+            if used + reserved + estimated_bytes > self.quota_bytes:
+                raise IOError('ExportQuotaExceeded')
+            job = ExportJob(user_id, file_id, file_path, resolution, fmt, estimated_bytes)
+            self.jobs[job.job_id] = job
+        self._pool.apply_async(self._run, (job,))
+        return job
+
+    def disk_usage(self):
+        """
+        Bytes used by the files in the export directory, including the
+        archives that are being written
+
+        Returns
+        -------
+        int
+        """
+        used = 0
+        for name in os.listdir(self.export_dir):
+            try:
+                used += os.path.getsize(os.path.join(self.export_dir, name))
+            except OSError:
+                pass
+        return used
+
+    def get(self, job_id, user_id):
+        """
+        Get a job, only if it belongs to the user
+
+        Returns
+        -------
+        ExportJob | None
+        """
+        job = self.jobs.get(job_id)
+        if job is None or job.user_id != user_id:
+            return None
+        return job
+
+    def _run(self, job):
+        from .coord_store import get_store
+
+        job.status = 'running'
+        out_path = os.path.join(
+            self.export_dir, job.job_id + '.' + EXPORT_FORMATS[job.format])
+
+        def progress(rows):
+            job.rows_done += rows
+
+        try:
+            hdf5_store = get_store(job.file_path)
+            job.rows_total = int(hdf5_store.get_dataset(job.resolution).shape[0])
+            WRITERS[job.format](hdf5_store, job.resolution, out_path + '.part', progress)
+            os.rename(out_path + '.part', out_path)
+            job.output = out_path
+            job.status = 'done'
+        except Exception as err:  # pylint: disable=broad-except
+            job.error = str(err)
+            job.status = 'failed'
+            if os.path.isfile(out_path + '.part'):
+                os.remove(out_path + '.part')
+        job.finished = time.time()
+
+    def purge(self):
+        """
+        Remove finished jobs that are older than max_age along with their
+        archives. Archives older than max_age that do not belong to a known
+        job, e.g. from before a restart, are removed as well.
+        """
+        cutoff = time.time() - self.max_age
+        with self._lock:
+            expired = [
+                job for job in self.jobs.values()
+                if job.finished is not None and job.finished < cutoff
+            ]
+            for job in expired:
+                del self.jobs[job.job_id]
+            live = set(job.job_id for job in self.jobs.values())
+        for job in expired:
+            if job.output is not None and os.path.isfile(job.output):
+                os.remove(job.output)
+        for name in os.listdir(self.export_dir):
+            path = os.path.join(self.export_dir, name)
+            try:
+                if name.split('.')[0] not in live and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
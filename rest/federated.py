@@ -0,0 +1,108 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import time
+
+
+def split_file_ids(file_str):
+    """
+    Split a comma separated list of file ids, dropping blanks and repeats
+    while keeping the order
+
+    Parameters
+    ----------
+    file_str : str
+
+    Returns
+    -------
+    list
+    """
+    file_ids = []
+    for file_id in file_str.split(','):
+        file_id = file_id.strip()
+        if file_id and file_id not in file_ids:
+            file_ids.append(file_id)
+    return file_ids
+
+
+class Federation(object):
+    """
+    Pool of threads used to run the same query against several files at once.
+    Each file is read through its own CoordStore so that a slow or failing
+    file does not hold up the others.
+    """
+
+    def __init__(self, workers=8):
+        """
+        Parameters
+        ----------
+        workers : int
+            Number of files that are queried concurrently
+        """
+        from multiprocessing.pool import ThreadPool
+
+        self.workers = workers
+        self._pool = ThreadPool(workers)
+
+    def run(self, func, file_ids, timeout=30):
+        """
+        Call `func(file_id)` for each of the files
+
+        Parameters
+        ----------
+        func : function
+            Function that takes a file_id and returns a JSON serialisable
+            result for that file
+        file_ids : list
+        timeout : int
+            Seconds to wait for all of the files. Files that have not finished
+            by then are reported as errors.
+
+        Returns
+        -------
+        tuple
+            (results, errors), both dicts keyed by file_id. The errors are
+            `Timeout` or `Failed` for each file that did not return a result.
+            The details of failures are printed rather than returned so that
+            they do not reach clients.
+        """
+        pending = [
+            (file_id, self._pool.apply_async(func, (file_id,))) for file_id in file_ids
+        ]
+        deadline = time.time() + timeout
+
+        results = {}
+        errors = {}
+        for file_id, async_result in pending:
+            async_result.wait(max(0, deadline - time.time()))
+            if not async_result.ready():
+                errors[file_id] = 'Timeout'
+                continue
+            try:
+                results[file_id] = async_result.get()
+            except Exception as err:  # pylint: disable=broad-except
+                print("Federated query failed for " + str(file_id) + ": " + repr(err))
+                errors[file_id] = 'Failed'
+        return results, errors
+
+    def close(self):
+        """
+        Stop the worker threads
+        """
+        self._pool.terminate()
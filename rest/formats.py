@@ -0,0 +1,365 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+Writers for standard structural formats (PDB, mmCIF and XYZ), along with a
+streamed form of the GetModel JSON.
+
+Each bead is written as a carbon atom named `CA` in a residue `BEA` on chain
+`A` with the bead number as the residue number. Lines are built a column at a
+time as arrays of bytes so that no Python objects are created per bead.
+"""
+
+from __future__ import print_function
+
+import json
+
+import numpy as np
+
+FORMATS = {
+    'pdb': 'chemical/x-pdb',
+    'cif': 'chemical/x-mmcif',
+    'xyz': 'chemical/x-xyz',
+}
+
+# Number of models read from the dataset at a time when streaming
+MODELS_PER_READ = 32
+
+# Memory used for each coordinate while a GetModel page is built: the int32
+# value read from the file, the Python int in the list and its JSON text
+JSON_BYTES_PER_COORD = 48
+
+
+def estimate_json_bytes(beads, models):
+    """
+    Estimate of the memory needed to build a GetModel JSON page
+
+    Parameters
+    ----------
+    beads : int
+        Number of beads in the region
+    models : int
+        Number of models in the page
+
+    Returns
+    -------
+    int
+    """
+    return int(beads) * int(models) * 3 * JSON_BYTES_PER_COORD
+
+
+def _const(text, rows):
+    """
+    Column of identical text on every row
+    """
+    row = np.frombuffer(text.encode('ascii'), dtype=np.uint8)
+    return np.broadcast_to(row, (rows, len(row)))
+
+
+def _int_column(values, width):
+    """
+    Right aligned integers as a (rows, width) array of ASCII bytes. Values
+    that do not fit in the width are filled with `*`.
+    """
+    values = np.asarray(values, dtype=np.int64)
+    rows = len(values)
+    out = np.full((rows, width), ord(' '), dtype=np.uint8)
+
+    negative = values < 0
+    remaining = np.abs(values)
+    digits = np.ones(rows, dtype=np.int64)
+    limit = 10
+    while True:
+        more = remaining >= limit
+        if not more.any():
+            break
+        digits += more
+        limit *= 10
+
+    for pos in range(width - 1, -1, -1):
+        written = width - 1 - pos
+        mask = written < digits
+        out[mask, pos] = ord('0') + remaining[mask] % 10
+        remaining[mask] //= 10
+        sign = negative & (written == digits)
+        out[sign, pos] = ord('-')
+
+    overflow = digits + negative > width
+    out[overflow] = ord('*')
+    return out
+
+
+def _fixed_column(values, width, decimals):
+    """
+    Integers written as a fixed point number, e.g. `  12.000`
+    """
+    if decimals == 0:
+        return np.hstack([_int_column(values, width - 1), _const('.', len(values))])
+    return np.hstack([
+        _int_column(values, width - decimals - 1),
+        _const('.' + '0' * decimals, len(values))
+    ])
+
+
+def _lines(columns):
+    """
+    Join the columns and add a newline to each row
+    """
+    rows = columns[0].shape[0]
+    return np.hstack(list(columns) + [_const('\n', rows)]).tobytes()
+
+
+def _pdb_decimals(coords):
+    """
+    PDB coordinates are 8 characters wide, use as many decimal places as fit
+    """
+    largest = max(int(coords.max()), -10 * int(coords.min()), 1) if coords.size else 1
+    for decimals in (3, 2, 1):
+        if largest < 10 ** (7 - decimals):
+            return decimals
+    return 0
+
+
+def pdb_model(model_num, coords):
+    """
+    Write one model in PDB format
+
+    Parameters
+    ----------
+    model_num : int
+        Number of the model within the file
+    coords : numpy.ndarray
+        Array of shape (beads, 3)
+
+    Returns
+    -------
+    bytes
+    """
+    beads = len(coords)
+    bead_num = np.arange(1, beads + 1)
+    decimals = _pdb_decimals(coords)
+    atoms = _lines([
+        _const('ATOM  ', beads),
+        _int_column(bead_num % 100000, 5),
+        _const('  CA  BEA A', beads),
+        _int_column(bead_num % 10000, 4),
+        _const('    ', beads),
+        _fixed_column(coords[:, 0], 8, decimals),
+        _fixed_column(coords[:, 1], 8, decimals),
+        _fixed_column(coords[:, 2], 8, decimals),
+        _const('  1.00  0.00           C  ', beads),
+    ])
+    header = 'MODEL     {:>4d}\n'.format(model_num % 10000).encode('ascii')
+    return header + atoms + b'ENDMDL\n'
+
+
+CIF_HEADER = """data_{name}
+#
+loop_
+_atom_site.group_PDB
+_atom_site.id
+_atom_site.type_symbol
+_atom_site.label_atom_id
+_atom_site.label_comp_id
+_atom_site.label_asym_id
+_atom_site.label_seq_id
+_atom_site.Cartn_x
+_atom_site.Cartn_y
+_atom_site.Cartn_z
+_atom_site.pdbx_PDB_model_num
+"""
+
+
+def cif_model(model_num, coords):
+    """
+    Write the atom_site rows for one model in mmCIF format
+
+    Parameters
+    ----------
+    model_num : int
+        Number of the model within the file
+    coords : numpy.ndarray
+        Array of shape (beads, 3)
+
+    Returns
+    -------
+    bytes
+    """
+    beads = len(coords)
+    bead_num = np.arange(1, beads + 1)
+    return _lines([
+        _const('ATOM ', beads),
+        _int_column(bead_num, 10),
+        _const(' C CA BEA A ', beads),
+        _int_column(bead_num, 10),
+        _const(' ', beads),
+        _fixed_column(coords[:, 0], 15, 3),
+        _const(' ', beads),
+        _fixed_column(coords[:, 1], 15, 3),
+        _const(' ', beads),
+        _fixed_column(coords[:, 2], 15, 3),
+        _const(' ', beads),
+        _int_column(np.full(beads, model_num), 10),
+    ])
+
+
+def xyz_model(comment, coords):
+    """
+    Write one model in XYZ format
+
+    Parameters
+    ----------
+    comment : str
+        Text for the comment line
+    coords : numpy.ndarray
+        Array of shape (beads, 3)
+
+    Returns
+    -------
+    bytes
+    """
+    beads = len(coords)
+    header = '{}\n{}\n'.format(beads, comment).encode('ascii')
+    return header + _lines([
+        _const('C ', beads),
+        _fixed_column(coords[:, 0], 15, 3),
+        _const(' ', beads),
+        _fixed_column(coords[:, 1], 15, 3),
+        _const(' ', beads),
+        _fixed_column(coords[:, 2], 15, 3),
+    ])
+
+
+def stream_models(fmt, hdf5_store, resolution, region_id, columns, beads=None):
+    """
+    Generator of the models of a region in a structural format. The models
+    are read from the `data` dataset MODELS_PER_READ at a time and written one
+    model at a time.
+
+    Parameters
+    ----------
+    fmt : str
+        pdb, cif or xyz
+    hdf5_store : CoordStore
+    resolution : int
+    region_id : str
+    columns : list
+        Columns of the models to write
+    beads : tuple
+        (first, last) beads of the region to write, None for all of them
+
+    Returns
+    -------
+    generator
+        bytes for each model
+    """
+    if fmt == 'cif':
+        yield CIF_HEADER.format(name=region_id).encode('ascii')
+
+    model_num = 0
+    for start in range(0, len(columns), MODELS_PER_READ):
+        model_params, coords = hdf5_store.get_model_page(
+            resolution, region_id, columns[start:start + MODELS_PER_READ], beads)
+        for k in range(len(model_params)):
+            model_num += 1
+            if fmt == 'pdb':
+                yield pdb_model(model_num, coords[:, k, :])
+            elif fmt == 'cif':
+                yield cif_model(model_num, coords[:, k, :])
+            else:
+                comment = 'region={} model={} cluster={}'.format(
+                    region_id, model_params[k][0], model_params[k][1])
+                yield xyz_model(comment, coords[:, k, :])
+
+    if fmt == 'pdb':
+        yield b'END\n'
+    elif fmt == 'cif':
+        yield b'#\n'
+
+
+def json_models(model_params, coords):
+    """
+    Models of a GetModel page in the TADbit JSON layout
+
+    Parameters
+    ----------
+    model_params : numpy.ndarray
+        [model_id, cluster_id] for each of the models
+    coords : numpy.ndarray
+        Array of shape (beads, models, 3)
+
+    Returns
+    -------
+    list
+        ref and data of each model
+    """
+    return [
+        {
+            'ref': str(model_params[k][0]),
+            'data': coords[:, k, :].ravel().tolist()
+        } for k in range(len(model_params))
+    ]
+
+
+def split_header(header):
+    """
+    Split the TADbit header of a region into the keys that are written before
+    the models and those that are written after them
+
+    Returns
+    -------
+    tuple
+        (head, tail) dicts
+    """
+    head = dict((key, header[key]) for key in ('metadata', 'object'))
+    tail = dict((key, value) for key, value in header.items() if key not in head)
+    return head, tail
+
+
+def stream_json(hdf5_store, resolution, region_id, columns, beads=None, tail=None):
+    """
+    Generator of the GetModel JSON for a set of models. The models are read
+    MODELS_PER_READ at a time so that only one batch is held in memory.
+
+    Parameters
+    ----------
+    hdf5_store : CoordStore
+    resolution : int
+    region_id : str
+    columns : list
+        Columns of the models to write
+    beads : tuple
+        (first, last) beads of the region to write, None for all of them
+    tail : dict
+        Keys added after the TADbit keys of the region, e.g. `_links`
+
+    Returns
+    -------
+    generator
+        bytes of the JSON document
+    """
+    head, trailer = split_header(hdf5_store.get_model_header(resolution, region_id))
+    trailer.update(tail or {})
+    yield (json.dumps(head)[:-1] + ', "models": [').encode('utf-8')
+
+    separator = ''
+    for start in range(0, len(columns), MODELS_PER_READ):
+        model_params, coords = hdf5_store.get_model_page(
+            resolution, region_id, columns[start:start + MODELS_PER_READ], beads)
+        for model in json_models(model_params, coords):
+            yield (separator + json.dumps(model)).encode('utf-8')
+            separator = ', '
+
+    yield ('], ' + json.dumps(trailer)[1:] + '\n').encode('utf-8')
@@ -0,0 +1,130 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import os
+import subprocess
+import sys
+
+BASEDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that should only be loaded once a request needs them
+HEAVY_MODULES = ['h5py', 'numpy', 'reader', 'mg_rest_util', 'dmp']
+
+
+def measure(module='rest.app', python=None, statements=None):
+    """
+    Import a module in a fresh interpreter with `-X importtime` and collect
+    the timings that are reported for each of the imported modules.
+
+    Requires Python 3.7+ for the interpreter that is being measured.
+
+    Parameters
+    ----------
+    module : str
+        Module to import
+    python : str
+        Python interpreter to use. Defaults to the current interpreter.
+    statements : list
+        Further statements to run once the module has been imported
+
+    Returns
+    -------
+    list
+        List of (self_us, cumulative_us, module_name) tuples in the order that
+        the imports completed
+    """
+    if python is None:
+        python = sys.executable
+
+    code = '; '.join(['import ' + module] + (statements or []))
+    process = subprocess.Popen(
+        [python, '-X', 'importtime', '-c', code],
+        cwd=BASEDIR, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    _, stderr = process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError(stderr.decode('utf-8', 'replace'))
+
+    timings = []
+    for line in stderr.decode('utf-8', 'replace').splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            self_us = int(fields[0])
+            cumulative_us = int(fields[1])
+        except ValueError:
+            # Header line
+            continue
+        timings.append((self_us, cumulative_us, fields[2].strip()))
+
+    return timings
+
+
+def total_time(timings, module='rest.app'):
+    """
+    Cumulative import time for a module in microseconds
+    """
+    for _, cumulative_us, name in timings:
+        if name == module:
+            return cumulative_us
+    raise KeyError(module)
+
+
+def heavy_imports(timings):
+    """
+    List the modules from HEAVY_MODULES that were imported
+    """
+    names = set(name for _, _, name in timings)
+    return [name for name in HEAVY_MODULES if name in names]
+
+
+def main():
+    """
+    Print a report of the slowest imports for a module
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Import time report")
+    parser.add_argument("--module", default="rest.app", help="Module to import")
+    parser.add_argument("--top", type=int, default=20, help="Number of modules to list")
+    parser.add_argument(
+        "--budget_ms", type=int, default=None,
+        help="Exit with an error if the import takes longer than this")
+    args = parser.parse_args()
+
+    timings = measure(args.module)
+    total_us = total_time(timings, args.module)
+
+    print("{:>12} {:>12}  {}".format("self [us]", "cumul [us]", "module"))
+    for self_us, cumulative_us, name in sorted(timings, reverse=True)[:args.top]:
+        print("{:>12} {:>12}  {}".format(self_us, cumulative_us, name))
+    print()
+    print("Total import time for {}: {:.1f} ms".format(args.module, total_us / 1000.0))
+
+    heavy = heavy_imports(timings)
+    if heavy:
+        print("Heavy modules imported at start up: " + ", ".join(heavy))
+
+    if args.budget_ms is not None and total_us > args.budget_ms * 1000:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
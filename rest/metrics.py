@@ -0,0 +1,101 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import threading
+
+
+def memory_usage():
+    """
+    Current and peak resident memory of this worker process
+
+    Returns
+    -------
+    dict
+        pid, rss_bytes and peak_rss_bytes. Values that cannot be read on this
+        platform are None.
+    """
+    usage = {'pid': os.getpid(), 'rss_bytes': None, 'peak_rss_bytes': None}
+
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kB, macOS reports bytes
+        usage['peak_rss_bytes'] = peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        pass
+
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    usage['rss_bytes'] = int(line.split()[1]) * 1024
+    except (OSError, IOError):
+        pass
+
+    return usage
+
+
+class Metrics(object):
+    """
+    Counters and high-water marks for this worker process
+    """
+
+    def __init__(self):
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def incr(self, name, amount=1):
+        """
+        Add to a counter
+        """
+        with self._lock:
+            self.values[name] = self.values.get(name, 0) + amount
+
+    def high_water(self, name, value):
+        """
+        Record a value, keeping the largest seen
+        """
+        with self._lock:
+            if value > self.values.get(name, 0):
+                self.values[name] = value
+
+    def report(self):
+        """
+        Snapshot of the counters along with the memory usage of the process
+
+        Returns
+        -------
+        dict
+        """
+        with self._lock:
+            report = dict(self.values)
+        report['memory'] = memory_usage()
+        return report
+
+    def clear(self):
+        """
+        Reset all of the counters
+        """
+        with self._lock:
+            self.values.clear()
+
+
+METRICS = Metrics()
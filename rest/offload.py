@@ -0,0 +1,166 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+Process pool for building the JSON bodies of large GetModel pages.
+
+Converting the coordinates of a page to lists and encoding them holds the GIL
+for the whole page, which stalls the other requests handled by the same
+server process. Pages handed to the pool are copied once into shared memory
+(Python 3.8+, otherwise they are pickled) and the pool returns the bytes of
+the response body. The pool processes are started with `spawn` so that they
+do not inherit the HDF5 file handles or the server threads.
+"""
+
+from __future__ import print_function
+
+import json
+import threading
+
+import numpy as np
+
+from .formats import json_models
+from .metrics import METRICS
+from .tracing import span
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+
+def build_json(head, tail, model_params, coords, settings=None):
+    """
+    Encode a GetModel page
+
+    Parameters
+    ----------
+    head : dict
+        Keys of the page that come before the models
+    tail : dict
+        Keys of the page that come after the models
+    model_params : numpy.ndarray
+        [model_id, cluster_id] for each of the models
+    coords : numpy.ndarray
+        Array of shape (beads, models, 3)
+    settings : dict
+        Keyword arguments for json.dumps
+
+    Returns
+    -------
+    bytes
+        JSON body, ending with a new line
+    """
+    payload = dict(head)
+    payload['models'] = json_models(model_params, coords)
+    payload.update(tail)
+    return (json.dumps(payload, **(settings or {})) + '\n').encode('utf-8')
+
+
+def _build_shared(head, tail, model_params, coords, settings):
+    """
+    Run `build_json` in a pool process. coords is either the array or the
+    (name, shape, dtype) of a shared memory block holding it.
+    """
+    if not isinstance(coords, tuple):
+        return build_json(head, tail, model_params, coords, settings)
+
+    name, shape, dtype = coords
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        view = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        body = build_json(head, tail, model_params, view, settings)
+        del view
+    finally:
+        block.close()
+    return body
+
+
+class Offload(object):
+    """
+    Pool of processes that build GetModel pages
+    """
+
+    def __init__(self, processes=2, max_queue=32):
+        """
+        Parameters
+        ----------
+        processes : int
+            Number of pool processes
+        max_queue : int
+            Number of pages that can be waiting for or using the pool. Pages
+            beyond this are built in the server process.
+        """
+        import multiprocessing
+
+        try:
+            context = multiprocessing.get_context('spawn')
+        except AttributeError:
+            context = multiprocessing
+
+        self.processes = processes
+        self.max_queue = max_queue
+        self.queued = 0
+        self._lock = threading.Lock()
+        self._pool = context.Pool(processes)
+
+    def build_json(self, head, tail, model_params, coords, settings=None):
+        """
+        Encode a GetModel page in one of the pool processes, blocking the
+        calling thread without holding the GIL until it is done
+
+        Parameters are the same as for `build_json`
+
+        Returns
+        -------
+        bytes | None
+            JSON body, or None if the queue is full
+        """
+        with self._lock:
+            if self.queued >= self.max_queue:
+                METRICS.incr('offload_queue_full')
+                return None
+            self.queued += 1
+            METRICS.high_water('offload_queue_high', self.queued)
+
+        block = None
+        try:
+            with span('offload.build_json', bytes_in=coords.nbytes) as current:
+                if shared_memory is not None and coords.nbytes:
+                    block = shared_memory.SharedMemory(create=True, size=coords.nbytes)
+                    view = np.ndarray(coords.shape, dtype=coords.dtype, buffer=block.buf)
+                    view[...] = coords
+                    del view
+                    shared = (block.name, coords.shape, coords.dtype.str)
+                else:
+                    shared = coords
+                body = self._pool.apply(
+                    _build_shared, (head, tail, model_params, shared, settings))
+                current.set_attribute('bytes_out', len(body))
+            METRICS.incr('offload_pages')
+            return body
+        finally:
+            if block is not None:
+                block.close()
+                block.unlink()
+            with self._lock:
+                self.queued -= 1
+
+    def close(self):
+        """
+        Stop the pool processes
+        """
+        self._pool.terminate()
+        self._pool.join()
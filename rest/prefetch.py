@@ -0,0 +1,154 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+Background prefetching of the regions and pages that a browsing client is
+likely to ask for next.
+
+Work is run on a small pool of threads at a lowered scheduling priority
+(where the platform allows it). Work is dropped rather than queued when the
+server is busy, when the same work is already queued, or when the queue is
+full. Queued work that has not started is cancelled if the server becomes
+busy, so prefetching never competes with requests for the disk.
+"""
+
+from __future__ import print_function
+
+import os
+import threading
+import time
+
+from .metrics import METRICS
+
+
+def _lower_priority():
+    """
+    Lower the scheduling priority of the calling pool thread. Only Linux
+    applies the priority to a single thread, elsewhere this does nothing.
+    """
+    get_native_id = getattr(threading, 'get_native_id', None)
+    if get_native_id is None or not hasattr(os, 'setpriority'):
+        return
+    try:
+        os.setpriority(os.PRIO_PROCESS, get_native_id(), 10)
+    except OSError:
+        pass
+
+
+class Prefetcher(object):
+    """
+    Bounded pool of low priority threads that runs prefetch work
+    """
+
+    def __init__(self, workers=2, max_pending=16, max_active=4):
+        """
+        Parameters
+        ----------
+        workers : int
+            Number of prefetch threads
+        max_pending : int
+            Number of prefetches that can be queued or running at once
+        max_active : int
+            Prefetches are skipped or cancelled while more than this many
+            requests are being handled
+        """
+        from multiprocessing.pool import ThreadPool
+
+        self.max_pending = max_pending
+        self.max_active = max_active
+        self.active = 0
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._pool = ThreadPool(workers, initializer=_lower_priority)
+
+    def request_started(self):
+        """
+        Count a request that is being handled
+        """
+        with self._lock:
+            self.active += 1
+
+    def request_finished(self):
+        """
+        Count a request that has finished
+        """
+        with self._lock:
+            self.active = max(0, self.active - 1)
+
+    def busy(self):
+        """
+        Whether there are too many requests in flight to prefetch
+        """
+        return self.active > self.max_active
+
+    def pending(self):
+        """
+        Number of prefetches that are queued or running
+        """
+        return len(self._pending)
+
+    def submit(self, key, func):
+        """
+        Queue work to be run in the background
+
+        Parameters
+        ----------
+        key : tuple
+            Identifies the work, so that the same work is only queued once
+        func : function
+            Called with no arguments
+
+        Returns
+        -------
+        bool
+            True if the work was queued
+        """
+        with self._lock:
+            if self.active > self.max_active or len(self._pending) >= self.max_pending:
+                METRICS.incr('prefetch_skipped')
+                return False
+            if key in self._pending:
+                return False
+            self._pending.add(key)
+        METRICS.incr('prefetch_queued')
+        self._pool.apply_async(self._run, (key, func))
+        return True
+
+    def _run(self, key, func):
+        try:
+            if self.busy():
+                METRICS.incr('prefetch_cancelled')
+                return
+            func()
+            METRICS.incr('prefetch_done')
+        except Exception:  # pylint: disable=broad-except
+            METRICS.incr('prefetch_errors')
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def wait(self):
+        """
+        Block until all of the queued work has finished
+        """
+        while self._pending:
+            time.sleep(0.01)
+
+    def close(self):
+        """
+        Stop the threads once the queued work has finished
+        """
+        self._pool.close()
+        self._pool.join()
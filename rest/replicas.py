@@ -0,0 +1,341 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+Local read replicas of the `data` datasets of hot resolutions.
+
+The `/<resolution>/data` datasets written by `parsing_models.py` are gzip
+compressed, so every read that misses the HDF5 chunk cache pays for
+decompression. The replica manager counts the reads of each (file,
+resolution) pair made by the CoordStores. Once a pair has been read
+`hot_reads` times, its `data` dataset is copied in the background into the
+cache directory, either uncompressed or compressed with LZ4. LZ4 needs the
+optional `hdf5plugin` package. The stores then read from the replica instead.
+
+Replicas record the inode and modification time of the file that they were
+copied from and are ignored and removed once the file has been replaced. The
+cache directory is kept within a quota by removing the least recently read
+replicas. Listeners are told about each replica that is removed so that the
+stores stop reading from it, and its space is freed once the reads still
+using it have finished. Only the reads made for clients are counted, not
+those made by prefetching or warm up.
+"""
+
+from __future__ import print_function
+
+import hashlib
+import os
+import threading
+import time
+
+from collections import OrderedDict
+
+import h5py
+
+from .metrics import METRICS
+
+# Rows of the `data` dataset copied at a time
+COPY_ROWS = 1024
+
+
+def _attr_str(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return str(value)
+
+
+def _lz4_options():
+    """
+    Dataset creation arguments for the LZ4 filter from hdf5plugin
+    """
+    import hdf5plugin
+
+    return dict(hdf5plugin.LZ4())
+
+
+class ReplicaManager(object):
+    """
+    Builds, finds and evicts the replicas within a cache directory
+    """
+
+    def __init__(self, cache_dir, quota_bytes=10 * 1024 ** 3, hot_reads=100,
+                 compression=None):
+        """
+        Parameters
+        ----------
+        cache_dir : str
+            Directory that the replicas are written to
+        quota_bytes : int
+            Total size of the replicas on disk
+        hot_reads : int
+            Number of reads of a resolution of a file before it is replicated
+        compression : str
+            None for uncompressed replicas or `lz4`
+        """
+        if compression not in (None, 'lz4'):
+            raise ValueError('Unknown replica compression: ' + str(compression))
+        if compression == 'lz4':
+            _lz4_options()
+
+        self.cache_dir = cache_dir
+        self.quota_bytes = quota_bytes
+        self.hot_reads = hot_reads
+        self.compression = compression
+        self.reads = {}
+        self.size = 0
+        self._replicas = OrderedDict()
+        self._building = set()
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._pool = None
+
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self._scan()
+
+    def _path(self, file_path, resolution):
+        digest = hashlib.sha1(os.path.abspath(file_path).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest[:20] + '-' + str(resolution) + '.h5')
+
+    def _scan(self):
+        """
+        Pick up the replicas left in the cache directory by an earlier run,
+        oldest first
+        """
+        found = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith('.tmp'):
+                os.remove(path)
+                continue
+            if not name.endswith('.h5'):
+                continue
+            try:
+                with h5py.File(path, 'r') as replica:
+                    key = (_attr_str(replica.attrs['source']), str(replica.attrs['resolution']))
+                found.append((os.path.getatime(path), key, path))
+            except (IOError, OSError, KeyError):
+                os.remove(path)
+
+        for _, key, path in sorted(found):
+            self._replicas[key] = (path, os.path.getsize(path))
+            self.size += self._replicas[key][1]
+
+    def add_listener(self, func):
+        """
+        Call `func(file_path, resolution)` whenever a replica is removed,
+        before its file is deleted, so that open handles on it can be dropped
+
+        Parameters
+        ----------
+        func : function
+        """
+        with self._lock:
+            if func not in self._listeners:
+                self._listeners.append(func)
+
+    def record(self, file_path, version, resolution):
+        """
+        Count a read of a resolution of a file, marking its replica as
+        recently used or starting to build one once the resolution is hot
+
+        Parameters
+        ----------
+        file_path : str
+        version : tuple
+            Inode and modification time of the file, from
+            `coord_store.file_version`
+        resolution : int
+        """
+        key = (os.path.abspath(file_path), str(resolution))
+        with self._lock:
+            if key in self._replicas:
+                self._replicas[key] = self._replicas.pop(key)
+                return
+            count = self.reads.get(key, 0) + 1
+            self.reads[key] = count
+            if count < self.hot_reads or key in self._building:
+                return
+            self._building.add(key)
+            if self._pool is None:
+                from multiprocessing.pool import ThreadPool
+
+                self._pool = ThreadPool(1)
+        self._pool.apply_async(self._build, (file_path, version, resolution))
+
+    def open(self, file_path, version, resolution):
+        """
+        Open the replica of a resolution of a file
+
+        Parameters
+        ----------
+        file_path : str
+        version : tuple
+            Inode and modification time of the file
+        resolution : int
+
+        Returns
+        -------
+        h5py.File | None
+            None if there is no replica of this version of the file
+        """
+        key = (os.path.abspath(file_path), str(resolution))
+        with self._lock:
+            entry = self._replicas.get(key)
+        if entry is None:
+            return None
+
+        replica = h5py.File(entry[0], 'r')
+        if (int(replica.attrs['source_inode']), float(replica.attrs['source_mtime'])) != \
+                (int(version[0]), float(version[1])):
+            replica.close()
+            self._remove(key)
+            return None
+        if _attr_str(replica.attrs['compression']) == 'lz4':
+            _lz4_options()
+        return replica
+
+    def _build(self, file_path, version, resolution):
+        key = (os.path.abspath(file_path), str(resolution))
+        try:
+            self.build(file_path, version, resolution)
+        except Exception:  # pylint: disable=broad-except
+            METRICS.incr('replica_errors')
+        finally:
+            with self._lock:
+                self._building.discard(key)
+                self.reads.pop(key, None)
+
+    def build(self, file_path, version, resolution):
+        """
+        Copy the `data` dataset of a resolution into the cache directory and
+        evict cold replicas to keep within the quota
+
+        Parameters
+        ----------
+        file_path : str
+        version : tuple
+            Inode and modification time of the file that is being copied
+        resolution : int
+
+        Returns
+        -------
+        str | None
+            Location of the replica, None if it would not fit in the quota
+        """
+        key = (os.path.abspath(file_path), str(resolution))
+        path = self._path(file_path, resolution)
+        options = _lz4_options() if self.compression == 'lz4' else {}
+
+        start = time.time()
+        with h5py.File(file_path, 'r') as source:
+            data = source[str(resolution)]['data']
+            if data.size * data.dtype.itemsize > self.quota_bytes and not options:
+                METRICS.incr('replica_skipped')
+                return None
+
+            with h5py.File(path + '.tmp', 'w') as replica:
+                grp = replica.create_group(str(resolution))
+                if options:
+                    copy = grp.create_dataset(
+                        'data', data.shape, dtype=data.dtype,
+                        chunks=(min(max(data.shape[0], 1), 64),) + data.shape[1:], **options)
+                else:
+                    copy = grp.create_dataset('data', data.shape, dtype=data.dtype)
+                for row in range(0, data.shape[0], COPY_ROWS):
+                    copy[row:row + COPY_ROWS] = data[row:row + COPY_ROWS]
+                for name, value in data.attrs.items():
+                    copy.attrs[name] = value
+
+                replica.attrs['source'] = key[0]
+                replica.attrs['resolution'] = int(resolution)
+                replica.attrs['source_inode'] = int(version[0])
+                replica.attrs['source_mtime'] = float(version[1])
+                replica.attrs['compression'] = self.compression or 'none'
+
+        size = os.path.getsize(path + '.tmp')
+        if size > self.quota_bytes:
+            os.remove(path + '.tmp')
+            METRICS.incr('replica_skipped')
+            return None
+        self._remove(key)
+        os.rename(path + '.tmp', path)
+        METRICS.incr('replica_builds')
+        METRICS.incr('replica_build_seconds', time.time() - start)
+
+        with self._lock:
+            self._replicas[key] = (path, size)
+            self.size += size
+        self._evict(keep=key)
+        return path
+
+    def _remove(self, key):
+        with self._lock:
+            entry = self._replicas.pop(key, None)
+            if entry is None:
+                return
+            self.size -= entry[1]
+            listeners = list(self._listeners)
+        for func in listeners:
+            func(key[0], key[1])
+        try:
+            os.remove(entry[0])
+        except OSError:
+            pass
+
+    def _evict(self, keep=None):
+        """
+        Remove the least recently read replicas, other than `keep`, until the
+        cache directory is within the quota
+        """
+        while True:
+            with self._lock:
+                cold = [key for key in self._replicas if key != keep]
+                if self.size <= self.quota_bytes or not cold:
+                    return
+                key = cold[0]
+            METRICS.incr('replica_evictions')
+            self._remove(key)
+
+    def report(self):
+        """
+        Summary of the replicas
+
+        Returns
+        -------
+        dict
+        """
+        with self._lock:
+            return {
+                'replicas': len(self._replicas),
+                'bytes': self.size,
+                'quota_bytes': self.quota_bytes,
+                'building': len(self._building)
+            }
+
+    def wait(self):
+        """
+        Block until the replicas that are being built have been written
+        """
+        while self._building:
+            time.sleep(0.01)
+
+    def close(self):
+        """
+        Stop the build thread once the current build has finished
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
@@ -0,0 +1,218 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+Residual encoding of the models in a region against their cluster centroids.
+
+The models of a region have the same number of beads and the members of a
+cluster lie close to the model recorded as its centroid in
+`meta/centroids/<region_id>`. A query in this encoding holds the coordinates
+of each centroid once, as a keyframe, and each model as the difference from
+the keyframe of its cluster, divided by `precision` and rounded to the nearest
+integer. The keyframes cover every cluster of the query and are only sent on
+the first page. Pages that are reached through the `_next_page` and
+`_previous_page` cursors refer to the keyframes of the first page. The
+coordinates of a model are decoded with:
+
+.. code-block:: python
+
+   keyframe = keyframes[model['keyframe']]['data']
+   precision = page['encoding']['precision']
+   data = [k + r * precision for k, r in zip(keyframe, model['residual'])]
+
+With a precision of 1 the decoded coordinates are exact, otherwise each value
+is within precision / 2 of the original. `decode` does the same for a whole
+page.
+"""
+
+from __future__ import print_function
+
+import numpy as np
+
+
+def quantize(residuals, precision):
+    """
+    Divide residuals by the precision, rounding to the nearest integer with
+    halves rounded up
+
+    Parameters
+    ----------
+    residuals : numpy.ndarray
+        Integer differences from the keyframe
+    precision : int
+
+    Returns
+    -------
+    numpy.ndarray
+    """
+    residuals = residuals.astype(np.int64)
+    if precision == 1:
+        return residuals
+    return np.floor_divide(residuals + precision // 2, precision)
+
+
+def keyframe_columns(model_ids, centroids, query_params, query_columns):
+    """
+    Pick the model used as the keyframe for each cluster of a query
+
+    Parameters
+    ----------
+    model_ids : numpy.ndarray
+        Model ID of every model in the region
+    centroids : numpy.ndarray
+        Model ID of the centroid of each cluster
+    query_params : numpy.ndarray
+        [model_id, cluster_id] for the models of the query
+    query_columns : list
+        Columns of the models of the query
+
+    Returns
+    -------
+    dict
+        Column of the keyframe for each cluster of the query. This is the
+        centroid of the cluster or, for models that are not in a cluster with
+        a centroid, the first model of that cluster in the query.
+    """
+    keyframes = {}
+    for params, col in zip(query_params, query_columns):
+        cluster = int(params[1])
+        if cluster in keyframes:
+            continue
+        keyframes[cluster] = int(col)
+        if 0 <= cluster < len(centroids):
+            found = np.flatnonzero(model_ids == centroids[cluster])
+            if len(found):
+                keyframes[cluster] = int(found[0])
+    return keyframes
+
+
+def encode_page(hdf5_store, resolution, region_id, columns, precision=1, beads=None,
+                query_columns=None, with_keyframes=True):
+    """
+    Read a set of models from a region and encode them as residuals against
+    the centroids of their clusters
+
+    Parameters
+    ----------
+    hdf5_store : CoordStore
+    resolution : int
+    region_id : str
+    columns : list
+        Sorted column indexes of the models
+    precision : int
+        Quantisation step of the residuals
+    beads : tuple
+        (first, last) beads of the region to encode, None for all of them
+    query_columns : list
+        Columns of all of the models of the query that the page belongs to.
+        The keyframes are picked from these so that every page of the query
+        refers to the same keyframes. None for just the page.
+    with_keyframes : bool
+        Return the keyframes, otherwise only those that the models on the page
+        refer to are read
+
+    Returns
+    -------
+    keyframes : list
+        ref, cluster and data of each keyframe, None without with_keyframes
+    models : list
+        ref, cluster, keyframe (position in the keyframe list) and residual of
+        each model
+    """
+    columns = [int(col) for col in columns]
+    if query_columns is None:
+        query_columns = columns
+    query_columns = np.asarray(query_columns, dtype=np.int64)
+
+    model_params, coords = hdf5_store.get_model_page(resolution, region_id, columns, beads)
+    catalogue = hdf5_store.get_catalogue(resolution, region_id)
+    key_cols = keyframe_columns(
+        catalogue.model_ids,
+        hdf5_store.get_centroids(resolution, region_id),
+        np.stack([catalogue.model_ids[query_columns], catalogue.cluster_ids[query_columns]], axis=1),
+        query_columns.tolist()
+    )
+    keyframe_index = dict((cluster, k) for k, cluster in enumerate(sorted(key_cols)))
+    if with_keyframes:
+        clusters = sorted(key_cols)
+    else:
+        clusters = sorted(set(int(params[1]) for params in model_params))
+
+    # Read the keyframes that are not on the page
+    position = dict((col, k) for k, col in enumerate(columns))
+    extra = sorted(set(key_cols[cluster] for cluster in clusters) - set(columns))
+    extra_params, extra_coords = hdf5_store.get_model_page(
+        resolution, region_id, extra, beads)
+    for k, col in enumerate(extra):
+        position[col] = len(columns) + k
+    all_params = np.concatenate([model_params, extra_params])
+    all_coords = np.concatenate([coords, extra_coords], axis=1)
+
+    keyframes = None
+    if with_keyframes:
+        keyframes = []
+        for cluster in clusters:
+            k = position[key_cols[cluster]]
+            keyframes.append({
+                'ref': str(all_params[k][0]),
+                'cluster': str(cluster),
+                'data': all_coords[:, k, :].ravel().tolist()
+            })
+
+    models = []
+    for k in range(len(model_params)):
+        cluster = int(model_params[k][1])
+        key_coords = all_coords[:, position[key_cols[cluster]], :]
+        models.append({
+            'ref': str(model_params[k][0]),
+            'cluster': str(model_params[k][1]),
+            'keyframe': keyframe_index[cluster],
+            'residual': quantize(coords[:, k, :] - key_coords, precision).ravel().tolist()
+        })
+
+    return keyframes, models
+
+
+def decode(page, keyframes=None):
+    """
+    Decode the models on a page in the residual encoding
+
+    Parameters
+    ----------
+    page : dict
+        Response from GetModel with `encoding=residual`
+    keyframes : list
+        `keyframes` of the first page of the query, for pages that do not
+        carry them
+
+    Returns
+    -------
+    list
+        ref and data of each model, as in the default encoding
+    """
+    precision = page['encoding']['precision']
+    keyframes = [
+        np.asarray(keyframe['data'], dtype=np.int64)
+        for keyframe in page.get('keyframes', keyframes)
+    ]
+    return [
+        {
+            'ref': model['ref'],
+            'data': (
+                keyframes[model['keyframe']] +
+                np.asarray(model['residual'], dtype=np.int64) * precision
+            ).tolist()
+        } for model in page['models']
+    ]
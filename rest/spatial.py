@@ -0,0 +1,205 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import numpy as np
+
+
+def _concat_ranges(starts, ends):
+    """
+    Concatenation of np.arange(start, end) for each pair of bounds
+    """
+    lengths = ends - starts
+    keep = lengths > 0
+    starts = starts[keep]
+    lengths = lengths[keep]
+    if not len(lengths):
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.cumsum(lengths) - lengths
+    return np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+
+
+class GridIndex(object):
+    """
+    Uniform grid over the bead coordinates of all of the models in a region.
+
+    Points are numbered in the order of the `data` hyperslab for the region,
+    so point `p` is bead `p // models` of the model in column `p % models`.
+    The points are sorted by the cell that they fall in so that the points in a
+    run of cells can be found with a binary search.
+    """
+
+    def __init__(self, coords, points_per_cell=8):
+        """
+        Parameters
+        ----------
+        coords : numpy.ndarray
+            Array of shape (beads, models, 3)
+        points_per_cell : int
+            Average number of points in each cell, used to pick the cell size
+        """
+        self.beads, self.models = coords.shape[0], coords.shape[1]
+        self.points = np.ascontiguousarray(coords).reshape(-1, 3)
+
+        if len(self.points):
+            self.origin = self.points.min(axis=0).astype(np.int64)
+            extent = self.points.max(axis=0).astype(np.int64) - self.origin + 1
+        else:
+            self.origin = np.zeros(3, dtype=np.int64)
+            extent = np.ones(3, dtype=np.int64)
+
+        cells_wanted = max(1.0, len(self.points) / float(points_per_cell))
+        self.cell_size = max(
+            1, int(np.ceil((np.prod(extent.astype(np.float64)) / cells_wanted) ** (1.0 / 3))))
+        self.shape = extent // self.cell_size + 1
+
+        cells = self._linear(self._cell(self.points))
+        self.order = np.argsort(cells, kind='mergesort')
+        self.sorted_cells = cells[self.order]
+
+    def _cell(self, xyz):
+        return (np.asarray(xyz, dtype=np.int64) - self.origin) // self.cell_size
+
+    def _linear(self, cell):
+        return (cell[..., 0] * self.shape[1] + cell[..., 1]) * self.shape[2] + cell[..., 2]
+
+    def _candidates(self, low, high):
+        """
+        Points in the cells that overlap a box
+        """
+        low_cell = np.maximum(self._cell(np.floor(low)), 0)
+        high_cell = np.minimum(self._cell(np.ceil(high)), self.shape - 1)
+        if (low_cell > high_cell).any():
+            return np.zeros(0, dtype=np.int64)
+
+        span = high_cell - low_cell + 1
+        if np.prod(span) > len(self.points):
+            return np.arange(len(self.points))
+
+        # Cells are contiguous along z, so each (x, y) column is one run
+        grid_x, grid_y = np.meshgrid(
+            np.arange(low_cell[0], high_cell[0] + 1),
+            np.arange(low_cell[1], high_cell[1] + 1),
+            indexing='ij'
+        )
+        base = (grid_x.ravel() * self.shape[1] + grid_y.ravel()) * self.shape[2]
+        starts = np.searchsorted(self.sorted_cells, base + low_cell[2], side='left')
+        ends = np.searchsorted(self.sorted_cells, base + high_cell[2], side='right')
+        return self.order[_concat_ranges(starts, ends)]
+
+    def query_box(self, low, high):
+        """
+        Points within an axis aligned box, bounds included
+
+        Parameters
+        ----------
+        low : list
+            [x, y, z] of the lower corner
+        high : list
+            [x, y, z] of the upper corner
+
+        Returns
+        -------
+        numpy.ndarray
+            Sorted point numbers
+
+        Raises
+        ------
+        ValueError
+            If a bound is not finite or the lower corner is above the upper
+            corner
+        """
+        low = np.asarray(low, dtype=np.float64)
+        high = np.asarray(high, dtype=np.float64)
+        if not (np.isfinite(low).all() and np.isfinite(high).all()):
+            raise ValueError('Box corners need to be finite')
+        if (low > high).any():
+            raise ValueError('Lower corner of the box is above the upper corner')
+        candidates = self._candidates(low, high)
+        points = self.points[candidates]
+        inside = ((points >= low) & (points <= high)).all(axis=1)
+        return np.sort(candidates[inside])
+
+    def query_sphere(self, center, radius):
+        """
+        Points within a distance of a point
+
+        Parameters
+        ----------
+        center : list
+            [x, y, z]
+        radius : float
+
+        Returns
+        -------
+        numpy.ndarray
+            Sorted point numbers
+
+        Raises
+        ------
+        ValueError
+            If the center or the radius is not finite or the radius is
+            negative
+        """
+        center = np.asarray(center, dtype=np.float64)
+        if not (np.isfinite(center).all() and np.isfinite(radius)):
+            raise ValueError('Sphere center and radius need to be finite')
+        if radius < 0:
+            raise ValueError('Sphere radius is negative')
+        candidates = self._candidates(center - radius, center + radius)
+        offsets = self.points[candidates] - center
+        inside = (offsets * offsets).sum(axis=1) <= float(radius) ** 2
+        return np.sort(candidates[inside])
+
+    def group_by_model(self, point_ids, columns=None):
+        """
+        Split the points from a query by model
+
+        Parameters
+        ----------
+        point_ids : numpy.ndarray
+            Sorted point numbers
+        columns : list
+            Columns of the models to keep, None for all of them
+
+        Returns
+        -------
+        list
+            (column, beads, coords) for each model with at least one point,
+            in column order
+        """
+        point_ids = np.asarray(point_ids, dtype=np.int64)
+        if columns is not None:
+            point_ids = point_ids[np.isin(point_ids % max(self.models, 1), columns)]
+
+        point_columns = point_ids % max(self.models, 1)
+        order = np.argsort(point_columns, kind='mergesort')
+        found, starts = np.unique(point_columns[order], return_index=True)
+        ends = np.append(starts[1:], len(order)).astype(np.int64)
+
+        groups = []
+        for col, first, last in zip(found, starts, ends):
+            ids = point_ids[order[first:last]]
+            groups.append((int(col), ids // self.models, self.points[ids]))
+        return groups
+
+    def nbytes(self):
+        """
+        Memory held by the index
+        """
+        return self.points.nbytes + self.order.nbytes + self.sorted_cells.nbytes
@@ -0,0 +1,308 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+Tracing spans for the request handling, auth, DM lookups and HDF5 reads.
+
+Tracing is off until `configure` is called, in which case `span` returns a
+shared object that does nothing. With the `otel` exporter the spans are
+created with the OpenTelemetry API so they go to whatever exporter the
+OpenTelemetry SDK has been set up with. The `console` and `file` exporters
+write one JSON object per finished span for offline analysis, with the same
+trace and span IDs and parent links.
+"""
+
+from __future__ import print_function
+
+import binascii
+import json
+import os
+import sys
+import threading
+import time
+
+_TRACER = None
+
+
+class _NoopSpan(object):
+    """
+    Span used while tracing is off
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def set_attribute(self, key, value):
+        """
+        Ignore the attribute
+        """
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+def _new_id(size):
+    return binascii.hexlify(os.urandom(size)).decode('ascii')
+
+
+class _JsonSpan(object):
+    """
+    Span that is written as a line of JSON once it has finished
+    """
+
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.trace_id = None
+        self.span_id = _new_id(8)
+        self.parent_id = None
+        self.start = None
+
+    def set_attribute(self, key, value):
+        """
+        Add an attribute to the span
+        """
+        self.attributes[key] = value
+
+    def begin(self, parent):
+        """
+        Start the span as a child of `parent`, or of a new trace if None
+        """
+        if parent is not None:
+            self.trace_id = parent.trace_id
+            self.parent_id = parent.span_id
+        else:
+            self.trace_id = _new_id(16)
+        self.start = time.time()
+
+    def finish(self, exc_type=None, exc_value=None):
+        """
+        Write the span
+        """
+        end = time.time()
+        if exc_type is not None:
+            self.attributes['error'] = exc_type.__name__ + ': ' + str(exc_value)
+        self.tracer.export({
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start': self.start,
+            'duration_ms': (end - self.start) * 1000.0,
+            'thread': threading.current_thread().name,
+            'attributes': self.attributes
+        })
+
+    def __enter__(self):
+        stack = self.tracer.stack()
+        self.begin(stack[-1] if stack else None)
+        stack.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        stack = self.tracer.stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+        self.finish(exc_type, exc_value)
+        return False
+
+
+class JsonTracer(object):
+    """
+    Writes each finished span as a line of JSON to a stream
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def stack(self):
+        """
+        Spans that are open on the current thread
+        """
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def span(self, name, attributes):
+        """
+        Create a span
+        """
+        return _JsonSpan(self, name, attributes)
+
+    def iterate(self, name, attributes, iterable):
+        """
+        Iterate within a span that is a child of the span open now
+        """
+        stack = self.stack()
+        current = _JsonSpan(self, name, attributes)
+        current.begin(stack[-1] if stack else None)
+        return self._iterate(current, iter(iterable))
+
+    def _iterate(self, current, iterator):
+        error = (None, None)
+        try:
+            while True:
+                stack = self.stack()
+                stack.append(current)
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    return
+                except Exception as err:
+                    error = (type(err), err)
+                    raise
+                finally:
+                    stack.remove(current)
+                yield chunk
+        finally:
+            if hasattr(iterator, 'close'):
+                iterator.close()
+            current.finish(*error)
+
+    def export(self, record):
+        """
+        Write a finished span
+        """
+        line = json.dumps(record, default=str)
+        with self._lock:
+            self.stream.write(line + '\n')
+            self.stream.flush()
+
+    def close(self):
+        """
+        Close the stream unless it is stdout or stderr
+        """
+        if self.stream not in (sys.stdout, sys.stderr):
+            self.stream.close()
+
+
+class OtelTracer(object):
+    """
+    Creates the spans with the OpenTelemetry API
+    """
+
+    def __init__(self):
+        from opentelemetry import trace
+
+        self._tracer = trace.get_tracer('mg-rest-3d')
+
+    def span(self, name, attributes):
+        """
+        Create a span that is made current when it is entered
+        """
+        return self._tracer.start_as_current_span(name, attributes=attributes)
+
+    def iterate(self, name, attributes, iterable):
+        """
+        Iterate within a span that is a child of the span current now
+        """
+        return self._iterate(self._tracer.start_span(name, attributes=attributes), iter(iterable))
+
+    @staticmethod
+    def _iterate(current, iterator):
+        from opentelemetry import trace
+
+        try:
+            while True:
+                with trace.use_span(current, end_on_exit=False):
+                    try:
+                        chunk = next(iterator)
+                    except StopIteration:
+                        return
+                yield chunk
+        finally:
+            if hasattr(iterator, 'close'):
+                iterator.close()
+            current.end()
+
+    def close(self):
+        """
+        Spans are flushed by the OpenTelemetry SDK
+        """
+        pass
+
+
+def configure(exporter=None, path=None):
+    """
+    Turn tracing on or off
+
+    Parameters
+    ----------
+    exporter : str | None
+        `otel`, `console`, `file` or None to turn tracing off
+    path : str
+        File that the spans are appended to with the `file` exporter
+    """
+    global _TRACER  # pylint: disable=global-statement
+    old, _TRACER = _TRACER, None
+    if old is not None:
+        old.close()
+
+    if exporter == 'otel':
+        _TRACER = OtelTracer()
+    elif exporter == 'console':
+        _TRACER = JsonTracer(sys.stderr)
+    elif exporter == 'file':
+        _TRACER = JsonTracer(open(path, 'a'))
+    elif exporter is not None:
+        raise ValueError('Unknown trace exporter: ' + str(exporter))
+
+
+def enabled():
+    """
+    Whether spans are being recorded
+    """
+    return _TRACER is not None
+
+
+def span(name, **attributes):
+    """
+    Create a span to use as a context manager
+
+    .. code-block:: python
+
+       with span('store.get_model_page', region=region_id) as current:
+           ...
+           current.set_attribute('bytes_read', coords.nbytes)
+    """
+    tracer = _TRACER
+    if tracer is None:
+        return _NOOP
+    return tracer.span(name, attributes)
+
+
+def streamed(name, iterable, **attributes):
+    """
+    Wrap a streamed response body so that the spans opened while it is read
+    belong to the request. The span `name` is started as a child of the span
+    open when this is called and is made current while each chunk is
+    produced, so it finishes once the body has been sent.
+
+    .. code-block:: python
+
+       return Response(streamed('stream.json', stream_json(...), region=region_id))
+    """
+    tracer = _TRACER
+    if tracer is None:
+        return iterable
+    return tracer.iterate(name, attributes, iterable)
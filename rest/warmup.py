@@ -0,0 +1,168 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import threading
+import time
+
+
+def parse_target(target):
+    """
+    Parse a warm-up target of the form `file_id[:res[,res...]]`
+
+    Parameters
+    ----------
+    target : str
+
+    Returns
+    -------
+    tuple
+        (file_id, list of resolutions). An empty list of resolutions means that
+        all of the resolutions in the file should be warmed.
+    """
+    file_id, _, res_str = target.partition(':')
+    resolutions = [int(res) for res in res_str.split(',') if res]
+    return file_id, resolutions
+
+
+class Warmup(object):
+    """
+    Tracks the readiness of the service while files are opened and their
+    indexes built ahead of the first requests.
+
+    The status is reported by the Ping end point as `warming` until either all
+    of the targets have been loaded or the time budget has been used up, at
+    which point it changes to `ready`.
+    """
+
+    def __init__(self):
+        self.status = 'ready'
+        self.targets_total = 0
+        self.targets_done = 0
+        self.bytes_read = 0
+        self.errors = []
+        self._lock = threading.Lock()
+
+    def report(self):
+        """
+        Summary of the warm-up progress
+
+        Returns
+        -------
+        dict
+        """
+        return {
+            'targets': self.targets_total,
+            'done': self.targets_done,
+            'bytes_read': self.bytes_read,
+            'errors': list(self.errors)
+        }
+
+    def _warm_target(self, open_store, file_id, resolutions, preload_bytes, deadline):
+        """
+        Open a file, build the region indexes and optionally read the `data`
+        rows for each of the requested resolutions.
+        """
+        store = open_store(file_id)
+        if not resolutions:
+            resolutions = store.get_resolutions()
+
+        bytes_read = 0
+        for resolution in resolutions:
+            if time.time() > deadline:
+                break
+            store.get_index(resolution)
+            if preload_bytes:
+                bytes_read += store.preload(resolution, max_bytes=preload_bytes)
+
+        return bytes_read
+
+    def _run_one(self, args):
+        open_store, target, preload_bytes, deadline = args
+        if time.time() > deadline:
+            return
+
+        file_id, resolutions = target
+        try:
+            bytes_read = self._warm_target(
+                open_store, file_id, resolutions, preload_bytes, deadline)
+        except Exception as err:  # pylint: disable=broad-except
+            with self._lock:
+                self.errors.append({'file_id': file_id, 'error': str(err)})
+            return
+
+        with self._lock:
+            self.targets_done += 1
+            self.bytes_read += bytes_read
+
+    def run(self, open_store, targets, workers=4, budget=300, preload_bytes=0):
+        """
+        Warm a list of targets, returning once they are all loaded or the
+        budget has been used up.
+
+        Parameters
+        ----------
+        open_store : function
+            Function that takes a file_id and returns a CoordStore
+        targets : list
+            List of (file_id, [resolutions]) tuples
+        workers : int
+            Number of files that are warmed concurrently
+        budget : int
+            Maximum time in seconds to spend warming files
+        preload_bytes : int
+            Number of bytes of the `data` dataset to read for each resolution.
+            0 only opens the file and builds the indexes.
+        """
+        from multiprocessing.pool import ThreadPool
+
+        self.status = 'warming'
+        self.targets_total = len(targets)
+        deadline = time.time() + budget
+
+        pool = ThreadPool(max(1, min(workers, len(targets) or 1)))
+        try:
+            result = pool.map_async(
+                self._run_one,
+                [(open_store, target, preload_bytes, deadline) for target in targets]
+            )
+            result.wait(max(0, deadline - time.time()))
+        finally:
+            pool.terminate()
+            self.status = 'ready'
+
+    def start(self, open_store, targets, workers=4, budget=300, preload_bytes=0):
+        """
+        Warm a list of targets in a background thread. Parameters match those
+        of `run`.
+
+        Returns
+        -------
+        threading.Thread
+        """
+        self.status = 'warming'
+        thread = threading.Thread(
+            target=self.run,
+            args=(open_store, targets, workers, budget, preload_bytes)
+        )
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+WARMUP = Warmup()
@@ -0,0 +1,80 @@
+#!/usr/bin/python
+
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import argparse
+
+import h5py
+
+from parsing_models import publish, staging_file, write_stats
+
+
+def backfill(filename, force=False):
+    """
+    Compute the per model and per cluster statistics for each region of an
+    HDF5 file. Regions that already have statistics are skipped unless force
+    is set.
+    """
+    h5_file = h5py.File(filename, "a")
+    try:
+        for resolution in h5_file:
+            grp = h5_file[resolution]
+            meta = grp['meta']
+            mpgrp = meta['model_params']
+            done = 0
+            for region_id in mpgrp:
+                if not force and 'model_stats' in meta and region_id in meta['model_stats']:
+                    continue
+                model_param = mpgrp[region_id][:]
+                i = int(mpgrp[region_id].attrs['i'])
+                j = int(mpgrp[region_id].attrs['j'])
+                coords = grp['data'][i:j, 0:len(model_param), :]
+                write_stats(meta, region_id, coords, model_param)
+                done += 1
+            print(resolution + ": " + str(done) + " regions")
+    finally:
+        h5_file.close()
+
+
+def main():
+    """
+    Parse the command line and backfill the file
+    """
+    parser = argparse.ArgumentParser(
+        description="Add per model and per cluster statistics to an existing HDF5 file")
+    parser.add_argument("--hdf5", required=True, help="HDF5 file to update")
+    parser.add_argument(
+        "--force", action="store_true",
+        help="Recompute the statistics for regions that already have them")
+    parser.add_argument(
+        "--in_place", action="store_true",
+        help="Modify the HDF5 file directly instead of a staging copy")
+    args = parser.parse_args()
+
+    if args.in_place:
+        backfill(args.hdf5, args.force)
+    else:
+        staging = staging_file(args.hdf5, False)
+        backfill(staging, args.force)
+        publish(staging, args.hdf5)
+
+
+if __name__ == "__main__":
+    main()
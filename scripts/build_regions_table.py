@@ -0,0 +1,63 @@
+#!/usr/bin/python
+
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import argparse
+
+import h5py
+
+from parsing_models import build_regions_table, publish, staging_file
+
+
+def migrate(filename):
+    """
+    Build the `meta/regions` table for each resolution of an HDF5 file
+    """
+    h5_file = h5py.File(filename, "a")
+    try:
+        for resolution in h5_file:
+            regions = build_regions_table(h5_file[resolution])
+            print(resolution + ": " + str(regions.shape[0]) + " regions")
+    finally:
+        h5_file.close()
+
+
+def main():
+    """
+    Parse the command line and migrate the file
+    """
+    parser = argparse.ArgumentParser(
+        description="Add the per resolution regions table to an existing HDF5 file")
+    parser.add_argument("--hdf5", required=True, help="HDF5 file to migrate")
+    parser.add_argument(
+        "--in_place", action="store_true",
+        help="Modify the HDF5 file directly instead of a staging copy")
+    args = parser.parse_args()
+
+    if args.in_place:
+        migrate(args.hdf5)
+    else:
+        staging = staging_file(args.hdf5, False)
+        migrate(staging)
+        publish(staging, args.hdf5)
+
+
+if __name__ == "__main__":
+    main()
@@ -19,122 +19,540 @@
 
 from __future__ import print_function
 
+import argparse
+import hashlib
 import json
-import h5py
-import numpy as np
+import os
+import shutil
+import time
 
-json_files = open('json_files.txt', 'r')
+from collections import OrderedDict
 
-for jf in json_files:
-    jf = jf.strip()
-    models = json.loads(open(jf).read())
+import h5py
+import numpy as np
 
+MANIFEST_DTYPE = np.dtype([
+    ('uuid', 'S64'),
+    ('sha1', 'S40'),
+    ('i', 'int64'),
+    ('j', 'int64'),
+    ('ingested', 'float64'),
+])
+
+REGIONS_DTYPE = np.dtype([
+    ('uuid', 'S64'),
+    ('chromosome', 'S32'),
+    ('start', 'int64'),
+    ('end', 'int64'),
+    ('i', 'int64'),
+    ('j', 'int64'),
+    ('models', 'int32'),
+    ('clusters', 'int32'),
+])
+
+MODEL_STATS_DTYPE = np.dtype([
+    ('radius_of_gyration', 'float64'),
+    ('end_to_end', 'float64'),
+    ('bbox_min', 'int32', (3,)),
+    ('bbox_max', 'int32', (3,)),
+    ('density', 'float64'),
+])
+
+CLUSTER_STATS_DTYPE = np.dtype([
+    ('cluster', 'int32'),
+    ('models', 'int32'),
+    ('radius_of_gyration', 'float64'),
+    ('radius_of_gyration_std', 'float64'),
+    ('end_to_end', 'float64'),
+    ('end_to_end_std', 'float64'),
+    ('density', 'float64'),
+])
+
+
+def _as_bytes(value):
+    """
+    String attributes are returned as bytes or str depending on the version
+    of h5py that wrote them
+    """
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode('utf-8')
+
+
+def load_source(json_file):
+    """
+    Load a TADbit JSON file along with the checksum of its contents
+    """
+    with open(json_file, 'rb') as source:
+        raw = source.read()
+    return json.loads(raw.decode('utf-8')), hashlib.sha1(raw).hexdigest()
+
+
+def bead_count(models):
+    """
+    Number of beads in each model of a TADbit JSON file
+    """
+    return len(models['models'][0]['data']) // 3
+
+
+def create_resolution(h5_file, models):
+    """
+    Create the group, datasets and attributes for a new resolution
+    """
     metadata = models['metadata']
     objectdata = models['object']
-    clusters = models['clusters']
-    file_name = jf.split("/")
-
-    resolution = objectdata['resolution']
 
-    uuid = objectdata['uuid']
-
-    # Create the HDF5 file
-    filename = "test_02.hdf5"
-    f = h5py.File(filename, "a")
-
-    print(
-        file_name[-1] + ' - ' + file_name[-3] + "\t" + objectdata['chrom'][0] +
-        ' : ' + str(objectdata['chromStart'][0]) + ' - ' + str(objectdata['chromEnd'][0]) +
-        " | " + str(int(objectdata['chromEnd'][0]-objectdata['chromStart'][0])) + " - " +
-        str(len(models['models'][0]['data']))
-    )
-
-    if str(resolution) in f:
-        grp = f[str(resolution)]
-        dset = grp['data']
-
-        meta = grp['meta']
+    grp = h5_file.create_group(str(objectdata['resolution']))
+    meta = grp.create_group('meta')
+
+    meta.create_group('model_params')
+    meta.create_group('clusters')
+    meta.create_group('centroids')
+    meta.create_group('model_stats')
+    meta.create_group('cluster_stats')
+    meta.create_dataset(
+        'manifest', (0,), maxshape=(None,), dtype=MANIFEST_DTYPE, chunks=True)
+    meta.create_dataset(
+        'regions', (0,), maxshape=(None,), dtype=REGIONS_DTYPE, chunks=True)
+
+    dset = grp.create_dataset(
+        'data', (1, 1000, 3), maxshape=(None, 1000, 3),
+        dtype='int32', chunks=True, compression="gzip")
+
+    dset.attrs['title'] = objectdata['title']
+    dset.attrs['experimentType'] = objectdata['experimentType']
+    dset.attrs['species'] = objectdata['species']
+    dset.attrs['project'] = objectdata['project']
+    dset.attrs['identifier'] = objectdata['identifier']
+    dset.attrs['assembly'] = objectdata['assembly']
+    dset.attrs['cellType'] = objectdata['cellType']
+    dset.attrs['resolution'] = objectdata['resolution']
+    dset.attrs['datatype'] = objectdata['datatype']
+    dset.attrs['components'] = objectdata['components']
+    dset.attrs['source'] = objectdata['source']
+    dset.attrs['TADbit_meta'] = json.dumps(metadata)
+    dset.attrs['dependencies'] = json.dumps(objectdata['dependencies'])
+    dset.attrs['restraints'] = json.dumps(models['restraints'])
+    if 'hic_data' in models:
+        dset.attrs['hic_data'] = json.dumps(models['hic_data'])
+
+    return grp
+
+
+def get_manifest(grp):
+    """
+    Get the manifest of the regions that have been committed to a
+    resolution. Files written before the manifest was introduced have one
+    built from the `meta/model_params` datasets, without checksums.
+    """
+    meta = grp['meta']
+    if 'manifest' not in meta:
         mpgrp = meta['model_params']
-        clustersgrp = meta['clusters']
-        centroidsgrp = meta['centroids']
-    else:
-        # Create the initial dataset with minimum values
-        grp = f.create_group(str(resolution))
-        meta = grp.create_group('meta')
-
-        mpgrp = meta.create_group('model_params')
-        clustersgrp = meta.create_group('clusters')
-        centroidsgrp = meta.create_group('centroids')
-
-        dset = grp.create_dataset(
-            'data', (1, 1000, 3), maxshape=(None, 1000, 3),
-            dtype='int32', chunks=True, compression="gzip")
-
-        dset.attrs['title'] = objectdata['title']
-        dset.attrs['experimentType'] = objectdata['experimentType']
-        dset.attrs['species'] = objectdata['species']
-        dset.attrs['project'] = objectdata['project']
-        dset.attrs['identifier'] = objectdata['identifier']
-        dset.attrs['assembly'] = objectdata['assembly']
-        dset.attrs['cellType'] = objectdata['cellType']
-        dset.attrs['resolution'] = objectdata['resolution']
-        dset.attrs['datatype'] = objectdata['datatype']
-        dset.attrs['components'] = objectdata['components']
-        dset.attrs['source'] = objectdata['source']
-        dset.attrs['TADbit_meta'] = json.dumps(metadata)
-        dset.attrs['dependencies'] = json.dumps(objectdata['dependencies'])
-        dset.attrs['restraints'] = json.dumps(models['restraints'])
-        if 'hic_data' in models:
-            dset.attrs['hic_data'] = json.dumps(models['hic_data'])
-
-    clustergrps = clustersgrp.create_group(str(uuid))
-    cluster_count = len(clusters)
-    for c in range(cluster_count):
-        clustersds = clustergrps.create_dataset(
-            str(c), data=clusters[c], chunks=True, compression="gzip")
-
-    centroidsds = centroidsgrp.create_dataset(
-        str(uuid), data=models['centroids'], chunks=True, compression="gzip")
-
-    current_size = len(dset)
-    if current_size == 1:
-        current_size = 0
-    dset.resize((current_size+(len(models['models'][0]['data'])/3), 1000, 3))
+        entries = [
+            (region_id.encode('utf-8'), b'',
+             mpgrp[region_id].attrs['i'], mpgrp[region_id].attrs['j'], 0)
+            for region_id in mpgrp
+        ]
+        meta.create_dataset(
+            'manifest', data=np.array(entries, dtype=MANIFEST_DTYPE),
+            maxshape=(None,), chunks=True)
+    return meta['manifest']
+
+
+def build_regions_table(grp):
+    """
+    Build the `meta/regions` table for a resolution from the attributes of
+    the `meta/model_params` datasets, replacing any existing table. The table
+    holds one row per region so that the REST service can load all of the
+    regions with a single read.
+    """
+    meta = grp['meta']
+    mpgrp = meta['model_params']
+    rows = []
+    for region_id in mpgrp:
+        attrs = mpgrp[region_id].attrs
+        clusters = len(meta['clusters'][region_id]) if region_id in meta['clusters'] else 0
+        rows.append((
+            region_id.encode('utf-8'), _as_bytes(attrs['chromosome']), attrs['start'], attrs['end'],
+            attrs['i'], attrs['j'], mpgrp[region_id].shape[0], clusters
+        ))
+
+    if 'regions' in meta:
+        del meta['regions']
+    return meta.create_dataset(
+        'regions', data=np.array(rows, dtype=REGIONS_DTYPE), maxshape=(None,), chunks=True)
+
+
+def get_regions_table(grp):
+    """
+    Get the `meta/regions` table for a resolution, building it for files
+    that were written before the table was introduced
+    """
+    if 'regions' not in grp['meta']:
+        return build_regions_table(grp)
+    return grp['meta']['regions']
+
+
+def committed_rows(manifest):
+    """
+    Number of rows of the `data` dataset that belong to committed regions
+    """
+    if len(manifest) == 0:
+        return 0
+    return int(manifest['j'].max())
+
+
+def clean_uncommitted(grp, manifest):
+    """
+    Remove anything left behind by a region that was not committed, so that
+    the region can be ingested again
+    """
+    committed = set(uuid.decode('utf-8') for uuid in manifest['uuid'])
+    meta = grp['meta']
+    for name in ('model_params', 'clusters', 'centroids', 'model_stats', 'cluster_stats'):
+        if name not in meta:
+            continue
+        for region_id in list(meta[name].keys()):
+            if region_id not in committed:
+                print("Removing uncommitted region " + region_id + " from " + name)
+                del meta[name][region_id]
+
+    regions = get_regions_table(grp)
+    if regions.shape[0] != len(committed):
+        build_regions_table(grp)
+
+
+def model_stats(coords):
+    """
+    Summary statistics for each model of a region
+
+    Parameters
+    ----------
+    coords : numpy.ndarray
+        Array of shape (beads, models, 3)
+
+    Returns
+    -------
+    numpy.ndarray
+        MODEL_STATS_DTYPE row for each model. The density is the number of
+        beads per unit volume of the bounding box.
+    """
+    beads, n_models = coords.shape[0], coords.shape[1]
+    stats = np.zeros(n_models, dtype=MODEL_STATS_DTYPE)
+    if beads == 0 or n_models == 0:
+        return stats
+
+    points = coords.astype(np.float64)
+    offsets = points - points.mean(axis=0)
+    ends = points[-1] - points[0]
+    bbox_min = coords.min(axis=0)
+    bbox_max = coords.max(axis=0)
+
+    stats['radius_of_gyration'] = np.sqrt((offsets * offsets).sum(axis=2).mean(axis=0))
+    stats['end_to_end'] = np.sqrt((ends * ends).sum(axis=1))
+    stats['bbox_min'] = bbox_min
+    stats['bbox_max'] = bbox_max
+    stats['density'] = beads / np.prod(
+        (bbox_max - bbox_min).astype(np.float64) + 1, axis=1)
+    return stats
+
+
+def cluster_stats(stats, clusters):
+    """
+    Mean and standard deviation of the model statistics in each cluster
+
+    Parameters
+    ----------
+    stats : numpy.ndarray
+        Output of model_stats
+    clusters : numpy.ndarray
+        Cluster ID of each model
+
+    Returns
+    -------
+    numpy.ndarray
+        CLUSTER_STATS_DTYPE row for each cluster that has models
+    """
+    clusters = np.asarray(clusters, dtype=np.int64)
+    found, inverse, counts = np.unique(clusters, return_inverse=True, return_counts=True)
+
+    summary = np.zeros(len(found), dtype=CLUSTER_STATS_DTYPE)
+    summary['cluster'] = found
+    summary['models'] = counts
+    for name in ('radius_of_gyration', 'end_to_end'):
+        mean = np.bincount(inverse, stats[name], len(found)) / counts
+        square = np.bincount(inverse, stats[name] ** 2, len(found)) / counts
+        summary[name] = mean
+        summary[name + '_std'] = np.sqrt(np.maximum(square - mean ** 2, 0))
+    summary['density'] = np.bincount(inverse, stats['density'], len(found)) / counts
+    return summary
+
+
+def write_stats(meta, uuid, coords, model_param):
+    """
+    Write the `meta/model_stats/<uuid>` dataset, with a row for each row of
+    `meta/model_params/<uuid>`, and the `meta/cluster_stats/<uuid>` dataset,
+    replacing any that already exist
+    """
+    stats = model_stats(coords)
+    summary = cluster_stats(stats, np.asarray(model_param)[:, 1] if len(model_param) else [])
+    for name, data in (('model_stats', stats), ('cluster_stats', summary)):
+        if name not in meta:
+            meta.create_group(name)
+        if str(uuid) in meta[name]:
+            del meta[name][str(uuid)]
+        meta[name].create_dataset(str(uuid), data=data)
+    return stats
+
+
+def write_region(grp, models, current_size):
+    """
+    Write the models, clusters and centroids for a region into rows starting
+    at current_size of the `data` dataset
+    """
+    objectdata = models['object']
+    clusters = models['clusters']
+    uuid = objectdata['uuid']
+    meta = grp['meta']
+    dset = grp['data']
 
-    dnp = np.zeros([len(models['models'][0]['data'])/3, 1000, 3], dtype='int32')
+    beads = bead_count(models)
+    dnp = np.zeros([beads, 1000, 3], dtype='int32')
 
     model_param = []
-
-    model_id = 0
-    for model in models['models']:
+    for model_id, model in enumerate(models['models']):
         ref = model['ref']
-        d = model['data']
 
-        cid = [ind for ind in xrange(len(clusters)) if ref in clusters[ind]]
+        cid = [ind for ind in range(len(clusters)) if ref in clusters[ind]]
         if len(cid) == 0:
             cluster_id = len(clusters)
         else:
             cluster_id = cid[0]
 
         model_param.append([int(ref), int(cluster_id)])
+        dnp[:, model_id, :] = np.reshape(model['data'], (beads, 3))
+
+    dset[current_size:current_size+beads, 0:1000, 0:3] = dnp
+    write_stats(meta, uuid, dnp[:, 0:len(model_param), :], model_param)
 
-        j = 0
-        for i in xrange(0, len(d), 3):
-            xyz = d[i:i + 3]
-            dnp[j][model_id] = xyz
-            j += 1
+    clustergrps = meta['clusters'].create_group(str(uuid))
+    for c in range(len(clusters)):
+        clustergrps.create_dataset(
+            str(c), data=clusters[c], chunks=True, compression="gzip")
 
-        model_id += 1
+    meta['centroids'].create_dataset(
+        str(uuid), data=models['centroids'], chunks=True, compression="gzip")
 
-    model_param_ds = mpgrp.create_dataset(
+    model_param_ds = meta['model_params'].create_dataset(
         str(uuid), data=model_param, chunks=True, compression="gzip")
 
     model_param_ds.attrs['i'] = current_size
-    model_param_ds.attrs['j'] = current_size+(len(models['models'][0]['data'])/3)
+    model_param_ds.attrs['j'] = current_size + beads
     model_param_ds.attrs['chromosome'] = objectdata['chrom'][0]
     model_param_ds.attrs['start'] = int(objectdata['chromStart'][0])
     model_param_ds.attrs['end'] = int(objectdata['chromEnd'][0])
 
-    dset[current_size:current_size+(len(models['models'][0]['data'])/3), 0:1000, 0:3] += dnp
-
-    f.close()
+    return beads
+
+
+def commit_region(h5_file, grp, uuid, sha1, i, j):
+    """
+    Record a region in the regions table and the manifest and flush the
+    file. Once this has returned the region is skipped by later incremental
+    runs.
+    """
+    meta = grp['meta']
+    model_param_ds = meta['model_params'][str(uuid)]
+    regions = get_regions_table(grp)
+    regions.resize((len(regions) + 1,))
+    regions[-1] = np.array(
+        (str(uuid).encode('utf-8'), _as_bytes(model_param_ds.attrs['chromosome']),
+         model_param_ds.attrs['start'], model_param_ds.attrs['end'], i, j,
+         model_param_ds.shape[0], len(meta['clusters'][str(uuid)])),
+        dtype=REGIONS_DTYPE)
+
+    manifest = get_manifest(grp)
+    manifest.resize((len(manifest) + 1,))
+    manifest[-1] = np.array(
+        (str(uuid).encode('utf-8'), sha1.encode('utf-8'), i, j, time.time()),
+        dtype=MANIFEST_DTYPE)
+    h5_file.flush()
+
+
+def plan_ingest(json_files, h5_file, incremental):
+    """
+    Read the sources and decide which regions need to be added to each
+    resolution
+
+    Returns
+    -------
+    dict
+        For each resolution, a list of (json_file, sha1, uuid, beads)
+    """
+    pending = OrderedDict()
+    seen = set()
+    for jf in json_files:
+        models, sha1 = load_source(jf)
+        objectdata = models['object']
+        uuid = str(objectdata['uuid'])
+        resolution = str(objectdata['resolution'])
+
+        if incremental:
+            if (resolution, uuid) in seen or (resolution, sha1) in seen:
+                print("Skipping " + jf + " - listed more than once")
+                continue
+            if resolution in h5_file:
+                manifest = get_manifest(h5_file[resolution])
+                uuids = set(entry.decode('utf-8') for entry in manifest['uuid'])
+                checksums = set(entry.decode('utf-8') for entry in manifest['sha1'])
+                if uuid in uuids or sha1 in checksums:
+                    if uuid in uuids and sha1 not in checksums:
+                        print(
+                            "Skipping " + jf + " - region " + uuid +
+                            " has already been ingested from a different source")
+                    else:
+                        print("Skipping " + jf + " - already ingested")
+                    continue
+            seen.add((resolution, uuid))
+            seen.add((resolution, sha1))
+
+        pending.setdefault(resolution, []).append((jf, sha1, uuid, bead_count(models)))
+
+    return pending
+
+
+def staging_file(filename, resume):
+    """
+    Prepare a staging copy of the HDF5 file to load into. When resuming, a
+    staging file left by an interrupted run is used as it is.
+    """
+    staging = filename + '.staging'
+    if resume and os.path.isfile(staging):
+        print("Resuming from " + staging)
+    elif os.path.isfile(filename):
+        shutil.copy2(filename, staging)
+    elif os.path.isfile(staging):
+        os.remove(staging)
+    return staging
+
+
+def publish(staging, filename):
+    """
+    Replace the live file with the staging file. The rename is atomic so
+    readers either see the old file or the complete new one, and readers that
+    already have the old file open carry on reading it.
+    """
+    fd = os.open(staging, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+    os.rename(staging, filename)
+
+    dir_fd = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def ingest(json_files, filename, incremental=False, in_place=False):
+    """
+    Load TADbit JSON files into an HDF5 file
+
+    Unless in_place is set the files are loaded into a staging copy of the
+    HDF5 file which then replaces it, so that the REST service never reads a
+    partially written file.
+
+    All new regions for a resolution are added with a single resize of the
+    `data` dataset. Each region is committed to the manifest once it has been
+    written, so an interrupted run can be repeated with incremental=True to
+    carry on from the last committed region.
+
+    Parameters
+    ----------
+    json_files : list
+        Locations of the TADbit JSON files
+    filename : str
+        Location of the HDF5 file
+    incremental : bool
+        Skip regions that are already in the file instead of failing
+    in_place : bool
+        Load directly into the live file
+    """
+    if in_place:
+        _ingest(json_files, filename, incremental)
+    else:
+        staging = staging_file(filename, incremental)
+        _ingest(json_files, staging, incremental)
+        publish(staging, filename)
+
+
+def _ingest(json_files, filename, incremental):
+    h5_file = h5py.File(filename, "a")
+    try:
+        pending = plan_ingest(json_files, h5_file, incremental)
+
+        for resolution, sources in pending.items():
+            first_models = None
+            if resolution not in h5_file:
+                first_models, _ = load_source(sources[0][0])
+                create_resolution(h5_file, first_models)
+
+            grp = h5_file[resolution]
+            manifest = get_manifest(grp)
+            clean_uncommitted(grp, manifest)
+
+            current_size = committed_rows(manifest)
+            new_rows = sum(source[3] for source in sources)
+            grp['data'].resize((current_size + new_rows, 1000, 3))
+
+            for jf, sha1, uuid, beads in sources:
+                if first_models is not None:
+                    models, first_models = first_models, None
+                else:
+                    models, _ = load_source(jf)
+                objectdata = models['object']
+                file_name = jf.split("/")
+
+                print(
+                    file_name[-1] + ' - ' + file_name[-3] + "\t" + objectdata['chrom'][0] +
+                    ' : ' + str(objectdata['chromStart'][0]) + ' - ' +
+                    str(objectdata['chromEnd'][0]) + " | " +
+                    str(int(objectdata['chromEnd'][0]-objectdata['chromStart'][0])) +
+                    " - " + str(len(models['models'][0]['data']))
+                )
+
+                write_region(grp, models, current_size)
+                commit_region(h5_file, grp, uuid, sha1, current_size, current_size + beads)
+                current_size += beads
+    finally:
+        h5_file.close()
+
+
+def main():
+    """
+    Parse the command line and load the listed files
+    """
+    parser = argparse.ArgumentParser(description="Load TADbit models into HDF5")
+    parser.add_argument(
+        "--json_files", default="json_files.txt",
+        help="File listing the TADbit JSON files to load, one per line")
+    parser.add_argument("--hdf5", default="test_02.hdf5", help="HDF5 file to load into")
+    parser.add_argument(
+        "--incremental", action="store_true",
+        help="Skip regions that have already been loaded and resume interrupted loads")
+    parser.add_argument(
+        "--in_place", action="store_true",
+        help="Load directly into the HDF5 file instead of a staging copy")
+    args = parser.parse_args()
+
+    with open(args.json_files, 'r') as json_list:
+        json_files = [jf.strip() for jf in json_list if jf.strip()]
+
+    ingest(json_files, args.hdf5, args.incremental, args.in_place)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import pytest
+
+from context import app, catalogue, metrics
+from sample_data import LocalService, create_sample_file
+
+# Attributes of the app that tests replace, put back after each test
+APP_STATE = ('ADMISSION', 'EXPORTS', 'RESPONSE_CACHE', 'OFFLOAD')
+
+
+@pytest.fixture
+def sample_file(tmpdir):
+    """
+    Location of a sample HDF5 file with the default regions
+    """
+    file_path = str(tmpdir.join('sample.hdf5'))
+    create_sample_file(file_path)
+    return file_path
+
+
+@pytest.fixture
+def service(request, tmpdir):
+    """
+    App serving a sample file, with local stand-ins for the auth server and
+    the DM API. The metrics are cleared before the test and the app settings
+    are put back after it.
+
+    Variants are picked with a dict of options, either from `SERVICE_OPTIONS`
+    in the test module or by parametrizing `service` indirectly:
+
+    config : dict
+        APP.config settings for the test
+    app : dict
+        Attributes of the app to replace, e.g. RESPONSE_CACHE, mapped to a
+        function of tmpdir that creates the value
+    with_stats : bool
+        Write the model statistics to the sample file
+    resolutions : list
+        (resolution, regions) to add to the sample file
+    files : dict
+        Further sample files, mapping each file ID to its regions. The DM
+        lookup then knows `file_a`, the main sample file, and these files.
+    """
+    options = getattr(request, 'param', None)
+    if options is None:
+        options = getattr(request.module, 'SERVICE_OPTIONS', {})
+
+    config = dict(app.APP.config)
+    state = dict((name, getattr(app, name)) for name in APP_STATE)
+
+    local = LocalService(app, catalogue, tmpdir, with_stats=options.get('with_stats', False))
+    for resolution, regions in options.get('resolutions', []):
+        create_sample_file(local.file_path, resolution=resolution, regions=regions, mode="a")
+
+    if 'files' in options:
+        files = {'file_a': local.file_path}
+        for file_id, regions in options['files'].items():
+            files[file_id] = str(tmpdir.join(file_id + '.hdf5'))
+            create_sample_file(files[file_id], regions=regions)
+
+        def _lookup(user_id, file_id):  # pylint: disable=unused-argument
+            if file_id not in files:
+                raise IOError('Unknown file ' + file_id)
+            return files[file_id]
+
+        app.CATALOGUE.dm_lookup = _lookup
+
+    app.APP.config.update(options.get('config', {}))
+    for name, factory in options.get('app', {}).items():
+        setattr(app, name, factory(tmpdir))
+    metrics.METRICS.clear()
+
+    yield local
+
+    local.close()
+    app.APP.config.clear()
+    app.APP.config.update(config)
+    for name, value in state.items():
+        setattr(app, name, value)
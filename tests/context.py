@@ -20,5 +20,28 @@ import os
 
 BASEDIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, BASEDIR + '/../')
+sys.path.insert(0, BASEDIR + '/../scripts')
 
 from rest import app
+from rest import coord_store
+from rest import warmup
+from rest import importtime
+from rest import auth_cache
+from rest import catalogue
+from rest import cursor
+from rest import formats
+from rest import export
+from rest import federated
+from rest import admission
+from rest import compression
+from rest import spatial
+from rest import residual
+from rest import prefetch
+from rest import offload
+from rest import replicas
+from rest import metrics
+from rest import tracing
+
+import parsing_models
+import build_regions_table
+import build_model_stats
@@ -0,0 +1,609 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+Load test and soak harness.
+
+The app is started under waitress in a separate process, serving synthetic
+HDF5 files with local stand-ins for the auth server and the DM API. Virtual
+clients then browse the service the way the web viewers do (resolutions,
+chromosomes, regions, models and then pages of models), following the
+`_links` in each response. The throughput, latency, error rate, open file
+descriptors and memory of the server are reported for each concurrency level.
+
+    python tests/loadtest.py --concurrency 1,8,32,128 --duration 30 --soak 3600
+
+The synthetic files are written with `sample_data.create_sample_file`, so the
+harness lives with the tests rather than in the `rest` package.
+"""
+
+from __future__ import print_function
+
+import json
+import math
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    from http.client import HTTPConnection
+    from urllib.parse import urlsplit
+except ImportError:  # Python 2
+    from httplib import HTTPConnection
+    from urlparse import urlsplit
+
+BASEDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_PROFILE = {
+    # Number of pages of models read from each region
+    'pages_per_region': 3,
+    # Models per page
+    'mpp': 10,
+    # Share of the model requests for each output format
+    'formats': {'json': 0.9, 'pdb': 0.1},
+    # Pause between requests within a session, in milliseconds
+    'think_ms': 0,
+}
+
+DEFAULT_FIXTURES = {
+    'files': 4,
+    'resolutions': [10000, 100000],
+    'chromosomes': 3,
+    'regions': 20,
+    'beads': 100,
+    'models': 50,
+}
+
+
+def create_fixtures(directory, files=4, resolutions=(10000, 100000), chromosomes=3,
+                    regions=20, beads=100, models=50):
+    """
+    Write synthetic HDF5 files with `sample_data.create_sample_file`, along
+    with a `files.json` mapping each file_id to its location
+
+    Parameters
+    ----------
+    directory : str
+    files : int
+        Number of files
+    resolutions : list
+        Resolutions within each file
+    chromosomes : int
+        Number of chromosomes at each resolution
+    regions : int
+        Number of regions on each chromosome
+    beads : int
+        Beads in each region
+    models : int
+        Models in each region, split between 4 clusters
+
+    Returns
+    -------
+    dict
+        Location of each file keyed by file_id
+    """
+    from sample_data import create_sample_file
+
+    clusters = 4
+    file_paths = {}
+    for file_num in range(files):
+        file_id = 'file_{}'.format(file_num)
+        file_paths[file_id] = os.path.join(directory, file_id + '.hdf5')
+
+        for res_num, resolution in enumerate(resolutions):
+            region_list = [
+                (
+                    'r{}_{}_{}'.format(resolution, chrom_num, region_num),
+                    'chr{}'.format(chrom_num + 1),
+                    region_num * beads * resolution, (region_num + 1) * beads * resolution,
+                    beads, models, clusters
+                )
+                for chrom_num in range(chromosomes) for region_num in range(regions)
+            ]
+            create_sample_file(
+                file_paths[file_id], resolution=resolution, regions=region_list,
+                with_table=True, mode='w' if res_num == 0 else 'a')
+
+    with open(os.path.join(directory, 'files.json'), 'w') as files_json:
+        json.dump(file_paths, files_json)
+    return file_paths
+
+
+def serve(fixtures_dir, port, threads=16, rate_limits=False):
+    """
+    Run the app under waitress against the files in a fixtures directory.
+    Each token is accepted as the user of the same name and file IDs are
+    resolved from `files.json` instead of the DM API.
+
+    Parameters
+    ----------
+    fixtures_dir : str
+        Directory written by create_fixtures
+    port : int
+    threads : int
+        Number of waitress worker threads
+    rate_limits : bool
+        Keep the default admission control. Otherwise the limits are raised
+        so that only the server itself is measured.
+    """
+    import waitress
+
+    from context import app
+    from rest.catalogue import Catalogue
+
+    with open(os.path.join(fixtures_dir, 'files.json')) as files_json:
+        file_paths = json.load(files_json)
+
+    app.AUTH_CACHE.validator = lambda token: (
+        {'user_id': (token or '').replace('Bearer ', '')}, None)
+    app.CATALOGUE = Catalogue(
+        os.path.join(fixtures_dir, 'catalogue.db'),
+        lambda user_id, file_id: file_paths[file_id],
+        lambda user_id: list(file_paths.items())
+    )
+    if not rate_limits:
+        app.APP.config['ADMISSION_RATE'] = 10 ** 12
+        app.APP.config['ADMISSION_BURST'] = 10 ** 12
+        app.APP.config['ADMISSION_MAX_EXPENSIVE'] = 10 ** 6
+
+    waitress.serve(app.APP, host='127.0.0.1', port=port, threads=threads, _quiet=True)
+
+
+def process_stats(pid):
+    """
+    Open file descriptors and resident memory of a process, read from /proc
+
+    Returns
+    -------
+    dict
+        fds and rss_kb, either of which is None if it could not be read
+    """
+    stats = {'fds': None, 'rss_kb': None}
+    try:
+        stats['fds'] = len(os.listdir('/proc/{}/fd'.format(pid)))
+    except OSError:
+        pass
+    try:
+        with open('/proc/{}/status'.format(pid)) as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    stats['rss_kb'] = int(line.split()[1])
+    except (OSError, IOError):
+        pass
+    return stats
+
+
+def percentile(values, pct):
+    """
+    Nearest rank percentile of a list of values
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(int(math.ceil(pct / 100.0 * len(ordered))) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+class Recorder(object):
+    """
+    Collects the outcome of each request
+    """
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = 0
+        self.throttled = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def add(self, endpoint, status, latency):
+        """
+        Record a request. A status of None means that the connection failed.
+        """
+        with self._lock:
+            self.requests += 1
+            if status == 429:
+                self.throttled += 1
+            elif status is None or status >= 400:
+                self.errors += 1
+            else:
+                self.latencies.setdefault(endpoint, []).append(latency)
+
+    def summary(self, elapsed):
+        """
+        Throughput, error rate and latency percentiles in milliseconds
+        """
+        with self._lock:
+            every = [lat for values in self.latencies.values() for lat in values]
+            endpoints = dict(
+                (endpoint, {
+                    'count': len(values),
+                    'p50_ms': percentile(values, 50) * 1000,
+                    'p99_ms': percentile(values, 99) * 1000,
+                }) for endpoint, values in self.latencies.items()
+            )
+            return {
+                'requests': self.requests,
+                'throughput_rps': self.requests / elapsed if elapsed else 0,
+                'error_rate': float(self.errors) / self.requests if self.requests else 0,
+                'throttled': self.throttled,
+                'p50_ms': percentile(every, 50) * 1000 if every else None,
+                'p95_ms': percentile(every, 95) * 1000 if every else None,
+                'p99_ms': percentile(every, 99) * 1000 if every else None,
+                'endpoints': endpoints,
+            }
+
+
+class Client(object):
+    """
+    Virtual user browsing the service over a single keep-alive connection
+    """
+
+    def __init__(self, host, port, user, file_ids, profile, recorder, seed):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.file_ids = file_ids
+        self.profile = profile
+        self.recorder = recorder
+        self.random = random.Random(seed)
+        self._conn = None
+
+    def get(self, endpoint, url):
+        """
+        GET a URL or path, returning the decoded JSON or None
+        """
+        parts = urlsplit(url)
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        if self._conn is None:
+            self._conn = HTTPConnection(self.host, self.port, timeout=60)
+
+        start = time.time()
+        try:
+            self._conn.request('GET', path, headers={'Authorization': 'Bearer ' + self.user})
+            response = self._conn.getresponse()
+            body = response.read()
+        except (socket.error, IOError, ValueError):
+            self.recorder.add(endpoint, None, time.time() - start)
+            self.close()
+            return None
+        self.recorder.add(endpoint, response.status, time.time() - start)
+
+        if response.status != 200 or response.getheader('Content-Type') != 'application/json':
+            return None
+        return json.loads(body.decode('utf-8'))
+
+    def _pause(self):
+        if self.profile.get('think_ms'):
+            time.sleep(self.profile['think_ms'] / 1000.0)
+
+    def _format(self):
+        formats = sorted(self.profile.get('formats', {'json': 1}).items())
+        pick = self.random.random() * sum(weight for _, weight in formats)
+        for name, weight in formats:
+            pick -= weight
+            if pick < 0:
+                return name
+        return formats[-1][0]
+
+    def session(self):
+        """
+        Browse from the list of resolutions of a file down to pages of models
+        """
+        file_id = self.random.choice(self.file_ids)
+        steps = [
+            ('chromosomes', 'resolutions', '_chromosomes'),
+            ('regions', 'chromosomes', '_regions'),
+            ('models', 'regions', '_models'),
+        ]
+
+        data = self.get('resolutions', '/mug/api/3dcoord/resolutions?file_id=' + file_id)
+        for endpoint, key, link in steps:
+            if not data or not data.get(key):
+                return
+            self._pause()
+            data = self.get(endpoint, self.random.choice(data[key])['_links'][link])
+
+        if not data or '_models_all' not in data.get('_links', {}):
+            return
+        url = data['_links']['_models_all'] + '&mpp=' + str(self.profile.get('mpp', 10))
+
+        fmt = self._format()
+        if fmt != 'json':
+            self._pause()
+            self.get('model_' + fmt, url + '&format=' + fmt)
+            return
+
+        for _ in range(self.profile.get('pages_per_region', 1)):
+            self._pause()
+            data = self.get('model', url)
+            if not data or '_next_page' not in data.get('_links', {}):
+                return
+            url = data['_links']['_next_page']
+
+    def run(self, deadline):
+        """
+        Run sessions until the deadline
+        """
+        while time.time() < deadline:
+            self.session()
+        self.close()
+
+    def close(self):
+        """
+        Close the connection
+        """
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def run_level(host, port, file_ids, concurrency, duration, profile, server_pid=None,
+              sample_every=None):
+    """
+    Run a number of concurrent clients for a period of time
+
+    Parameters
+    ----------
+    concurrency : int
+        Number of clients
+    duration : float
+        Seconds to run for
+    server_pid : int
+        Process to sample the file descriptors and memory of
+    sample_every : float
+        Seconds between samples of the server process during the run
+
+    Returns
+    -------
+    dict
+    """
+    recorder = Recorder()
+    before = process_stats(server_pid) if server_pid else None
+    samples = []
+
+    start = time.time()
+    deadline = start + duration
+    threads = []
+    for num in range(concurrency):
+        client = Client(
+            host, port, 'loadtest{}'.format(num), file_ids, profile, recorder, num)
+        thread = threading.Thread(target=client.run, args=(deadline,))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    if server_pid and sample_every:
+        while time.time() < deadline:
+            time.sleep(min(sample_every, max(deadline - time.time(), 0)))
+            sample = process_stats(server_pid)
+            sample['elapsed'] = time.time() - start
+            sample['requests'] = recorder.requests
+            samples.append(sample)
+
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    result = recorder.summary(elapsed)
+    result['concurrency'] = concurrency
+    result['duration'] = elapsed
+    if server_pid:
+        result['server_before'] = before
+        result['server_after'] = process_stats(server_pid)
+    if samples:
+        result['samples'] = samples
+    return result
+
+
+def _free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def start_server(fixtures_dir, threads=16, rate_limits=False, timeout=30):
+    """
+    Start `serve` in a new interpreter and wait for it to answer the ping
+
+    Returns
+    -------
+    tuple
+        (process, port)
+    """
+    port = _free_port()
+    command = [
+        sys.executable, os.path.join(BASEDIR, 'tests', 'loadtest.py'),
+        '--serve', fixtures_dir, '--port', str(port), '--threads', str(threads)
+    ]
+    if rate_limits:
+        command.append('--rate_limits')
+    process = subprocess.Popen(command, cwd=BASEDIR)
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('Server exited with code {}'.format(process.returncode))
+        try:
+            conn = HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/mug/api/3dcoord/ping')
+            status = conn.getresponse().status
+            conn.close()
+            if status == 200:
+                return process, port
+        except (socket.error, IOError):
+            pass
+        time.sleep(0.1)
+
+    process.kill()
+    raise RuntimeError('Server did not start within {} seconds'.format(timeout))
+
+
+def run(concurrency_levels=(1, 8, 32, 128), duration=30, soak=0, profile=None,
+        fixtures=None, threads=16, rate_limits=False, sample_every=10, fixtures_dir=None):
+    """
+    Run a concurrency sweep followed by an optional soak at the highest level
+
+    Parameters
+    ----------
+    concurrency_levels : list
+    duration : float
+        Seconds at each concurrency level
+    soak : float
+        Seconds to run the soak for, 0 to skip it
+    profile : dict
+        Traffic profile, see DEFAULT_PROFILE
+    fixtures : dict
+        Size of the synthetic files, see DEFAULT_FIXTURES
+    threads : int
+        Number of waitress worker threads
+    rate_limits : bool
+        Keep the default admission control on the server
+    sample_every : float
+        Seconds between samples of the server during the soak
+    fixtures_dir : str
+        Directory for the synthetic files. A temporary directory is used and
+        removed afterwards if this is None.
+
+    Returns
+    -------
+    dict
+        Report with the results for each level and the soak
+    """
+    full_profile = dict(DEFAULT_PROFILE)
+    full_profile.update(profile or {})
+    full_fixtures = dict(DEFAULT_FIXTURES)
+    full_fixtures.update(fixtures or {})
+
+    tmp_dir = None
+    if fixtures_dir is None:
+        tmp_dir = fixtures_dir = tempfile.mkdtemp(prefix='mg-rest-3d-loadtest-')
+    try:
+        file_paths = create_fixtures(fixtures_dir, **full_fixtures)
+        process, port = start_server(fixtures_dir, threads, rate_limits)
+        try:
+            report = {'profile': full_profile, 'fixtures': full_fixtures, 'levels': []}
+            for concurrency in concurrency_levels:
+                report['levels'].append(run_level(
+                    '127.0.0.1', port, sorted(file_paths), concurrency, duration,
+                    full_profile, process.pid))
+            if soak:
+                report['soak'] = run_level(
+                    '127.0.0.1', port, sorted(file_paths), max(concurrency_levels), soak,
+                    full_profile, process.pid, sample_every)
+        finally:
+            process.terminate()
+            process.wait()
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir)
+    return report
+
+
+def _growth(result, key):
+    before = (result.get('server_before') or {}).get(key)
+    after = (result.get('server_after') or {}).get(key)
+    if before is None or after is None:
+        return '-'
+    return '{:+d}'.format(after - before)
+
+
+def print_report(report):
+    """
+    Print a table of the results for each level
+    """
+    print("{:>6} {:>10} {:>9} {:>9} {:>9} {:>9} {:>9} {:>8} {:>10}".format(
+        "users", "req/s", "p50 ms", "p95 ms", "p99 ms", "errors", "429s", "fds", "rss kB"))
+    rows = list(report['levels'])
+    if 'soak' in report:
+        rows.append(report['soak'])
+    for result in rows:
+        print("{:>6} {:>10.1f} {:>9} {:>9} {:>9} {:>9.2%} {:>9} {:>8} {:>10}".format(
+            result['concurrency'], result['throughput_rps'],
+            '{:.1f}'.format(result['p50_ms']) if result['p50_ms'] is not None else '-',
+            '{:.1f}'.format(result['p95_ms']) if result['p95_ms'] is not None else '-',
+            '{:.1f}'.format(result['p99_ms']) if result['p99_ms'] is not None else '-',
+            result['error_rate'], result['throttled'],
+            _growth(result, 'fds'), _growth(result, 'rss_kb')))
+    if 'soak' in report:
+        print()
+        print("Soak samples (elapsed s, requests, fds, rss kB):")
+        for sample in report['soak'].get('samples', []):
+            print("  {:>8.0f} {:>10} {:>6} {:>10}".format(
+                sample['elapsed'], sample['requests'], sample['fds'], sample['rss_kb']))
+
+
+def main():
+    """
+    Parse the command line and run the load test, or the server for it
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Load test and soak harness")
+    parser.add_argument(
+        "--concurrency", default="1,8,32,128",
+        help="Comma separated list of the numbers of concurrent clients")
+    parser.add_argument(
+        "--duration", type=float, default=30, help="Seconds at each concurrency level")
+    parser.add_argument(
+        "--soak", type=float, default=0,
+        help="Seconds to run at the highest concurrency after the sweep")
+    parser.add_argument(
+        "--sample_every", type=float, default=10,
+        help="Seconds between samples of the server during the soak")
+    parser.add_argument("--profile", help="JSON file with the traffic profile")
+    parser.add_argument("--fixtures", help="JSON file with the size of the synthetic files")
+    parser.add_argument("--threads", type=int, default=16, help="waitress worker threads")
+    parser.add_argument(
+        "--rate_limits", action="store_true",
+        help="Keep the default admission control on the server")
+    parser.add_argument("--report", help="File to write the JSON report to")
+    parser.add_argument("--serve", metavar="FIXTURES_DIR", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.threads, args.rate_limits)
+        return
+
+    profile = None
+    if args.profile:
+        with open(args.profile) as profile_json:
+            profile = json.load(profile_json)
+    fixtures = None
+    if args.fixtures:
+        with open(args.fixtures) as fixtures_json:
+            fixtures = json.load(fixtures_json)
+
+    report = run(
+        [int(level) for level in args.concurrency.split(',')], args.duration, args.soak,
+        profile, fixtures, args.threads, args.rate_limits, args.sample_every)
+
+    print_report(report)
+    if args.report:
+        with open(args.report, 'w') as report_json:
+            json.dump(report, report_json, indent=2)
+
+
+if __name__ == "__main__":
+    main()
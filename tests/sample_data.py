@@ -0,0 +1,214 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import json
+import os
+import sys
+
+import h5py
+import numpy as np
+
+RESOLUTION = 10000
+
+# region_id: (chromosome, start, end, beads, models, clusters)
+REGIONS = [
+    ('region_a', 'chr1', 0, 100000, 10, 4, 2),
+    ('region_b', 'chr1', 100000, 200000, 10, 4, 2),
+    ('region_c', 'chr2', 0, 50000, 5, 3, 1),
+]
+
+
+def create_sample_file(file_path, resolution=RESOLUTION, regions=None, with_table=False,
+                       with_stats=False, mode="w"):
+    """
+    Write a small HDF5 file with the same layout that is generated by
+    `scripts/parsing_models.py`. The `meta/regions` table is only written if
+    with_table is set and the model statistics only if with_stats is set.
+    With mode "a" the resolution is added to an existing file.
+
+    Returns
+    -------
+    dict
+        Coordinates that were written for each region, as an array of shape
+        (beads, models, 3)
+    """
+    if regions is None:
+        regions = REGIONS
+
+    if with_stats:
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+        from parsing_models import write_stats
+
+    coords = {}
+    rng = np.random.RandomState(0)
+
+    h5_file = h5py.File(file_path, mode)
+    grp = h5_file.create_group(str(resolution))
+    meta = grp.create_group('meta')
+    mpgrp = meta.create_group('model_params')
+    clustersgrp = meta.create_group('clusters')
+    centroidsgrp = meta.create_group('centroids')
+
+    total = sum(region[4] for region in regions)
+    dset = grp.create_dataset(
+        'data', (total, 1000, 3), maxshape=(None, 1000, 3),
+        dtype='int32', chunks=True, compression="gzip")
+    dset.attrs['title'] = 'Sample models'
+    dset.attrs['resolution'] = resolution
+    dset.attrs['TADbit_meta'] = json.dumps({'formatVersion': 3, 'producer': 'sample_data'})
+    dset.attrs['dependencies'] = json.dumps({})
+    dset.attrs['restraints'] = json.dumps([])
+
+    table = []
+    current_size = 0
+    for region_id, chrom, start, end, beads, models, clusters in regions:
+        data = rng.randint(-1000, 1000, size=(beads, models, 3)).astype('int32')
+        coords[region_id] = data
+        dset[current_size:current_size + beads, 0:models, :] = data
+
+        model_param = [[ref + 1, ref % clusters] for ref in range(models)]
+        model_param_ds = mpgrp.create_dataset(region_id, data=model_param)
+        model_param_ds.attrs['i'] = current_size
+        model_param_ds.attrs['j'] = current_size + beads
+        model_param_ds.attrs['chromosome'] = chrom
+        model_param_ds.attrs['start'] = start
+        model_param_ds.attrs['end'] = end
+
+        clustergrps = clustersgrp.create_group(region_id)
+        for cluster in range(clusters):
+            clustergrps.create_dataset(
+                str(cluster),
+                data=[ref + 1 for ref in range(models) if ref % clusters == cluster])
+        centroidsgrp.create_dataset(
+            region_id, data=[cluster + 1 for cluster in range(clusters)])
+
+        if with_stats:
+            write_stats(meta, region_id, data, model_param)
+
+        table.append((
+            region_id, chrom, start, end, current_size, current_size + beads,
+            models, clusters
+        ))
+        current_size += beads
+
+    if with_table:
+        meta.create_dataset('regions', data=np.array(table, dtype=[
+            ('uuid', 'S64'), ('chromosome', 'S32'), ('start', 'int64'),
+            ('end', 'int64'), ('i', 'int64'), ('j', 'int64'),
+            ('models', 'int32'), ('clusters', 'int32')
+        ]))
+
+    h5_file.close()
+
+    return coords
+
+
+def write_source(file_path, uuid, chrom='chr1', start=0, end=100000, beads=10, models=4,
+                 clusters=2, resolution=RESOLUTION, seed=0):
+    """
+    Write a TADbit JSON file for a single region, in the format that is loaded
+    by `scripts/parsing_models.py`
+
+    Returns
+    -------
+    numpy.ndarray
+        Coordinates of the models, as an array of shape (beads, models, 3)
+    """
+    rng = np.random.RandomState(seed)
+    coords = rng.randint(-1000, 1000, size=(beads, models, 3)).astype('int32')
+
+    source = {
+        'metadata': {'formatVersion': 3, 'producer': 'sample_data'},
+        'object': {
+            'uuid': uuid,
+            'title': 'Sample models',
+            'experimentType': 'Hi-C',
+            'species': 'Homo sapiens',
+            'project': 'sample',
+            'identifier': 'sample',
+            'assembly': 'GRCh38',
+            'cellType': 'sample',
+            'resolution': resolution,
+            'datatype': 'xyz',
+            'components': 3,
+            'source': 'local',
+            'chrom': [chrom],
+            'chromStart': [start],
+            'chromEnd': [end],
+            'dependencies': {},
+        },
+        'models': [
+            {'ref': str(ref + 1), 'data': coords[:, ref, :].reshape(-1).tolist()}
+            for ref in range(models)
+        ],
+        'clusters': [
+            [str(ref + 1) for ref in range(models) if ref % clusters == cluster]
+            for cluster in range(clusters)
+        ],
+        'centroids': [str(cluster + 1) for cluster in range(clusters)],
+        'restraints': [],
+    }
+
+    with open(file_path, 'w') as source_file:
+        json.dump(source, source_file)
+
+    return coords
+
+
+class LocalService(object):
+    """
+    Point the app at a sample file, with local stand-ins for the auth server
+    and the DM API
+    """
+
+    def __init__(self, app, catalogue, tmpdir, regions=None, with_stats=False):
+        self.app = app
+        self.file_path = str(tmpdir.join('sample.hdf5'))
+        self.coords = create_sample_file(
+            self.file_path, regions=regions, with_stats=with_stats)
+
+        self._validator = app.AUTH_CACHE.validator
+        self._catalogue = app.CATALOGUE
+
+        app.AUTH_CACHE.clear()
+        app.AUTH_CACHE.validator = lambda token: ({'user_id': 'test'}, None)
+        app.CATALOGUE = catalogue.Catalogue(
+            str(tmpdir.join('catalogue.db')), lambda user_id, file_id: self.file_path)
+        self.client = app.APP.test_client()
+
+    def get(self, url):
+        """
+        Authorised GET request against the app, returning the decoded JSON
+        """
+        rest_value = self.client.get(url, headers=dict(Authorization='Bearer test'))
+        return json.loads(rest_value.data)
+
+    def close(self):
+        """
+        Restore the app
+        """
+        from rest import coord_store
+
+        if self.app.PREFETCHER is not None:
+            self.app.PREFETCHER.wait()
+        self.app.CATALOGUE.close()
+        self.app.CATALOGUE = self._catalogue
+        self.app.AUTH_CACHE.validator = self._validator
+        self.app.AUTH_CACHE.clear()
+        coord_store.close_stores()
@@ -0,0 +1,148 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import json
+
+import pytest
+
+from context import admission
+from sample_data import RESOLUTION
+
+class FakeClock(object):
+    """
+    Clock that only moves when told to
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+# Small bucket and a clock that does not move
+SERVICE_OPTIONS = {
+    'app': {
+        'ADMISSION': lambda tmpdir: admission.AdmissionControl(
+            rate=10, burst=100, max_expensive=1, expensive_cost=1000, clock=FakeClock())
+    }
+}
+
+def test_bucket_refill():
+    """
+    Test that the bucket is charged by cost and refilled over time
+    """
+    clock = FakeClock()
+    control = admission.AdmissionControl(rate=10, burst=100, clock=clock)
+
+    assert control.admit('a', 60)[0] is not None
+    ticket, retry_after = control.admit('a', 60)
+    assert ticket is None
+    assert retry_after == pytest.approx(2.0)
+
+    # Other users have their own bucket
+    assert control.admit('b', 60)[0] is not None
+
+    clock.now += 2
+    assert control.admit('a', 60)[0] is not None
+
+def test_large_request_debt():
+    """
+    Test that a request larger than the burst is only run from a full bucket
+    and then has to be paid back
+    """
+    clock = FakeClock()
+    control = admission.AdmissionControl(rate=10, burst=100, clock=clock)
+
+    assert control.admit('a', 300)[0] is not None
+    ticket, retry_after = control.admit('a', 1)
+    assert ticket is None
+    assert retry_after == pytest.approx(20.1)
+
+def test_expensive_slots():
+    """
+    Test that expensive requests are capped globally and that the tokens are
+    returned when there is no free slot
+    """
+    control = admission.AdmissionControl(
+        rate=10, burst=1000, max_expensive=1, expensive_cost=100, clock=FakeClock())
+
+    ticket, _ = control.admit('a', 200)
+    assert ticket is not None
+
+    rejected, retry_after = control.admit('b', 200)
+    assert rejected is None
+    assert retry_after == 1
+
+    # Cheap requests are not held back by the expensive ones
+    assert control.admit('b', 10)[0] is not None
+
+    ticket.release()
+    ticket.release()
+    assert control.admit('b', 200)[0] is not None
+    assert control.admit('b', 600)[0] is None
+
+def test_model_rate_limit(service):
+    """
+    Test that GetModel is charged beads x models and returns 429 with a
+    Retry-After header once the bucket is empty
+    """
+    url = '/mug/api/3dcoord/model?file_id=test&res=' + str(RESOLUTION) + '&region=region_a&model='
+    headers = dict(Authorization='Bearer test')
+
+    # region_a has 10 beads and 4 models. Each request is for a different
+    # URL so that none of them are served from the response cache.
+    for model_str in ('all', '1,2,3,4'):
+        assert service.client.get(url + model_str, headers=headers).status_code == 200
+
+    rest_value = service.client.get(url + 'all&mpp=4', headers=headers)
+    assert rest_value.status_code == 429
+    assert rest_value.headers['Retry-After'] == '2'
+    assert json.loads(rest_value.data)['error'] == 'TooManyRequests'
+
+@pytest.mark.parametrize('service', [{
+    'app': {
+        'ADMISSION': lambda tmpdir: admission.AdmissionControl(
+            rate=10, burst=10 ** 9, max_expensive=1, expensive_cost=admission.LIST_COST,
+            clock=FakeClock())
+    },
+    'files': {'file_b': [('region_d', 'chr1', 50000, 150000, 10, 2, 1)]}
+}], indirect=True)
+def test_listing_tickets_released(service):
+    """
+    Test that the listing end points release their tickets, so that with a
+    single read slot each of them can be requested again
+    """
+    query = '?file_id=file_a&res=' + str(RESOLUTION)
+    urls = [
+        '/mug/api/3dcoord/resolutions?file_id=file_a',
+        '/mug/api/3dcoord/chromosomes' + query,
+        '/mug/api/3dcoord/regions' + query + '&chrom=chr1&start=0&end=200000',
+        '/mug/api/3dcoord/locus?file_id=file_a&chrom=chr1&start=0&end=200000',
+        '/mug/api/3dcoord/models' + query + '&region=region_a',
+        '/mug/api/3dcoord/federated/regions?file_ids=file_a,file_b&res=' + str(RESOLUTION) +
+        '&chrom=chr1&start=0&end=200000',
+    ]
+    headers = dict(Authorization='Bearer test')
+    for url in urls + urls:
+        rest_value = service.client.get(url, headers=headers)
+        assert rest_value.status_code == 200, url
+        rest_value.close()
+
+    assert service.app.ADMISSION.rejected == 0
+    assert service.app.ADMISSION.admitted == 2 * len(urls)
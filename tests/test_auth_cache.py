@@ -0,0 +1,144 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import json
+
+from context import app, auth_cache
+
+class LocalValidator(object):
+    """
+    Stand-in for the auth server that accepts tokens starting with `good`
+    """
+
+    def __init__(self, expires_at=None):
+        self.calls = 0
+        self.expires_at = expires_at
+
+    def __call__(self, token):
+        self.calls += 1
+        if token is not None and token.startswith('good'):
+            return {'user_id': token}, self.expires_at
+        return None, None
+
+class Clock(object):
+    """
+    Clock that only moves when told to
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def test_positive_cache():
+    """
+    Test that an accepted token is only validated once within the TTL
+    """
+    validator = LocalValidator()
+    clock = Clock()
+    cache = auth_cache.TokenCache(validator, ttl=60, clock=clock)
+
+    assert cache.lookup('good_1') == ({'user_id': 'good_1'}, False)
+    assert cache.lookup('good_1') == ({'user_id': 'good_1'}, True)
+    assert cache.validate('good_1') == {'user_id': 'good_1'}
+    assert validator.calls == 1
+
+    clock.now += 61
+    cache.validate('good_1')
+    assert validator.calls == 2
+
+def test_token_expiry():
+    """
+    Test that the token is validated again once it has expired, even if that
+    is before the TTL
+    """
+    clock = Clock()
+    validator = LocalValidator(expires_at=clock.now + 5)
+    cache = auth_cache.TokenCache(validator, ttl=60, clock=clock)
+
+    cache.validate('good_1')
+    clock.now += 6
+    cache.validate('good_1')
+    assert validator.calls == 2
+
+def test_negative_cache():
+    """
+    Test that rejected tokens are held for the shorter negative TTL
+    """
+    validator = LocalValidator()
+    clock = Clock()
+    cache = auth_cache.TokenCache(validator, ttl=60, negative_ttl=5, clock=clock)
+
+    assert cache.validate('bad') is None
+    assert cache.validate('bad') is None
+    assert validator.calls == 1
+
+    clock.now += 6
+    cache.validate('bad')
+    assert validator.calls == 2
+
+    assert cache.lookup('') == (None, False)
+    assert validator.calls == 3
+
+def test_cache_size():
+    """
+    Test that the least recently used token is dropped once the cache is full
+    """
+    validator = LocalValidator()
+    cache = auth_cache.TokenCache(validator, max_size=2)
+
+    cache.validate('good_1')
+    cache.validate('good_2')
+    cache.validate('good_1')
+    cache.validate('good_3')
+    assert len(cache) == 2
+
+    cache.validate('good_1')
+    assert validator.calls == 3
+    cache.validate('good_2')
+    assert validator.calls == 4
+
+def test_authorized_end_point():
+    """
+    Test that the end points use the cache with a local validator
+    """
+    validator = LocalValidator()
+    original = app.AUTH_CACHE.validator
+    app.AUTH_CACHE.validator = validator
+    app.AUTH_CACHE.clear()
+    client = app.APP.test_client()
+    try:
+        for _ in range(3):
+            rest_value = client.get(
+                '/mug/api/3dcoord/resolutions',
+                headers=dict(Authorization='good_token')
+            )
+            assert 'usage' in json.loads(rest_value.data)
+
+        rest_value = client.get(
+            '/mug/api/3dcoord/resolutions',
+            headers=dict(Authorization='bad_token')
+        )
+        assert json.loads(rest_value.data)['error'] == 'Forbidden'
+    finally:
+        app.AUTH_CACHE.validator = original
+        app.AUTH_CACHE.clear()
+
+    assert validator.calls == 2
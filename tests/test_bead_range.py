@@ -0,0 +1,88 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import pytest
+
+from context import coord_store
+from sample_data import RESOLUTION
+
+MODEL_URL = '/mug/api/3dcoord/model?file_id=test&res=' + str(RESOLUTION) + '&region=region_a&model=all'
+
+def test_genomic_range(service):
+    """
+    Test that a genomic interval returns the beads that overlap it
+    """
+    details = service.get(MODEL_URL + '&start=25000&end=55000')
+    assert details['query_data']['bead_from'] == 2
+    assert details['query_data']['bead_to'] == 6
+    for k, model in enumerate(details['models']):
+        assert model['data'] == service.coords['region_a'][2:6, k, :].ravel().tolist()
+
+def test_bead_range_pages(service):
+    """
+    Test that a range of beads is kept when following the page cursors and
+    applies to the residual encoding
+    """
+    details = service.get(MODEL_URL + '&bead_from=7&mpp=2')
+    assert (details['query_data']['bead_from'], details['query_data']['bead_to']) == (7, 10)
+    assert details['models'][0]['data'] == service.coords['region_a'][7:, 0, :].ravel().tolist()
+
+    next_page = service.get(details['_links']['_next_page'])
+    assert next_page['query_data']['bead_from'] == 7
+    assert next_page['models'][1]['data'] == service.coords['region_a'][7:, 3, :].ravel().tolist()
+
+    details = service.get(MODEL_URL + '&bead_from=7&encoding=residual')
+    assert len(details['keyframes'][0]['data']) == 9
+    assert len(details['models'][1]['residual']) == 9
+
+def test_bead_range_format(service):
+    """
+    Test that the structural formats only include the beads in the range
+    """
+    rest_value = service.client.get(
+        MODEL_URL + '&bead_to=4&format=xyz', headers=dict(Authorization='Bearer test'))
+    lines = rest_value.data.decode('ascii').splitlines()
+    assert lines[0] == '4'
+    assert len(lines) == 4 * (4 + 2)
+
+def test_bead_range_outside(service):
+    """
+    Test that a range with none of the beads of the region is refused
+    """
+    details = service.get(MODEL_URL + '&start=200000&end=300000')
+    assert details['error'] == 'InvalidRange'
+
+    details = service.get(MODEL_URL + '&bead_from=a')
+    assert details['error'] == 'IncorrectParameterType'
+
+def test_get_bead_range(service):
+    """
+    Test the mapping of genomic intervals and bead numbers to bead slices
+    """
+    store = coord_store.get_store(service.file_path)
+    assert store.get_bead_range(RESOLUTION, 'region_a') is None
+    assert store.get_bead_range(RESOLUTION, 'region_a', start=0, end=10000) == (0, 1)
+    assert store.get_bead_range(RESOLUTION, 'region_a', start=9999, end=10001) == (0, 2)
+    assert store.get_bead_range(RESOLUTION, 'region_a', end=500000) == (0, 10)
+    assert store.get_bead_range(RESOLUTION, 'region_a', bead_from=-3, bead_to=2) == (0, 2)
+    with pytest.raises(ValueError):
+        store.get_bead_range(RESOLUTION, 'region_a', bead_from=5, bead_to=5)
+
+    _, coords = store.get_model_page(RESOLUTION, 'region_a', [1, 3], (3, 5))
+    assert coords.tolist() == service.coords['region_a'][3:5, [1, 3], :].tolist()
@@ -0,0 +1,125 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import os
+
+import pytest
+
+from context import app, catalogue
+from sample_data import RESOLUTION
+
+class LocalDM(object):
+    """
+    Stand-in for the DM API holding a single file
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.files = {'file_1': file_path}
+        self.lookups = 0
+
+    def lookup(self, user_id, file_id):  # pylint: disable=unused-argument
+        """
+        Resolve a file_id
+        """
+        self.lookups += 1
+        return self.files[file_id]
+
+    def list(self, user_id):  # pylint: disable=unused-argument
+        """
+        List the files for a user
+        """
+        return list(self.files.items())
+
+@pytest.fixture
+def local_dm(sample_file):
+    """
+    DM stand-in with a sample file
+    """
+    return LocalDM(sample_file)
+
+def test_catalogue_lookup(tmpdir, local_dm):
+    """
+    Test that the DM API is only used for the first lookup of a file
+    """
+    cat = catalogue.Catalogue(
+        str(tmpdir.join('catalogue.db')), local_dm.lookup, local_dm.list)
+
+    assert cat.get_resolutions('test', 'file_1') == [RESOLUTION]
+    assert cat.get_chromosomes('test', 'file_1', RESOLUTION) == ['chr1', 'chr2']
+    assert cat.get_file_path('test', 'file_1') == local_dm.file_path
+    assert local_dm.lookups == 1
+    assert cat.hits == 2
+
+    # The catalogue persists between restarts
+    cat.close()
+    cat = catalogue.Catalogue(
+        str(tmpdir.join('catalogue.db')), local_dm.lookup, local_dm.list)
+    cat.get_resolutions('test', 'file_1')
+    assert local_dm.lookups == 1
+
+def test_catalogue_modified(tmpdir, local_dm):
+    """
+    Test that a file is described again once it has been modified
+    """
+    described = []
+
+    def describe(file_path):
+        described.append(file_path)
+        return catalogue.describe_file(file_path)
+
+    cat = catalogue.Catalogue(
+        str(tmpdir.join('catalogue.db')), local_dm.lookup, local_dm.list, describe)
+    cat.get_resolutions('test', 'file_1')
+    stat = os.stat(local_dm.file_path)
+    os.utime(local_dm.file_path, (stat.st_atime, stat.st_mtime + 10))
+    cat.get_resolutions('test', 'file_1')
+
+    assert len(described) == 2
+    assert local_dm.lookups == 1
+
+def test_catalogue_refresh(tmpdir, local_dm):
+    """
+    Test that files removed from the DM API are removed by a refresh
+    """
+    cat = catalogue.Catalogue(
+        str(tmpdir.join('catalogue.db')), local_dm.lookup, local_dm.list)
+    cat.get_resolutions('test', 'file_1')
+
+    local_dm.files = {}
+    cat.refresh()
+    with pytest.raises(KeyError):
+        cat.get_resolutions('test', 'file_1')
+
+def test_catalogue_data_dir(tmpdir, monkeypatch):
+    """
+    Test that the app keeps its catalogue in the configured data directory
+    """
+    monkeypatch.setattr(app, 'CATALOGUE', None)
+    monkeypatch.setitem(app.APP.config, 'CATALOGUE_REFRESH', 3600)
+    monkeypatch.setenv('MG_REST_3D_DATA_DIR', str(tmpdir.join('env_data')))
+    assert app._data_dir() == str(tmpdir.join('env_data'))
+
+    monkeypatch.setitem(app.APP.config, 'DATA_DIR', str(tmpdir.join('data')))
+    cat = app._get_catalogue()
+    try:
+        assert cat.db_path == os.path.join(str(tmpdir.join('data')), 'catalogue.db')
+        assert os.path.isfile(cat.db_path)
+    finally:
+        cat.close()
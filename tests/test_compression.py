@@ -0,0 +1,122 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import gzip
+import io
+import json
+import zlib
+
+from context import app, compression
+from sample_data import RESOLUTION
+
+# Empty response cache
+SERVICE_OPTIONS = {'app': {'RESPONSE_CACHE': lambda tmpdir: compression.ResponseCache()}}
+
+def _gunzip(data):
+    return gzip.GzipFile(fileobj=io.BytesIO(data)).read()
+
+def test_negotiate():
+    """
+    Test the choice of encoding from the Accept-Encoding header
+    """
+    encodings = ['br', 'gzip', 'deflate']
+    assert compression.negotiate('gzip, deflate, br', encodings) == 'br'
+    assert compression.negotiate('gzip;q=1.0, br;q=0.5', encodings) == 'gzip'
+    assert compression.negotiate('deflate', encodings) == 'deflate'
+    assert compression.negotiate('*;q=0.1, br;q=0', encodings) == 'gzip'
+    assert compression.negotiate('identity', encodings) is None
+    assert compression.negotiate(None, encodings) is None
+
+def test_compress_round_trip():
+    """
+    Test that gzip and deflate bodies decompress to the original
+    """
+    data = b'{"data": [1, 2, 3]}' * 100
+    assert _gunzip(compression.compress(data, 'gzip')) == data
+    assert zlib.decompress(compression.compress(data, 'deflate')) == data
+    assert _gunzip(b''.join(compression.compress_stream([data, data], 'gzip'))) == data + data
+
+def test_response_cache_eviction():
+    """
+    Test that each encoding is only compressed once and that the least
+    recently used entries are removed first
+    """
+    cache = compression.ResponseCache(max_bytes=2500)
+    cache.put('a', b'a' * 1000)
+    cache.put('b', b'b' * 1000)
+
+    gzipped = cache.get('a', 'gzip')
+    assert _gunzip(gzipped) == b'a' * 1000
+    assert cache.get('a', 'gzip') is gzipped
+
+    cache.put('c', b'c' * 1000)
+    assert cache.get('b') is None
+    assert cache.get('a') == b'a' * 1000
+    assert cache.size <= 2500
+    assert (cache.hits, cache.misses) == (3, 1)
+
+    body = cache.get('c')
+    assert cache.encode('c', body, 'gzip') is cache.encode('c', body, 'gzip')
+    assert cache.encode('c', body, None) is body
+    assert _gunzip(cache.encode('d', b'd' * 1000, 'gzip')) == b'd' * 1000
+    assert (cache.hits, cache.misses) == (4, 1)
+
+def test_model_compressed(service):
+    """
+    Test that GetModel pages are compressed and then served from the cache
+    """
+    url = '/mug/api/3dcoord/model?file_id=test&res=' + str(RESOLUTION) + '&region=region_a&model=all'
+    headers = {'Authorization': 'Bearer test', 'Accept-Encoding': 'gzip'}
+
+    first = service.client.get(url, headers=headers)
+    assert first.headers['Content-Encoding'] == 'gzip'
+    assert (app.RESPONSE_CACHE.hits, app.RESPONSE_CACHE.misses) == (0, 1)
+    details = json.loads(_gunzip(first.data))
+    assert details['models'][0]['data'] == service.coords['region_a'][:, 0, :].ravel().tolist()
+
+    second = service.client.get(url, headers=headers)
+    assert second.data == first.data
+    assert (app.RESPONSE_CACHE.hits, app.RESPONSE_CACHE.misses) == (1, 1)
+
+    plain = service.client.get(url, headers={'Authorization': 'Bearer test'})
+    assert 'Content-Encoding' not in plain.headers
+    assert json.loads(plain.data) == details
+    assert (app.RESPONSE_CACHE.hits, app.RESPONSE_CACHE.misses) == (2, 1)
+
+def test_stream_compressed(service):
+    """
+    Test that streamed formats and the listing end points are compressed
+    """
+    headers = {'Authorization': 'Bearer test', 'Accept-Encoding': 'gzip'}
+
+    rest_value = service.client.get(
+        '/mug/api/3dcoord/model?file_id=test&res=' + str(RESOLUTION) +
+        '&region=region_a&model=all&format=pdb', headers=headers)
+    assert rest_value.headers['Content-Encoding'] == 'gzip'
+    assert _gunzip(rest_value.data).endswith(b'END\n')
+
+    app.APP.config['COMPRESSION_MIN_SIZE'] = 0
+    try:
+        rest_value = service.client.get(
+            '/mug/api/3dcoord/models?file_id=test&res=' + str(RESOLUTION) +
+            '&region=region_a', headers=headers)
+    finally:
+        del app.APP.config['COMPRESSION_MIN_SIZE']
+    assert rest_value.headers['Content-Encoding'] == 'gzip'
+    assert 'model_list' in json.loads(_gunzip(rest_value.data))
@@ -0,0 +1,220 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import os
+
+import h5py
+import numpy as np
+import pytest
+
+from context import build_regions_table, coord_store, parsing_models
+from sample_data import create_sample_file, RESOLUTION, REGIONS
+
+def test_store_rotation(tmpdir):
+    """
+    Test that replacing a file gives a new store while the old store carries
+    on reading the old file
+    """
+    file_path = str(tmpdir.join('sample.hdf5'))
+    staging = str(tmpdir.join('sample.hdf5.staging'))
+    create_sample_file(file_path, regions=REGIONS[:2])
+
+    try:
+        old_store = coord_store.get_store(file_path)
+        assert coord_store.get_store(file_path) is old_store
+        assert len(old_store.get_index(RESOLUTION)) == 2
+
+        create_sample_file(staging)
+        os.rename(staging, file_path)
+
+        new_store = coord_store.get_store(file_path)
+        assert new_store is not old_store
+        assert len(new_store.get_index(RESOLUTION)) == 3
+
+        assert old_store.get_dataset(RESOLUTION).shape[0] == 20
+        old_store.close()
+    finally:
+        coord_store.close_stores()
+
+def test_regions_table(tmpdir):
+    """
+    Test that the index loaded from the regions table matches the index built
+    from the attributes of each region
+    """
+    attrs_path = str(tmpdir.join('attrs.hdf5'))
+    table_path = str(tmpdir.join('table.hdf5'))
+    create_sample_file(attrs_path)
+    create_sample_file(table_path, with_table=True)
+
+    attrs_store = coord_store.CoordStore(attrs_path)
+    table_store = coord_store.CoordStore(table_path)
+    try:
+        assert 'regions' in table_store.file_handle[str(RESOLUTION)]['meta']
+        attrs_index = attrs_store.get_index(RESOLUTION)
+        table_index = table_store.get_index(RESOLUTION)
+        for region in REGIONS:
+            assert attrs_index.get_region(region[0]) == table_index.get_region(region[0])
+        assert table_index.get_region('region_b')['models'] == 4
+        assert table_index.get_region_order('chr1') == ['region_a', 'region_b']
+        assert table_index.get_chromosomes() == attrs_index.get_chromosomes()
+    finally:
+        attrs_store.close()
+        table_store.close()
+
+def test_regions_table_migration(tmpdir, monkeypatch):
+    """
+    Test that build_regions_table.py adds a table to a file written without
+    one, through a staging copy, and that the index is then loaded from it
+    """
+    file_path = str(tmpdir.join('sample.hdf5'))
+    create_sample_file(file_path)
+    attrs_store = coord_store.CoordStore(file_path)
+    attrs_index = attrs_store.get_index(RESOLUTION)
+    attrs_store.close()
+
+    monkeypatch.setattr('sys.argv', ['build_regions_table.py', '--hdf5', file_path])
+    build_regions_table.main()
+    assert not os.path.exists(file_path + '.staging')
+
+    def _from_group(mpgrp, clustersgrp=None):  # pylint: disable=unused-argument
+        raise AssertionError('index built from the region attributes')
+
+    monkeypatch.setattr(coord_store.RegionIndex, 'from_group', staticmethod(_from_group))
+    table_store = coord_store.CoordStore(file_path)
+    try:
+        table_index = table_store.get_index(RESOLUTION)
+        assert table_index.region_ids == attrs_index.region_ids
+        for region in REGIONS:
+            assert table_index.get_region(region[0]) == attrs_index.get_region(region[0])
+    finally:
+        table_store.close()
+
+def test_stale_regions_table(tmpdir):
+    """
+    Test that a regions table that no longer matches the regions is ignored,
+    even when it has the right number of rows
+    """
+    file_path = str(tmpdir.join('sample.hdf5'))
+    create_sample_file(file_path, with_table=True)
+
+    with h5py.File(file_path, 'a') as h5_file:
+        meta = h5_file[str(RESOLUTION)]['meta']
+        meta['model_params'].move('region_c', 'region_d')
+        meta['clusters'].move('region_c', 'region_d')
+        assert not coord_store._table_current(meta, meta['regions'][:])  # pylint: disable=protected-access
+
+        index = coord_store.RegionIndex.from_meta(meta)
+        assert 'region_d' in index
+        assert 'region_c' not in index
+
+        # Rows that disagree with the manifest
+        parsing_models.build_regions_table(meta.parent)
+        parsing_models.get_manifest(meta.parent)
+        assert coord_store._table_current(meta, meta['regions'][:])  # pylint: disable=protected-access
+        table = meta['regions'][:]
+        table['i'][0], table['j'][0] = 0, 1
+        meta['regions'][:] = table
+        assert not coord_store._table_current(meta, meta['regions'][:])  # pylint: disable=protected-access
+
+        index = coord_store.RegionIndex.from_meta(meta)
+        assert index.get_region('region_a')['end'] == 100000
+        assert index.row_j[index.region_ids.index('region_a')] == 10
+
+        # Rows beyond the end of the data without a manifest
+        del meta['manifest']
+        table['j'][0] = 1000
+        meta['regions'][:] = table
+        assert not coord_store._table_current(meta, meta['regions'][:])  # pylint: disable=protected-access
+
+@pytest.mark.parametrize('service', [{'with_stats': True}], indirect=True)
+def test_model_stats(tmpdir, service):
+    """
+    Test that the statistics written at ingest are read back and returned by
+    GetModels
+    """
+    hdf5_store = coord_store.get_store(service.file_path)
+    model_stats, cluster_stats = hdf5_store.get_model_stats(RESOLUTION, 'region_a')
+
+    points = service.coords['region_a'].astype(np.float64)
+    radius = np.sqrt(((points - points.mean(axis=0)) ** 2).sum(axis=2).mean(axis=0))
+    assert np.allclose(model_stats['radius_of_gyration'], radius)
+    assert np.array_equal(model_stats['bbox_min'], service.coords['region_a'].min(axis=0))
+    assert cluster_stats['models'].tolist() == [2, 2]
+    assert np.isclose(cluster_stats['radius_of_gyration'][1], radius[[1, 3]].mean())
+
+    details = service.get('/mug/api/3dcoord/models?file_id=test&res=' + str(RESOLUTION) + '&region=region_a')
+    stats = details['model_list'][2]['stats']
+    assert np.isclose(stats['radius_of_gyration'], radius[2])
+    assert len(stats['bbox']) == 6
+    assert [entry['cluster'] for entry in details['cluster_stats']] == ['0', '1']
+
+    file_path = str(tmpdir.join('no_stats.hdf5'))
+    create_sample_file(file_path)
+    assert coord_store.get_store(file_path).get_model_stats(RESOLUTION, 'region_a') == (None, None)
+    coord_store.close_stores()
+
+def test_model_catalogue(service):
+    """
+    Test that the model catalogue is shared, read only and selects models by
+    ID and cluster for GetModels and GetModel
+    """
+    hdf5_store = coord_store.get_store(service.file_path)
+    models = hdf5_store.get_catalogue(RESOLUTION, 'region_a')
+    assert hdf5_store.get_catalogue(RESOLUTION, 'region_a') is models
+    assert len(models) == 4
+    assert (models.row_i, models.row_j) == (0, 10)
+    assert not models.model_ids.flags.writeable
+
+    assert models.select().tolist() == [0, 1, 2, 3]
+    assert models.select(['all'], ['1']).tolist() == [1, 3]
+    assert models.select(['1', '2', '4'], [1]).tolist() == [1, 3]
+    assert models.select(['9', 'x']).tolist() == []
+    assert models.model_ids.dtype.kind == 'i'
+    assert models.nbytes() == 2 * 4 * models.model_ids.itemsize
+
+    url = '/mug/api/3dcoord/models?file_id=test&res=' + str(RESOLUTION) + '&region=region_a'
+    details = service.get(url + '&cluster=0')
+    assert [(entry['model'], entry['cluster']) for entry in details['model_list']] == \
+        [('1', '0'), ('3', '0')]
+    assert details['model_list'][1]['_links']['_model'].endswith('&region=region_a&model=3')
+
+    details = service.get(url + '&model=2,3,4&cluster=1')
+    assert [entry['model'] for entry in details['model_list']] == ['2', '4']
+
+    details = service.get(
+        '/mug/api/3dcoord/model?file_id=test&res=' + str(RESOLUTION) +
+        '&region=region_a&model=all&cluster=1')
+    assert [model['ref'] for model in details['models']] == ['2', '4']
+
+def test_catalogue_cache_bound(sample_file, monkeypatch):
+    """
+    Test that the least recently used catalogues are dropped once they hold
+    more than CATALOGUE_CACHE_BYTES
+    """
+    hdf5_store = coord_store.get_store(sample_file)
+    size = hdf5_store.get_catalogue(RESOLUTION, 'region_a').nbytes()
+    monkeypatch.setattr(coord_store, 'CATALOGUE_CACHE_BYTES', 2 * size)
+
+    hdf5_store.get_catalogue(RESOLUTION, 'region_b')
+    hdf5_store.get_catalogue(RESOLUTION, 'region_a')
+    hdf5_store.get_catalogue(RESOLUTION, 'region_c')
+    assert list(hdf5_store._catalogues) == [
+        (str(RESOLUTION), 'region_a'), (str(RESOLUTION), 'region_c')]
+    assert hdf5_store._catalogue_bytes <= 2 * size
+    coord_store.close_stores()
@@ -0,0 +1,98 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import pytest
+
+from context import app, cursor
+from sample_data import RESOLUTION
+
+def test_cursor_round_trip():
+    """
+    Test that a cursor decodes to the state it was created from and that
+    altered cursors are rejected
+    """
+    state = {'f': '/tmp/file.hdf5', 'c': cursor.encode_columns([3, 4, 5]), 'p': 10}
+    token = cursor.encode_cursor(state, b'secret')
+
+    assert cursor.decode_cursor(token, b'secret') == state
+    assert cursor.decode_columns(state['c']) == [3, 4, 5]
+    assert cursor.decode_columns(cursor.encode_columns([1, 5])) == [1, 5]
+
+    with pytest.raises(ValueError):
+        cursor.decode_cursor(token, b'other')
+    with pytest.raises(ValueError):
+        cursor.decode_cursor('A' + token, b'secret')
+
+def test_model_cursor_pages(service):
+    """
+    Test that following the cursors walks all of the models of a region
+    """
+    url = (
+        '/mug/api/3dcoord/model?file_id=test&res=' + str(RESOLUTION) +
+        '&region=region_a&model=all&mpp=3'
+    )
+    details = service.get(url)
+    assert details['query_data']['page_count'] == 2
+
+    refs = [model['ref'] for model in details['models']]
+    next_url = details['_links']['_next_page']
+    details = service.get(next_url[next_url.index('/mug/'):])
+    refs += [model['ref'] for model in details['models']]
+
+    assert details['query_data']['page'] == 2
+    assert '_next_page' not in details['_links']
+    assert '_previous_page' in details['_links']
+    assert refs == ['1', '2', '3', '4']
+
+    coords = service.coords['region_a']
+    assert details['models'][0]['data'] == coords[:, 3, :].ravel().tolist()
+
+def test_model_payload(service):
+    """
+    Test that GetModel returns the TADbit layout of the region and that the
+    cursors do not expose the file location or the user
+    """
+    details = service.get(
+        '/mug/api/3dcoord/model?file_id=test&res=' + str(RESOLUTION) +
+        '&region=region_a&model=all&mpp=3'
+    )
+    assert details['metadata'] == {'formatVersion': 3, 'producer': 'sample_data'}
+    assert details['object']['uuid'] == 'region_a'
+    assert details['object']['title'] == 'Sample models'
+    assert (details['object']['chrom'], details['object']['chromStart']) == (['chr1'], [0])
+    assert details['clusters'] == [[1, 3], [2, 4]]
+    assert details['centroids'] == [1, 2]
+    assert details['restraints'] == []
+    assert sorted(details['models'][0].keys()) == ['data', 'ref']
+
+    token = details['_links']['_next_page'].split('cursor=')[1]
+    state = cursor.decode_cursor(token, app._cursor_secret({'user_id': 'test'}))
+    assert 'f' not in state and 'u' not in state
+    assert service.file_path.encode('utf-8') not in cursor.zlib.decompress(
+        cursor.base64.urlsafe_b64decode(token.split('.')[0] + '=='))
+
+    with pytest.raises(ValueError):
+        cursor.decode_cursor(token, app._cursor_secret({'user_id': 'other'}))
+
+def test_model_cursor_invalid(service):
+    """
+    Test that an altered cursor is rejected
+    """
+    details = service.get('/mug/api/3dcoord/model?cursor=abc.def')
+    assert details['error'] == 'InvalidCursor'
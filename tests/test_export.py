@@ -0,0 +1,158 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import io
+import json
+import os
+import tarfile
+import threading
+import time
+import zipfile
+
+import h5py
+import numpy as np
+import pytest
+
+from context import admission, app, coord_store, export
+from sample_data import RESOLUTION, REGIONS
+
+# Exports written to a temporary directory
+SERVICE_OPTIONS = {
+    'app': {'EXPORTS': lambda tmpdir: export.ExportManager(str(tmpdir.join('exports')))}
+}
+
+def _wait(job):
+    for _ in range(100):
+        if job.status in ('done', 'failed'):
+            break
+        time.sleep(0.05)
+    assert job.status == 'done', job.error
+
+def test_iter_regions(service):
+    """
+    Test that reading in chunks returns the coordinates of each region
+    """
+    hdf5_store = coord_store.get_store(service.file_path)
+    regions = list(export.iter_regions(hdf5_store, RESOLUTION, chunk_rows=12))
+    assert [region[0] for region in regions] == [region[0] for region in REGIONS]
+    for region_id, _, params, coords in regions:
+        assert len(params) == coords.shape[1]
+        assert np.array_equal(coords, service.coords[region_id])
+
+@pytest.mark.parametrize("fmt", ['npz', 'pdb', 'hdf5'])
+def test_export_formats(tmpdir, service, fmt):
+    """
+    Test that each of the archive formats is written
+    """
+    job = app.EXPORTS.submit('test', 'test', service.file_path, RESOLUTION, fmt)
+    _wait(job)
+
+    if fmt == 'npz':
+        archive = np.load(job.output)
+        assert np.array_equal(archive['region_b'], service.coords['region_b'])
+        assert archive['region_b_models'].shape == (4, 2)
+    elif fmt == 'pdb':
+        with tarfile.open(job.output) as tar_file:
+            assert sorted(tar_file.getnames()) == ['region_a.pdb', 'region_b.pdb', 'region_c.pdb']
+    else:
+        with h5py.File(job.output, 'r') as h5_file:
+            assert h5_file[str(RESOLUTION)]['data'].shape == (25, 4, 3)
+            assert 'region_c' in h5_file[str(RESOLUTION)]['meta']['model_params']
+
+def test_export_end_points(service):
+    """
+    Test queueing an export, checking its status and downloading it
+    """
+    headers = dict(Authorization='Bearer test')
+    rest_value = service.client.post(
+        '/mug/api/3dcoord/export?file_id=test&res=' + str(RESOLUTION) + '&export_format=npz',
+        headers=headers
+    )
+    assert rest_value.status_code == 202
+    job_id = json.loads(rest_value.data)['job_id']
+
+    _wait(app.EXPORTS.jobs[job_id])
+    details = service.get('/mug/api/3dcoord/export?job_id=' + job_id)
+    assert details['status'] == 'done'
+    assert details['rows_done'] == details['rows_total']
+
+    rest_value = service.client.get(
+        '/mug/api/3dcoord/export/download?job_id=' + job_id, headers=headers)
+    assert 'regions.json' in zipfile.ZipFile(io.BytesIO(rest_value.data)).namelist()
+
+def test_export_limits(tmpdir, service):
+    """
+    Test the per user job limit and the quota on the export directory
+    """
+    manager = export.ExportManager(
+        str(tmpdir.join('limited')), workers=1, max_user_jobs=1, quota_bytes=1000)
+    blocked = threading.Event()
+    manager._pool.apply_async(blocked.wait)
+    try:
+        manager.submit('test', 'test', service.file_path, RESOLUTION, 'npz', 400)
+        with pytest.raises(IOError) as err:
+            manager.submit('test', 'test', service.file_path, RESOLUTION, 'npz', 400)
+        assert str(err.value) == 'TooManyExports'
+
+        manager.submit('other', 'test', service.file_path, RESOLUTION, 'npz', 400)
+        with pytest.raises(IOError) as err:
+            manager.submit('third', 'test', service.file_path, RESOLUTION, 'npz', 400)
+        assert str(err.value) == 'ExportQuotaExceeded'
+    finally:
+        blocked.set()
+        manager._pool.terminate()
+
+def test_export_admission(service):
+    """
+    Test that an export is charged to the user by admission control
+    """
+    hdf5_store = coord_store.get_store(service.file_path)
+    cost = export.export_cost(hdf5_store, RESOLUTION)
+    assert cost == sum(region[4] * region[5] for region in REGIONS)
+
+    app.ADMISSION = admission.AdmissionControl(rate=1, burst=cost)
+    try:
+        url = '/mug/api/3dcoord/export?file_id=test&res=' + str(RESOLUTION)
+        rest_value = service.client.post(url, headers=dict(Authorization='Bearer test'))
+        assert rest_value.status_code == 202
+        _wait(app.EXPORTS.jobs[json.loads(rest_value.data)['job_id']])
+
+        rest_value = service.client.post(url, headers=dict(Authorization='Bearer test'))
+        assert rest_value.status_code == 429
+
+        rest_value = service.client.post(
+            '/mug/api/3dcoord/export?file_id=test&res=1', headers=dict(Authorization='Bearer test'))
+        assert json.loads(rest_value.data)['error'] == 'NotFound'
+    finally:
+        app.ADMISSION = None
+
+def test_export_dir(tmpdir, monkeypatch):
+    """
+    Test that exports are written within the data directory unless
+    EXPORT_DIR is set
+    """
+    monkeypatch.setattr(app, 'EXPORTS', None)
+    monkeypatch.setitem(app.APP.config, 'DATA_DIR', str(tmpdir.join('data')))
+    exports = app._get_exports()  # pylint: disable=protected-access
+    assert exports.export_dir == os.path.join(str(tmpdir.join('data')), 'exports')
+    assert os.path.isdir(exports.export_dir)
+
+    monkeypatch.setattr(app, 'EXPORTS', None)
+    monkeypatch.setitem(app.APP.config, 'EXPORT_DIR', str(tmpdir.join('elsewhere')))
+    assert app._get_exports().export_dir == str(tmpdir.join('elsewhere'))  # pylint: disable=protected-access
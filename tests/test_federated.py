@@ -0,0 +1,100 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import threading
+
+from context import federated
+from sample_data import RESOLUTION
+
+# Two sample files, `file_a` and `file_b`. Any other file ID fails in the DM
+# API lookup.
+SERVICE_OPTIONS = {'files': {'file_b': [('region_d', 'chr1', 50000, 150000, 10, 2, 1)]}}
+
+def test_split_file_ids():
+    """
+    Test that blanks and repeats are removed from the list of files
+    """
+    assert federated.split_file_ids('a, b,,a,c') == ['a', 'b', 'c']
+
+def test_federation_partial_failure():
+    """
+    Test that a failing file and a file that is too slow are reported without
+    losing the results from the other files
+    """
+    release = threading.Event()
+
+    def _query(file_id):
+        if file_id == 'bad':
+            raise ValueError('Bad file')
+        if file_id == 'slow':
+            release.wait(5)
+        return file_id.upper()
+
+    federation = federated.Federation(4)
+    try:
+        results, errors = federation.run(_query, ['a', 'bad', 'slow', 'b'], timeout=0.2)
+    finally:
+        release.set()
+        federation.close()
+
+    assert results == {'a': 'A', 'b': 'B'}
+    assert errors == {'bad': 'Failed', 'slow': 'Timeout'}
+
+def test_federated_regions(service):
+    """
+    Test that the regions are listed for each file, with unknown files
+    reported as errors
+    """
+    details = service.get(
+        '/mug/api/3dcoord/federated/regions?file_ids=file_a,file_b,missing&res=' +
+        str(RESOLUTION) + '&chrom=chr1&start=60000&end=120000'
+    )
+
+    assert [reg['region_id'] for reg in details['files']['file_a']] == ['region_a', 'region_b']
+    assert [reg['region_id'] for reg in details['files']['file_b']] == ['region_d']
+    assert details['errors'] == {'missing': 'Failed'}
+    assert details['query_data'] == {'files_requested': 3, 'files_returned': 2}
+
+def test_federated_model(service):
+    """
+    Test that the models for each overlapping region are returned for each
+    file, limited by mpp
+    """
+    details = service.get(
+        '/mug/api/3dcoord/federated/model?file_ids=file_a,file_b&res=' +
+        str(RESOLUTION) + '&chrom=chr1&start=0&end=60000&model=all&mpp=3'
+    )
+
+    assert details['errors'] == {}
+    file_a = details['files']['file_a']
+    assert [reg['object']['uuid'] for reg in file_a] == ['region_a']
+    assert len(file_a[0]['models']) == 3
+    assert file_a[0]['models'][0]['data'] == service.coords['region_a'][:, 0, :].ravel().tolist()
+    assert len(details['files']['file_b'][0]['models']) == 2
+
+def test_federated_parameters(service):
+    """
+    Test the usage and parameter errors
+    """
+    details = service.get('/mug/api/3dcoord/federated/regions')
+    assert 'file_ids' in details['usage']['parameters']
+
+    details = service.get(
+        '/mug/api/3dcoord/federated/regions?file_ids=file_a&res=a&chrom=chr1&start=0&end=1')
+    assert details['error'] == 'IncorrectParameterType'
@@ -0,0 +1,69 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import numpy as np
+import pytest
+
+from context import formats
+from sample_data import RESOLUTION
+
+def test_pdb_columns():
+    """
+    Test that the PDB writer matches the fixed column layout
+    """
+    coords = np.array([[1, -2, 30], [-999, 9999, 0]], dtype=np.int32)
+    lines = formats.pdb_model(1, coords).decode('ascii').splitlines()
+
+    assert lines[0] == 'MODEL        1'
+    assert lines[1] == (
+        'ATOM      1  CA  BEA A   1    ' +
+        '%8.3f%8.3f%8.3f' % (1, -2, 30) +
+        '  1.00  0.00           C  '
+    )
+    assert lines[2][30:54] == '%8.3f%8.3f%8.3f' % (-999, 9999, 0)
+    assert lines[-1] == 'ENDMDL'
+
+def test_large_coordinates():
+    """
+    Test that coordinates that do not fit with 3 decimal places use fewer
+    """
+    coords = np.array([[123456, -99999, 0]], dtype=np.int32)
+    line = formats.pdb_model(1, coords).decode('ascii').splitlines()[1]
+    assert [float(line[pos:pos+8]) for pos in (30, 38, 46)] == [123456, -99999, 0]
+
+@pytest.mark.parametrize("fmt", ['pdb', 'cif', 'xyz'])
+def test_model_formats(service, fmt):
+    """
+    Test that GetModel streams each of the structural formats
+    """
+    rest_value = service.client.get(
+        '/mug/api/3dcoord/model?file_id=test&res=' + str(RESOLUTION) +
+        '&region=region_a&model=all&format=' + fmt,
+        headers=dict(Authorization='Bearer test')
+    )
+    text = rest_value.data.decode('ascii')
+    coords = service.coords['region_a']
+
+    assert rest_value.mimetype == formats.FORMATS[fmt]
+    if fmt == 'xyz':
+        lines = text.splitlines()
+        assert lines[0] == str(coords.shape[0])
+        assert [float(val) for val in lines[2].split()[1:]] == coords[0, 0].tolist()
+    else:
+        assert text.count('ATOM ') == coords.shape[0] * coords.shape[1]
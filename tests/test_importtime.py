@@ -0,0 +1,52 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import sys
+
+import pytest
+
+from context import importtime
+
+# Budget for importing rest.app in a fresh interpreter
+IMPORT_BUDGET_MS = 1500
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason="requires -X importtime")
+def test_import_time():
+    """
+    Test that importing the app does not load the HDF5 or DM modules and that
+    it stays within the cold start budget
+    """
+    timings = importtime.measure('rest.app')
+    total_us = importtime.total_time(timings, 'rest.app')
+    print('rest.app import time: {:.1f} ms'.format(total_us / 1000.0))
+
+    assert importtime.heavy_imports(timings) == []
+    assert total_us < IMPORT_BUDGET_MS * 1000
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason="requires -X importtime")
+def test_ping_without_hdf5():
+    """
+    Test that the ping and end point listings are answered without loading h5py
+    """
+    timings = importtime.measure('rest.app', statements=[
+        'client = rest.app.APP.test_client()',
+        'client.get("/mug/api/3dcoord")',
+        'client.get("/mug/api/3dcoord/ping")',
+    ])
+    assert importtime.heavy_imports(timings) == []
@@ -0,0 +1,270 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import json
+import os
+import shutil
+
+import h5py
+import numpy as np
+import pytest
+
+from context import build_model_stats, coord_store, parsing_models
+from sample_data import RESOLUTION, write_source
+
+def _sources(tmpdir, count, seed=0):
+    source_dir = tmpdir.ensure('tadbit', 'sources', dir=True)
+    sources = []
+    for index in range(count):
+        file_path = str(source_dir.join('region_' + str(index) + '.json'))
+        coords = write_source(
+            file_path, 'region_' + str(index), start=index * 100000,
+            end=(index + 1) * 100000, beads=10 + index, seed=seed + index)
+        sources.append((file_path, coords))
+    return sources
+
+def _manifest(file_path):
+    with h5py.File(file_path, 'r') as h5_file:
+        manifest = h5_file[str(RESOLUTION)]['meta']['manifest'][:]
+    return [(row['uuid'].decode('utf-8'), int(row['i']), int(row['j'])) for row in manifest]
+
+def _check_coords(file_path, sources):
+    with h5py.File(file_path, 'r') as h5_file:
+        grp = h5_file[str(RESOLUTION)]
+        for index, (_, coords) in enumerate(sources):
+            mpds = grp['meta']['model_params']['region_' + str(index)]
+            data = grp['data'][mpds.attrs['i']:mpds.attrs['j'], 0:coords.shape[1], :]
+            assert np.array_equal(data, coords)
+
+def test_ingest(tmpdir):
+    """
+    Test that each region is written and committed to the manifest in order
+    """
+    file_path = str(tmpdir.join('models.hdf5'))
+    sources = _sources(tmpdir, 3)
+    parsing_models.ingest([source[0] for source in sources], file_path)
+
+    assert _manifest(file_path) == [
+        ('region_0', 0, 10), ('region_1', 10, 21), ('region_2', 21, 33)]
+    _check_coords(file_path, sources)
+
+    with h5py.File(file_path, 'r') as h5_file:
+        grp = h5_file[str(RESOLUTION)]
+        assert grp['data'].shape[0] == 33
+        regions = grp['meta']['regions'][:]
+        assert [uuid.decode('utf-8') for uuid in regions['uuid']] == [
+            'region_0', 'region_1', 'region_2']
+        assert json.loads(grp['data'].attrs['TADbit_meta'])['producer'] == 'sample_data'
+
+def test_duplicate_uuid_skipped(tmpdir):
+    """
+    Test that an incremental run skips regions that are already in the file,
+    even from a different source, and regions listed more than once
+    """
+    file_path = str(tmpdir.join('models.hdf5'))
+    sources = _sources(tmpdir, 2)
+    parsing_models.ingest([sources[0][0]], file_path)
+
+    # Same uuid as region_0 but different contents
+    changed = str(tmpdir.join('tadbit', 'sources', 'changed.json'))
+    write_source(changed, 'region_0', seed=10)
+
+    parsing_models.ingest(
+        [changed, sources[0][0], sources[1][0], sources[1][0]], file_path, incremental=True)
+
+    assert _manifest(file_path) == [('region_0', 0, 10), ('region_1', 10, 21)]
+    _check_coords(file_path, sources)
+
+def test_duplicate_uuid_planned_once(tmpdir):
+    """
+    Test that the plan lists each new region once per resolution
+    """
+    file_path = str(tmpdir.join('models.hdf5'))
+    sources = _sources(tmpdir, 2)
+    with h5py.File(file_path, 'a') as h5_file:
+        pending = parsing_models.plan_ingest(
+            [sources[0][0], sources[1][0], sources[0][0]], h5_file, True)
+
+    assert [entry[2] for entry in pending[str(RESOLUTION)]] == ['region_0', 'region_1']
+
+def test_resume_after_failed_region(tmpdir):
+    """
+    Test that a failure part way through a region leaves the committed
+    regions in place and that a repeated incremental run removes what was
+    left behind and appends the remaining regions
+    """
+    file_path = str(tmpdir.join('models.hdf5'))
+    sources = _sources(tmpdir, 3)
+
+    # region_1 fails after its coordinates, statistics and clusters are written
+    with open(sources[1][0]) as source_file:
+        broken = json.load(source_file)
+    del broken['centroids']
+    with open(sources[1][0], 'w') as source_file:
+        json.dump(broken, source_file)
+
+    with pytest.raises(KeyError):
+        parsing_models.ingest(
+            [source[0] for source in sources], file_path, in_place=True)
+
+    assert _manifest(file_path) == [('region_0', 0, 10)]
+    with h5py.File(file_path, 'r') as h5_file:
+        meta = h5_file[str(RESOLUTION)]['meta']
+        assert 'region_1' in meta['clusters']
+        assert 'region_1' in meta['model_stats']
+        assert 'region_1' not in meta['model_params']
+
+    sources[1] = (sources[1][0], write_source(
+        sources[1][0], 'region_1', start=100000, end=200000, beads=11, seed=1))
+    parsing_models.ingest(
+        [source[0] for source in sources], file_path, incremental=True, in_place=True)
+
+    assert _manifest(file_path) == [
+        ('region_0', 0, 10), ('region_1', 10, 21), ('region_2', 21, 33)]
+    _check_coords(file_path, sources)
+    with h5py.File(file_path, 'r') as h5_file:
+        grp = h5_file[str(RESOLUTION)]
+        assert grp['data'].shape[0] == 33
+        assert len(grp['meta']['clusters']['region_1']) == 2
+        assert len(grp['meta']['regions']) == 3
+
+def test_clean_uncommitted(tmpdir):
+    """
+    Test that only the regions missing from the manifest are removed
+    """
+    file_path = str(tmpdir.join('models.hdf5'))
+    sources = _sources(tmpdir, 1)
+    parsing_models.ingest([sources[0][0]], file_path)
+
+    with h5py.File(file_path, 'a') as h5_file:
+        grp = h5_file[str(RESOLUTION)]
+        grp['meta']['clusters'].create_group('orphan')
+        grp['meta']['model_stats'].create_dataset('orphan', data=[0])
+        parsing_models.clean_uncommitted(grp, parsing_models.get_manifest(grp))
+
+        for name in ('clusters', 'model_stats'):
+            assert list(grp['meta'][name]) == ['region_0']
+
+def test_single_resize(tmpdir, monkeypatch):
+    """
+    Test that the `data` dataset is resized once for each resolution however
+    many regions are added
+    """
+    file_path = str(tmpdir.join('models.hdf5'))
+    sources = _sources(tmpdir, 3)
+
+    resized = []
+    resize = h5py.Dataset.resize
+
+    def _resize(dset, size, axis=None):
+        if dset.name.endswith('/data'):
+            resized.append((dset.name, size))
+        return resize(dset, size, axis)
+
+    monkeypatch.setattr(h5py.Dataset, 'resize', _resize)
+
+    parsing_models.ingest([source[0] for source in sources[:2]], file_path)
+    parsing_models.ingest([source[0] for source in sources], file_path, incremental=True)
+
+    assert resized == [
+        ('/' + str(RESOLUTION) + '/data', (21, 1000, 3)),
+        ('/' + str(RESOLUTION) + '/data', (33, 1000, 3)),
+    ]
+
+def test_publish(tmpdir):
+    """
+    Test that a failed run leaves the live file alone, with the partial load
+    in the staging file, and that a successful run replaces the live file so
+    that the shared stores pick up the new version
+    """
+    file_path = str(tmpdir.join('models.hdf5'))
+    sources = _sources(tmpdir, 3)
+    parsing_models.ingest([sources[0][0]], file_path)
+
+    before = os.stat(file_path)
+    with open(file_path, 'rb') as live:
+        contents = live.read()
+    hdf5_store = coord_store.get_store(file_path)
+    try:
+        assert len(hdf5_store.get_index(RESOLUTION)) == 1
+
+        with open(sources[2][0]) as source_file:
+            broken = json.load(source_file)
+        del broken['centroids']
+        with open(sources[2][0], 'w') as source_file:
+            json.dump(broken, source_file)
+
+        with pytest.raises(KeyError):
+            parsing_models.ingest([source[0] for source in sources], file_path, incremental=True)
+
+        assert os.path.isfile(file_path + '.staging')
+        assert _manifest(file_path + '.staging') == [('region_0', 0, 10), ('region_1', 10, 21)]
+        after = os.stat(file_path)
+        assert (after.st_ino, after.st_mtime) == (before.st_ino, before.st_mtime)
+        with open(file_path, 'rb') as live:
+            assert live.read() == contents
+        assert coord_store.get_store(file_path) is hdf5_store
+
+        write_source(sources[2][0], 'region_2', start=200000, end=300000, beads=12, seed=2)
+        parsing_models.ingest([source[0] for source in sources], file_path, incremental=True)
+
+        assert not os.path.exists(file_path + '.staging')
+        assert os.stat(file_path).st_ino != before.st_ino
+        assert _manifest(file_path) == [
+            ('region_0', 0, 10), ('region_1', 10, 21), ('region_2', 21, 33)]
+
+        new_store = coord_store.get_store(file_path)
+        assert new_store is not hdf5_store
+        assert len(new_store.get_index(RESOLUTION)) == 3
+        assert len(hdf5_store.get_index(RESOLUTION)) == 1
+    finally:
+        coord_store.close_stores()
+        hdf5_store.close()
+
+def test_backfill_stats(tmpdir, monkeypatch):
+    """
+    Test that build_model_stats.py adds the same statistics to a file without
+    them as are computed at ingest
+    """
+    file_path = str(tmpdir.join('models.hdf5'))
+    backfill_path = str(tmpdir.join('backfill.hdf5'))
+    sources = _sources(tmpdir, 3)
+    parsing_models.ingest([source[0] for source in sources], file_path)
+
+    shutil.copy2(file_path, backfill_path)
+    with h5py.File(backfill_path, 'a') as h5_file:
+        meta = h5_file[str(RESOLUTION)]['meta']
+        del meta['model_stats']
+        del meta['cluster_stats']
+
+    monkeypatch.setattr('sys.argv', ['build_model_stats.py', '--hdf5', backfill_path])
+    build_model_stats.main()
+    assert not os.path.exists(backfill_path + '.staging')
+
+    with h5py.File(file_path, 'r') as ingested, h5py.File(backfill_path, 'r') as backfilled:
+        meta = ingested[str(RESOLUTION)]['meta']
+        backfill_meta = backfilled[str(RESOLUTION)]['meta']
+        for name in ('model_stats', 'cluster_stats'):
+            assert sorted(backfill_meta[name]) == ['region_0', 'region_1', 'region_2']
+            for region_id in meta[name]:
+                expected = meta[name][region_id][:]
+                found = backfill_meta[name][region_id][:]
+                assert found.dtype == expected.dtype
+                for field in expected.dtype.names:
+                    assert np.allclose(found[field], expected[field]), (name, region_id, field)
@@ -0,0 +1,51 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import loadtest
+
+def test_percentile():
+    """
+    Test the nearest rank percentiles
+    """
+    values = list(range(1, 101))
+    assert loadtest.percentile(values, 50) == 50
+    assert loadtest.percentile(values, 99) == 99
+    assert loadtest.percentile(values, 100) == 100
+    assert loadtest.percentile([], 50) is None
+
+def test_short_sweep(tmpdir):
+    """
+    Test a short sweep against a server running on small fixtures
+    """
+    report = loadtest.run(
+        [1, 2], duration=1, soak=1, sample_every=0.5,
+        fixtures={'files': 2, 'resolutions': [10000], 'regions': 3, 'beads': 20, 'models': 12},
+        profile={'pages_per_region': 2, 'mpp': 5, 'formats': {'json': 1, 'pdb': 1}},
+        threads=4, fixtures_dir=str(tmpdir)
+    )
+
+    assert [level['concurrency'] for level in report['levels']] == [1, 2]
+    for result in report['levels'] + [report['soak']]:
+        assert result['requests'] > 0
+        assert result['error_rate'] == 0
+    endpoints = set()
+    for level in report['levels']:
+        endpoints.update(level['endpoints'])
+    assert set(['resolutions', 'chromosomes', 'regions', 'models', 'model']) <= endpoints
+    assert report['soak']['samples']
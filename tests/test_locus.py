@@ -0,0 +1,67 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+from sample_data import RESOLUTION
+
+LOCUS_URL = '/mug/api/3dcoord/locus?file_id=test&chrom=chr1'
+
+# A second, coarser resolution
+SERVICE_OPTIONS = {
+    'resolutions': [(2 * RESOLUTION, [
+        ('coarse_a', 'chr1', 0, 400000, 10, 3, 1),
+        ('coarse_b', 'chr2', 0, 100000, 5, 2, 1)
+    ])]
+}
+
+def test_locus(service):
+    """
+    Test that the regions for a location are listed at every resolution
+    """
+    details = service.get(LOCUS_URL + '&start=50000&end=150000&models=true')
+    assert [res['resolution'] for res in details['resolutions']] == [RESOLUTION, 2 * RESOLUTION]
+
+    fine, coarse = details['resolutions']
+    assert [region['region_id'] for region in fine['regions']] == ['region_a', 'region_b']
+    assert fine['regions'][0]['models'] == 4
+    assert fine['regions'][0]['clusters'] == 2
+    assert [region['region_id'] for region in coarse['regions']] == ['coarse_a']
+    assert coarse['regions'][0]['start'] == 0
+    assert coarse['regions'][0]['end'] == 400000
+    assert coarse['regions'][0]['_links']['_models'].endswith(
+        'models?file_id=test&res=' + str(2 * RESOLUTION) + '&region=coarse_a')
+
+    models = service.get(coarse['regions'][0]['_links']['_models_all'])
+    assert len(models['models']) == 3
+
+def test_locus_without_models(service):
+    """
+    Test that model counts are left out unless asked for and that
+    resolutions without a matching region are still listed
+    """
+    details = service.get(LOCUS_URL + '&start=250000&end=260000')
+    fine, coarse = details['resolutions']
+    assert fine['regions'] == []
+    assert 'models' not in coarse['regions'][0]
+
+def test_locus_parameters(service):
+    """
+    Test the parameter checks
+    """
+    assert service.get(LOCUS_URL)['error'] == 'MissingParameters'
+    assert service.get(LOCUS_URL + '&start=a&end=10')['error'] == 'IncorrectParameterType'
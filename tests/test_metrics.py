@@ -0,0 +1,99 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import json
+
+from context import app, metrics
+from sample_data import RESOLUTION
+
+MODEL_URL = '/mug/api/3dcoord/model?file_id=test&res=' + str(RESOLUTION) + '&region=region_a&model=all'
+
+# Page budget that fits 2 models of region_a (10 beads x 3 coordinates x 48
+# bytes each)
+SERVICE_OPTIONS = {'config': {'MAX_PAGE_BYTES': 2 * 10 * 3 * 48}}
+
+def test_oversize_page_streamed(service):
+    """
+    Test that a page over the budget is streamed with the same models
+    """
+    details = service.get(MODEL_URL + '&mpp=2')
+    assert 'streamed' not in details['query_data']
+
+    rest_value = service.client.get(MODEL_URL + '&mpp=3', headers=dict(Authorization='Bearer test'))
+    assert rest_value.is_streamed
+    details = json.loads(rest_value.data)
+    assert details['query_data'] == {
+        'model_count': 4, 'page_count': 2, 'page': 1, 'mpp': 3, 'streamed': True}
+    assert details['object']['uuid'] == 'region_a'
+    assert [model['ref'] for model in details['models']] == ['1', '2', '3']
+    assert details['models'][2]['data'] == service.coords['region_a'][:, 2, :].ravel().tolist()
+
+    report = metrics.METRICS.report()
+    assert report['pages_streamed'] == 1
+    assert report['largest_page_bytes'] == 3 * 10 * 3 * 48
+
+def test_oversize_page_cursors(service):
+    """
+    Test that the cursors of a streamed page walk the whole region and lead
+    back to the streamed page
+    """
+    rest_value = service.client.get(MODEL_URL + '&mpp=3', headers=dict(Authorization='Bearer test'))
+    first = json.loads(rest_value.data)
+    assert '_previous_page' not in first['_links']
+    assert first['_links']['_self'].endswith(MODEL_URL + '&mpp=3')
+
+    last = service.get(first['_links']['_next_page'])
+    assert last['query_data']['page'] == 2
+    assert '_next_page' not in last['_links']
+    assert [model['ref'] for model in first['models'] + last['models']] == ['1', '2', '3', '4']
+
+    rest_value = service.client.get(
+        last['_links']['_previous_page'], headers=dict(Authorization='Bearer test'))
+    assert rest_value.is_streamed
+    assert json.loads(rest_value.data)['models'] == first['models']
+
+def test_oversize_page_refused(service):
+    """
+    Test that a page over the budget is refused when streaming is turned off
+    """
+    app.APP.config['OVERSIZE_PAGES'] = 'refuse'
+    rest_value = service.client.get(MODEL_URL + '&mpp=4', headers=dict(Authorization='Bearer test'))
+    assert rest_value.status_code == 413
+    details = json.loads(rest_value.data)
+    assert details['error'] == 'ResponseTooLarge'
+    assert details['provided_parameters']['estimated_bytes'] == 4 * 10 * 3 * 48
+
+def test_page_clamped(service):
+    """
+    Test that mpp below 1 and pages past the end are clamped
+    """
+    details = service.get(MODEL_URL + '&mpp=0&page=1')
+    assert details['query_data']['mpp'] == 1
+
+    details = service.get(MODEL_URL + '&mpp=2&page=50')
+    assert details['query_data']['page'] == 2
+    assert [model['ref'] for model in details['models']] == ['3', '4']
+
+def test_metrics_endpoint(service):
+    """
+    Test that the worker memory is reported
+    """
+    details = service.get('/mug/api/3dcoord/metrics')
+    assert details['memory']['pid'] > 0
+    assert details['memory']['peak_rss_bytes'] > 0
@@ -0,0 +1,111 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import pytest
+
+from context import admission, app, metrics, offload
+from sample_data import RESOLUTION
+
+MODEL_URL = '/mug/api/3dcoord/model?file_id=test&res=' + str(RESOLUTION) + '&region=region_a&model=all'
+
+@pytest.fixture(scope='module')
+def pool():
+    """
+    Offload pool shared by the tests, as starting the processes is slow
+    """
+    pool = offload.Offload(processes=1, max_queue=4)
+    yield pool
+    pool.close()
+
+# Response cache turned off so that every page is built
+SERVICE_OPTIONS = {
+    'config': {'RESPONSE_CACHE_BYTES': 0},
+    'app': {'RESPONSE_CACHE': lambda tmpdir: None}
+}
+
+def _get(local, url):
+    return local.client.get(url, headers=dict(Authorization='Bearer test')).data
+
+def test_offload_page(service, pool):
+    """
+    Test that a page built by the pool is the same as one built in the
+    server process, including the page cursors
+    """
+    expected = _get(service, MODEL_URL + '&mpp=2')
+
+    app.OFFLOAD = pool
+    app.APP.config['OFFLOAD_MIN_BYTES'] = 0
+    assert _get(service, MODEL_URL + '&mpp=2') == expected
+
+    report = service.get('/mug/api/3dcoord/metrics')
+    assert report['offload_pages'] == 1
+    assert report['offload'] == {'processes': 1, 'max_queue': 4, 'queued': 0}
+
+def test_offload_holds_ticket(service):
+    """
+    Test that the admission ticket of an offloaded page is held until the
+    body has been built
+    """
+    app.ADMISSION = admission.AdmissionControl(
+        rate=10, burst=10 ** 9, max_expensive=1, expensive_cost=1, clock=lambda: 1000.0)
+    held = []
+
+    class _Pool(object):
+        """
+        Stand-in pool that checks the read slot and leaves the page to the
+        server process
+        """
+
+        def build_json(self, *args):  # pylint: disable=unused-argument
+            held.append(app.ADMISSION.admit('other', 1)[0] is None)
+
+    expected = _get(service, MODEL_URL + '&mpp=2')
+    app.OFFLOAD = _Pool()
+    app.APP.config['OFFLOAD_MIN_BYTES'] = 0
+    assert _get(service, MODEL_URL + '&mpp=2') == expected
+
+    assert held == [True]
+    assert app.ADMISSION.admit('other', 1)[0] is not None
+
+def test_offload_queue_full(service, pool):
+    """
+    Test that pages are built in the server process when the queue is full
+    """
+    expected = _get(service, MODEL_URL)
+
+    app.OFFLOAD = pool
+    app.APP.config['OFFLOAD_MIN_BYTES'] = 0
+    pool.max_queue = 0
+    try:
+        assert _get(service, MODEL_URL) == expected
+    finally:
+        pool.max_queue = 4
+
+    report = metrics.METRICS.report()
+    assert report['offload_queue_full'] == 1
+    assert 'offload_pages' not in report
+
+def test_offload_small_page(service, pool):
+    """
+    Test that pages under OFFLOAD_MIN_BYTES are built in the server process
+    """
+    app.OFFLOAD = pool
+    details = service.get(MODEL_URL)
+    assert len(details['models']) == 4
+    assert 'offload_pages' not in metrics.METRICS.report()
@@ -0,0 +1,126 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import threading
+
+from context import app, coord_store, metrics, prefetch
+from sample_data import RESOLUTION
+
+BASE_URL = '/mug/api/3dcoord/'
+QUERY = '?file_id=test&res=' + str(RESOLUTION)
+
+def test_prefetch_next_region(service):
+    """
+    Test that listing the models of a region prefetches its neighbours
+    """
+    service.get(BASE_URL + 'models' + QUERY + '&region=region_a')
+    app.PREFETCHER.wait()
+    assert metrics.METRICS.report()['prefetch_done'] == 1
+
+    details = service.get(BASE_URL + 'model' + QUERY + '&region=region_b&model=all')
+    assert details['models'][1]['data'] == service.coords['region_b'][:, 1, :].ravel().tolist()
+
+    report = service.get(BASE_URL + 'metrics')
+    assert report['slab_hits'] == 1
+    assert report['slab_hit_rate'] == 1.0
+
+def test_prefetch_cached_listing(service):
+    """
+    Test that the neighbours are prefetched when the listing comes from the
+    response cache
+    """
+    app.APP.config['PREFETCH_WORKERS'] = 0
+    first = service.get(BASE_URL + 'models' + QUERY + '&region=region_a')
+    assert 'prefetch_queued' not in metrics.METRICS.report()
+
+    app.APP.config['PREFETCH_WORKERS'] = 2
+    assert service.get(BASE_URL + 'models' + QUERY + '&region=region_a') == first
+    app.PREFETCHER.wait()
+    assert metrics.METRICS.report()['prefetch_done'] == 1
+
+def test_prefetch_next_page(service):
+    """
+    Test that the rest of a region is prefetched while it is being paged
+    through
+    """
+    details = service.get(BASE_URL + 'model' + QUERY + '&region=region_a&model=all&mpp=2')
+    app.PREFETCHER.wait()
+
+    # Only the models of the next page are read
+    slab = coord_store.get_store(service.file_path)._cached_slab(  # pylint: disable=protected-access
+        RESOLUTION, 'region_a', [0, 1, 2, 3])
+    assert slab is None
+    slab = coord_store.get_store(service.file_path)._cached_slab(  # pylint: disable=protected-access
+        RESOLUTION, 'region_a', [2, 3])
+    assert slab.shape == (10, 2, 3)
+
+    next_page = service.get(details['_links']['_next_page'])
+    assert [model['ref'] for model in next_page['models']] == ['3', '4']
+    assert next_page['models'][0]['data'] == service.coords['region_a'][:, 2, :].ravel().tolist()
+
+    report = metrics.METRICS.report()
+    assert report['slab_misses'] == 1
+    assert report['slab_hits'] == 1
+
+def test_models_unknown_region(service):
+    """
+    Test that listing the models of an unknown region or resolution is a 404
+    and that nothing is prefetched
+    """
+    for query in (QUERY + '&region=region_x', '?file_id=test&res=20000&region=region_a'):
+        details = service.get(BASE_URL + 'models' + query)
+        assert details['status_code'] == 404
+        assert details['error'] == 'NotFound'
+    assert 'prefetch_queued' not in metrics.METRICS.report()
+
+def test_prefetch_busy():
+    """
+    Test that prefetches are skipped while busy and that queued prefetches
+    are cancelled if the server becomes busy before they start
+    """
+    metrics.METRICS.clear()
+    prefetcher = prefetch.Prefetcher(workers=1, max_pending=4, max_active=1)
+    done = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def block():
+        started.set()
+        release.wait(5)
+
+    try:
+        assert prefetcher.submit('block', block)
+        started.wait(5)
+        assert prefetcher.submit('a', lambda: done.append('a'))
+        assert not prefetcher.submit('a', lambda: done.append('a'))
+
+        prefetcher.request_started()
+        prefetcher.request_started()
+        assert not prefetcher.submit('b', lambda: done.append('b'))
+        release.set()
+        prefetcher.wait()
+    finally:
+        release.set()
+        prefetcher.close()
+
+    assert done == []
+    report = metrics.METRICS.report()
+    assert report['prefetch_skipped'] == 1
+    assert report['prefetch_cancelled'] == 1
+    assert report['prefetch_done'] == 1
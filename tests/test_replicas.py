@@ -0,0 +1,119 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import os
+
+import pytest
+
+from context import app, coord_store, metrics, replicas
+from sample_data import RESOLUTION, create_sample_file
+
+MODEL_URL = '/mug/api/3dcoord/model?file_id=test&res=' + str(RESOLUTION) + '&region=region_a&model='
+
+# Prefetching turned off so that only the requests read the file
+SERVICE_OPTIONS = {'config': {'PREFETCH_WORKERS': 0}}
+
+@pytest.fixture
+def manager(service, tmpdir):
+    """
+    Replica manager that replicates a resolution on its second read
+    """
+    replica_manager = app.start_replicas(str(tmpdir.join('replicas')), hot_reads=2)
+    yield replica_manager
+    coord_store.set_replicas(None)
+    replica_manager.close()
+
+def test_replica_reads(service, manager):
+    """
+    Test that a hot resolution is replicated and read from the replica
+    """
+    service.get(MODEL_URL + '1')
+    service.get(MODEL_URL + '2')
+    manager.wait()
+    assert metrics.METRICS.report()['replica_builds'] == 1
+
+    details = service.get(MODEL_URL + '3')
+    assert details['models'][0]['data'] == service.coords['region_a'][:, 2, :].ravel().tolist()
+    assert metrics.METRICS.report()['replica_reads'] == 1
+
+    report = service.get('/mug/api/3dcoord/metrics')['replicas']
+    assert report['replicas'] == 1
+    assert report['bytes'] == manager.size
+    assert report['building'] == 0
+
+    # Replicas are found again by a new manager
+    assert replicas.ReplicaManager(manager.cache_dir).report()['replicas'] == 1
+
+def test_replica_stale(service, manager):
+    """
+    Test that a replica of a file that has since been replaced is removed
+    """
+    hdf5_store = coord_store.get_store(service.file_path)
+    path = manager.build(service.file_path, hdf5_store.version, RESOLUTION)
+    assert manager.open(service.file_path, hdf5_store.version, RESOLUTION) is not None
+
+    assert manager.open(service.file_path, (0, 0.0), RESOLUTION) is None
+    assert not os.path.exists(path)
+    assert manager.report()['replicas'] == 0
+
+def test_replica_quota(service, manager):
+    """
+    Test that the least recently read replicas are removed to keep within
+    the quota
+    """
+    create_sample_file(service.file_path, resolution=2 * RESOLUTION, mode="a")
+    version = coord_store.file_version(service.file_path)
+
+    first = manager.build(service.file_path, version, RESOLUTION)
+    manager.quota_bytes = int(manager.size * 1.5)
+    second = manager.build(service.file_path, version, 2 * RESOLUTION)
+
+    assert not os.path.exists(first)
+    assert os.path.exists(second)
+    assert manager.report()['replicas'] == 1
+    assert metrics.METRICS.report()['replica_evictions'] == 1
+
+    manager.quota_bytes = manager.size - 1
+    assert manager.build(service.file_path, version, RESOLUTION) is None
+    assert manager.report()['replicas'] == 1
+
+def test_replica_eviction_drops_handles(service, manager):
+    """
+    Test that an evicted replica is no longer read by the stores and that
+    reads made ahead of the clients are not counted
+    """
+    hdf5_store = coord_store.get_store(service.file_path)
+    hdf5_store.prefetch_region(RESOLUTION, 'region_a')
+    hdf5_store.preload(RESOLUTION)
+    assert manager.reads == {}
+
+    service.get(MODEL_URL + '1')
+    service.get(MODEL_URL + '2')
+    manager.wait()
+    service.get(MODEL_URL + '3')
+    assert str(RESOLUTION) in hdf5_store._replica_handles
+
+    manager.quota_bytes = 0
+    manager._evict()
+    assert manager.report()['replicas'] == 0
+    assert hdf5_store._replica_handles == {}
+
+    details = service.get(MODEL_URL + '4')
+    assert details['models'][0]['data'] == service.coords['region_a'][:, 3, :].ravel().tolist()
+    assert metrics.METRICS.report()['replica_reads'] == 1
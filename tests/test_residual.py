@@ -0,0 +1,112 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import numpy as np
+
+from context import residual
+from sample_data import RESOLUTION
+
+MODEL_URL = '/mug/api/3dcoord/model?file_id=test&res=' + str(RESOLUTION) + '&region=region_a'
+
+def test_residual_lossless(service):
+    """
+    Test that the models decode to the same coordinates with a precision of 1
+    """
+    details = service.get(MODEL_URL + '&model=all&encoding=residual')
+    assert details['encoding'] == {'name': 'residual', 'precision': 1}
+
+    # The centroid of cluster n is model n + 1 in the sample data
+    assert [(keyframe['cluster'], keyframe['ref']) for keyframe in details['keyframes']] == \
+        [('0', '1'), ('1', '2')]
+    assert details['models'][0]['residual'] == [0] * 30
+
+    plain = service.get(MODEL_URL + '&model=all')
+    assert residual.decode(details) == plain['models']
+
+def test_residual_centroid_off_page(service):
+    """
+    Test that the centroid is sent as a keyframe when it is not requested
+    """
+    details = service.get(MODEL_URL + '&model=3&encoding=residual')
+    assert [keyframe['ref'] for keyframe in details['keyframes']] == ['1']
+    assert [model['ref'] for model in details['models']] == ['3']
+    assert residual.decode(details)[0]['data'] == \
+        service.coords['region_a'][:, 2, :].ravel().tolist()
+
+def test_residual_quantized(service):
+    """
+    Test that quantised residuals decode to within half the precision and
+    that the encoding is kept by the page cursors
+    """
+    details = service.get(MODEL_URL + '&model=all&mpp=2&encoding=residual&precision=10')
+    assert details['encoding']['precision'] == 10
+    decoded = residual.decode(details)
+    for k, model in enumerate(decoded):
+        original = service.coords['region_a'][:, k, :].ravel()
+        assert np.abs(np.asarray(model['data']) - original).max() <= 5
+
+    next_page = service.get(details['_links']['_next_page'])
+    assert next_page['encoding']['precision'] == 10
+    assert [model['ref'] for model in next_page['models']] == ['3', '4']
+    assert 'keyframes' not in next_page
+    decoded = residual.decode(next_page, details['keyframes'])
+    for k, model in enumerate(decoded):
+        original = service.coords['region_a'][:, k + 2, :].ravel()
+        assert np.abs(np.asarray(model['data']) - original).max() <= 5
+
+def test_residual_keyframes_first_page(service):
+    """
+    Test that the first page carries the keyframes for every cluster of the
+    query and that the pages reached through the cursors refer to them
+    """
+    # Models 1 and 3 are in cluster 0, models 2 and 4 in cluster 1
+    details = service.get(MODEL_URL + '&model=1,3,4&mpp=2&encoding=residual')
+    assert [(keyframe['cluster'], keyframe['ref']) for keyframe in details['keyframes']] == \
+        [('0', '1'), ('1', '2')]
+    assert [model['keyframe'] for model in details['models']] == [0, 0]
+
+    next_page = service.get(details['_links']['_next_page'])
+    assert 'keyframes' not in next_page
+    assert [model['keyframe'] for model in next_page['models']] == [1]
+    assert residual.decode(next_page, details['keyframes'])[0]['data'] == \
+        service.coords['region_a'][:, 3, :].ravel().tolist()
+
+    previous_page = service.get(next_page['_links']['_previous_page'])
+    assert 'keyframes' not in previous_page
+    assert residual.decode(previous_page, details['keyframes']) == residual.decode(details)
+
+    # A page that is asked for directly carries the keyframes
+    second = service.get(MODEL_URL + '&model=1,3,4&mpp=2&page=2&encoding=residual')
+    assert second['keyframes'] == details['keyframes']
+    assert second['models'] == next_page['models']
+
+def test_residual_format_error(service):
+    """
+    Test that the residual encoding is only offered for JSON
+    """
+    details = service.get(MODEL_URL + '&model=all&encoding=residual&format=pdb')
+    assert details['error'] == 'UnsupportedEncoding'
+
+def test_quantize():
+    """
+    Test the rounding of residuals
+    """
+    values = np.array([-15, -6, -5, -4, 0, 4, 5, 6, 15])
+    assert residual.quantize(values, 10).tolist() == [-1, -1, 0, 0, 0, 0, 1, 1, 2]
+    assert residual.quantize(values, 1).tolist() == values.tolist()
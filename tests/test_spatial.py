@@ -0,0 +1,129 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import numpy as np
+import pytest
+
+from context import coord_store, spatial
+from sample_data import RESOLUTION
+
+def test_grid_matches_brute_force():
+    """
+    Test that the box and sphere queries find the same points as checking
+    every point
+    """
+    rng = np.random.RandomState(1)
+    coords = rng.randint(-5000, 5000, size=(200, 7, 3)).astype('int32')
+    points = coords.reshape(-1, 3)
+    grid = spatial.GridIndex(coords)
+
+    for _ in range(20):
+        low = rng.randint(-6000, 4000, size=3)
+        high = low + rng.randint(0, 4000, size=3)
+        expected = np.flatnonzero(((points >= low) & (points <= high)).all(axis=1))
+        assert np.array_equal(grid.query_box(low, high), expected)
+
+        center = rng.randint(-5000, 5000, size=3)
+        radius = rng.randint(0, 3000)
+        expected = np.flatnonzero(((points - center) ** 2).sum(axis=1) <= radius ** 2)
+        assert np.array_equal(grid.query_sphere(center, radius), expected)
+
+def test_group_by_model():
+    """
+    Test that points are split into beads of each model
+    """
+    coords = np.arange(4 * 3 * 3).reshape(4, 3, 3).astype('int32')
+    grid = spatial.GridIndex(coords)
+    groups = grid.group_by_model(np.arange(12), columns=[0, 2])
+
+    assert [group[0] for group in groups] == [0, 2]
+    assert groups[1][1].tolist() == [0, 1, 2, 3]
+    assert np.array_equal(groups[1][2], coords[:, 2, :])
+
+def test_spatial_index_cached(service):
+    """
+    Test that the grid for a region is built once per store
+    """
+    hdf5_store = coord_store.get_store(service.file_path)
+    grid = hdf5_store.get_spatial_index(RESOLUTION, 'region_b')
+    assert hdf5_store.get_spatial_index(RESOLUTION, 'region_b') is grid
+    assert grid.points.shape == (40, 3)
+
+def test_spatial_endpoint(service):
+    """
+    Test the sphere query against the sample file
+    """
+    url = (
+        '/mug/api/3dcoord/spatial?file_id=test&res=' + str(RESOLUTION) +
+        '&region=region_a&model=1,3&center=0,0,0&radius=800'
+    )
+    details = service.get(url)
+
+    coords = service.coords['region_a']
+    expected = 0
+    for model in details['models']:
+        col = int(model['ref']) - 1
+        inside = np.flatnonzero((coords[:, col, :].astype(np.int64) ** 2).sum(axis=1) <= 800 ** 2)
+        assert model['beads'] == inside.tolist()
+        assert model['data'] == coords[inside, col, :].ravel().tolist()
+        expected += len(inside)
+    assert set(model['ref'] for model in details['models']) <= set(['1', '3'])
+    assert details['query_data']['bead_count'] == expected
+
+    details = service.get(
+        '/mug/api/3dcoord/spatial?file_id=test&res=' + str(RESOLUTION) +
+        '&region=region_a&model=all&box=-1000,-1000,-1000,1000,1000,1000')
+    assert details['query_data']['bead_count'] == 40
+
+    details = service.get(
+        '/mug/api/3dcoord/spatial?file_id=test&res=' + str(RESOLUTION) +
+        '&region=region_a&model=all&center=0,0,0')
+    assert details['error'] == 'MissingParameters'
+
+def test_invalid_queries():
+    """
+    Test that the grid rejects bounds that are not finite, inside out boxes
+    and negative radii
+    """
+    grid = spatial.GridIndex(np.zeros((4, 2, 3), dtype='int32'))
+    for low, high in (([0, 0, np.nan], [1, 1, 1]), ([0, 0, 0], [np.inf, 1, 1]), ([2, 0, 0], [1, 1, 1])):
+        with pytest.raises(ValueError):
+            grid.query_box(low, high)
+    for center, radius in (([0, 0, 0], -1), ([0, np.nan, 0], 1), ([0, 0, 0], np.inf)):
+        with pytest.raises(ValueError):
+            grid.query_sphere(center, radius)
+    assert grid.query_sphere([0, 0, 0], 0).tolist() == list(range(8))
+
+def test_spatial_endpoint_errors(service):
+    """
+    Test that unknown regions are a 404 and invalid shapes a 400
+    """
+    url = '/mug/api/3dcoord/spatial?file_id=test&res=' + str(RESOLUTION) + '&model=all'
+    for query, status, error in (
+            ('&region=region_x&center=0,0,0&radius=1', 404, 'NotFound'),
+            ('&region=region_a&center=0,0,nan&radius=1', 400, 'IncorrectParameterType'),
+            ('&region=region_a&center=0,0,0&radius=inf', 400, 'IncorrectParameterType'),
+            ('&region=region_a&center=0,0,0&radius=-1', 400, 'InvalidRange'),
+            ('&region=region_a&box=0,0,0,1,-1,1', 400, 'InvalidRange')):
+        details = service.get(url + query)
+        assert (details['status_code'], details['error']) == (status, error), query
+
+    details = service.get(
+        '/mug/api/3dcoord/spatial?file_id=test&res=1&region=region_a&model=all&box=0,0,0,1,1,1')
+    assert (details['status_code'], details['error']) == (404, 'NotFound')
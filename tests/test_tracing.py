@@ -0,0 +1,113 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import json
+import sys
+
+import pytest
+
+from context import app, tracing
+from sample_data import RESOLUTION
+
+MODEL_URL = '/mug/api/3dcoord/model?file_id=test&res=' + str(RESOLUTION) + '&region=region_a&model=all'
+
+@pytest.fixture
+def trace_file(service, tmpdir):
+    """
+    File that the spans of the app are written to
+    """
+    path = str(tmpdir.join('spans.jsonl'))
+    app.start_tracing('file', path)
+    yield path
+    tracing.configure(None)
+
+def _read_spans(trace_file):
+    with open(trace_file) as handle:
+        return [json.loads(line) for line in handle]
+
+def test_request_spans(service, trace_file):
+    """
+    Test that a request is recorded as a tree of spans in a single trace
+    """
+    service.get(MODEL_URL)
+
+    spans = _read_spans(trace_file)
+    by_name = dict((record['name'], record) for record in spans)
+    root = by_name['GetModel.get']
+    assert root['parent_id'] is None
+    assert root['attributes']['http.url'].endswith(MODEL_URL.split('/', 1)[1])
+    assert set(record['trace_id'] for record in spans) == set([root['trace_id']])
+
+    for name in ['auth.validate', 'catalogue.get_file_path', 'payload.build', 'serialize.json']:
+        assert by_name[name]['parent_id'] == root['span_id']
+    assert by_name['store.get_model_page']['parent_id'] == by_name['payload.build']['span_id']
+    assert by_name['store.get_model_page']['attributes']['bytes_read'] > 0
+    assert by_name['serialize.json']['attributes']['bytes'] > 0
+    assert root['duration_ms'] >= by_name['payload.build']['duration_ms']
+
+def test_streamed_spans(service, trace_file):
+    """
+    Test that the spans of a streamed body are attached to the request span
+    """
+    response = service.client.get(
+        MODEL_URL + '&format=pdb', headers=dict(Authorization='Bearer test'))
+    assert response.data.startswith(b'MODEL')
+    response.close()
+
+    spans = _read_spans(trace_file)
+    by_name = dict((record['name'], record) for record in spans)
+    root = by_name['GetModel.get']
+    assert set(record['trace_id'] for record in spans) == set([root['trace_id']])
+    assert by_name['stream.pdb']['parent_id'] == root['span_id']
+    assert by_name['store.get_model_page']['parent_id'] == by_name['stream.pdb']['span_id']
+    assert by_name['stream.pdb']['start'] <= by_name['store.get_model_page']['start']
+
+def test_span_error():
+    """
+    Test that an exception is recorded on the span and raised
+    """
+    records = []
+    tracer = tracing.JsonTracer(sys.stderr)
+    tracer.export = records.append
+    tracing._TRACER = tracer  # pylint: disable=protected-access
+    try:
+        with pytest.raises(KeyError):
+            with tracing.span('outer'):
+                with tracing.span('inner', region='region_a'):
+                    raise KeyError('region_z')
+    finally:
+        tracing.configure(None)
+
+    assert [record['name'] for record in records] == ['inner', 'outer']
+    assert records[0]['parent_id'] == records[1]['span_id']
+    assert records[0]['attributes']['region'] == 'region_a'
+    assert 'KeyError' in records[0]['attributes']['error']
+
+def test_tracing_off():
+    """
+    Test that spans do nothing until tracing is configured
+    """
+    tracing.configure(None)
+    assert not tracing.enabled()
+    with tracing.span('noop', region='region_a') as current:
+        current.set_attribute('bytes_read', 10)
+    assert tracing.span('other') is current
+
+    with pytest.raises(ValueError):
+        tracing.configure('zipkin')
@@ -0,0 +1,74 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from __future__ import print_function
+
+import json
+
+import pytest
+
+from context import app, coord_store, warmup
+from sample_data import RESOLUTION
+
+@pytest.fixture
+def sample_store(sample_file):
+    """
+    Open a CoordStore on a freshly generated sample file
+    """
+    store = coord_store.CoordStore(sample_file)
+    yield store
+    store.close()
+
+def test_region_index(sample_store):
+    """
+    Test that the region index matches the attributes of the sample file
+    """
+    index = sample_store.get_index(RESOLUTION)
+    assert sample_store.get_resolutions() == [RESOLUTION]
+    assert index.get_chromosomes() == ['chr1', 'chr2']
+    assert index.get_regions('chr1', 150000, 300000) == ['region_b']
+    assert index.get_region_order(region='region_b') == ['region_a', 'region_b']
+    assert index.get_region('region_b')['i'] == 10
+    assert index is sample_store.get_index(RESOLUTION)
+
+def test_warmup_run(sample_store):
+    """
+    Test that a warm-up builds the indexes and preloads the data
+    """
+    state = warmup.Warmup()
+    state.run(
+        lambda file_id: sample_store, [warmup.parse_target('test:' + str(RESOLUTION))],
+        preload_bytes=1024 * 1024
+    )
+    assert state.status == 'ready'
+    assert state.targets_done == 1
+    assert state.bytes_read > 0
+    assert str(RESOLUTION) in sample_store._indexes  # pylint: disable=protected-access
+
+def test_ping_warming():
+    """
+    Test that ping reports that the service is not ready while warming
+    """
+    client = app.APP.test_client()
+    app.WARMUP.status = 'warming'
+    try:
+        rest_value = client.get('/mug/api/3dcoord/ping')
+    finally:
+        app.WARMUP.status = 'ready'
+    details = json.loads(rest_value.data)
+    assert rest_value.status_code == 503
+    assert details['status'] == 'warming'